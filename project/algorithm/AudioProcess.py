@@ -1,109 +1,703 @@
-from transformers import WhisperProcessor, WhisperForConditionalGeneration
-from transformers import AutoTokenizer, AutoModel
-import torch
-import librosa
-import noisereduce as nr
-from pydub import AudioSegment
 import numpy as np
-from scipy.signal import resample
+import functools
+import hashlib
+import itertools
+import json
+import os
+import tempfile
+import time
+from fractions import Fraction
+from math import gcd
+
+try:
+    from . import InferenceBackend
+    from .ModelRegistry import registry
+except ImportError:
+    import InferenceBackend
+    from ModelRegistry import registry
+
+# torch、librosa、noisereduce 和 scipy 在用到的函数内导入，导入本模块时不加载这些库
+
+# Whisper 模型路径
+trans_model_path = r"F:\a\apaper\project\project\algorithm\whisper-small"
+
+# 模型在第一次使用时加载
+def load_whisper_processor():
+    from transformers import WhisperProcessor
+    return WhisperProcessor.from_pretrained(trans_model_path)
+
+def load_whisper_model():
+    if InferenceBackend.use_onnx():
+        return InferenceBackend.whisper_model(trans_model_path, check=check_whisper_parity)
+    from transformers import WhisperForConditionalGeneration
+    return WhisperForConditionalGeneration.from_pretrained(trans_model_path)
+
+registry.register('whisper_processor', load_whisper_processor, path=trans_model_path)
+registry.register('whisper', load_whisper_model, path=trans_model_path)
+MODEL_NAMES = ('whisper_processor', 'whisper')
+
+# 预处理步骤：每一步接收 (audio, sr) 并返回处理后的 float32 数组，能原地修改或返回视图时不复制
 
 # 降噪处理
 def denoise_audio(audio, sr):
+    import noisereduce as nr
     # 提取前 1 秒音频作为噪声样本
     noise_sample = audio[:int(sr * 1)]
     denoised_audio = nr.reduce_noise(y=audio, sr=sr, y_noise=noise_sample)
-    return denoised_audio
+    return denoised_audio.astype(np.float32, copy=False)
+
+# 去除首尾静音片段
+def remove_silence(audio, sr, threshold=0.01, frame_length=2048):
+    """
+    按帧计算 RMS，截掉首尾低于阈值的帧
+    :return: 原数组的切片视图，不复制数据；全部静音时原样返回
+    """
+    frame_count = len(audio) // frame_length
+    if frame_count == 0:
+        return audio
+    frames = audio[:frame_count * frame_length].reshape(frame_count, frame_length)
+    energy = np.sqrt(np.einsum('ij,ij->i', frames, frames) / frame_length)
+    non_silent = np.flatnonzero(energy > threshold)
+    if non_silent.size == 0:
+        return audio
+    # 帧序号换算为采样点位置
+    return audio[non_silent[0] * frame_length:(non_silent[-1] + 1) * frame_length]
 
-# 去除静音片段
-def remove_silence(audio, sr, threshold=0.01):
-    energy = librosa.feature.rms(y=audio)
-    non_silent_indices = np.where(energy > threshold)[1]
-    start = non_silent_indices.min()
-    end = non_silent_indices.max()
-    return audio[start:end]
+# 音量增益，原地修改
+def apply_gain(audio, sr, gain_db=5):
+    audio *= np.float32(10 ** (gain_db / 20))
+    np.clip(audio, -1.0, 1.0, out=audio)
+    return audio
+
+# 提高音调（同时加快语速），与按更高采样率播放再重采样回原采样率等价
+def shift_pitch(audio, sr, factor=1.2):
+    from scipy.signal import resample_poly
+    ratio = Fraction(factor).limit_denominator(100)
+    return resample_poly(audio, ratio.denominator, ratio.numerator).astype(np.float32, copy=False)
 
 # 音频增强
 def enhance_audio(audio, sr):
-    audio_segment = AudioSegment(
-        audio.tobytes(),
-        frame_rate=sr,
-        sample_width=audio.dtype.itemsize,
-        channels=1
-    )
-    # 增加 5dB 音量
-    audio_segment = audio_segment + 5
-    # 提高音调 20%
-    new_frame_rate = int(audio_segment.frame_rate * 1.2)
-    audio_segment = audio_segment._spawn(audio_segment.raw_data, overrides={
-        "frame_rate": new_frame_rate
-    })
-    audio_segment = audio_segment.set_frame_rate(sr)
-    enhanced_audio = np.array(audio_segment.get_array_of_samples())
-    return enhanced_audio
-
-# 重采样，统一采样率
+    # 增加 5dB 音量，提高音调 20%
+    return shift_pitch(apply_gain(audio, sr, 5), sr, 1.2)
+
+# 重采样，统一采样率（多相滤波）
 def resample_audio(audio, sr, target_sr=16000):
+    from scipy.signal import resample_poly
     if sr != target_sr:
-        duration = len(audio) / sr
-        num_samples = int(duration * target_sr)
-        resampled_audio = resample(audio, num_samples)
-        return resampled_audio
+        divisor = gcd(sr, target_sr)
+        return resample_poly(audio, target_sr // divisor, sr // divisor).astype(np.float32, copy=False)
     return audio
 
+# 加载音频：以原始采样率解码为 float32 单声道，再用多相滤波重采样到目标采样率
+def load_audio(audio_path, target_sr=16000):
+    import librosa
+    audio, sr = librosa.load(audio_path, sr=None, mono=True)
+    return resample_audio(audio, sr, target_sr)
+
+# 默认预处理步骤：降噪、去除静音、音频增强
+DEFAULT_STEPS = (denoise_audio, remove_silence, enhance_audio)
 
 # 音频预处理
-def preprocess_audio(audio_path):
-    # 加载音频
-    audio, sr = librosa.load(audio_path)
-    # 降噪
-    audio = denoise_audio(audio, sr)
-    # 去除静音
-    audio = remove_silence(audio, sr)
-    # 音频增强
-    audio = enhance_audio(audio, sr)
-    # 重采样
-    audio = resample_audio(audio, sr)
-    
+def preprocess_audio(audio_path, steps=DEFAULT_STEPS, target_sr=16000):
+    """
+    解码后先统一到目标采样率，之后各步骤都在同一采样率的缓冲区上进行
+    :param audio_path: 音频文件路径
+    :param steps: 预处理步骤序列，可用 functools.partial 调整参数
+    :param target_sr: 目标采样率
+    :return: float32 音频数组
+    """
+    audio = load_audio(audio_path, target_sr)
+    for step in steps:
+        audio = step(audio, target_sr)
     return audio
 
+# 推理设备，有 GPU 时使用 GPU
+def get_device():
+    import torch
+    return torch.device("cuda" if torch.cuda.is_available() else "cpu")
+
+# 把模型放到推理设备上，已在该设备上时不重复移动
+def place_model(model):
+    device = get_device()
+    if model.device.type != device.type:
+        model.to(device)
+    return device
+
+# 解码提示词只与语言和任务有关，缓存后复用
+@functools.lru_cache(maxsize=None)
+def decoder_prompt_ids(processor, language="zh", task="transcribe"):
+    return processor.get_decoder_prompt_ids(language=language, task=task)
+
 # 语音识别
-def transcribe_speech(model, inputs):
+def transcribe_speech(model, audio_input):
+    import torch
+    processor = registry.get('whisper_processor')
     inputs = processor(audio_input, sampling_rate=16000, return_tensors="pt").input_features
     # 将模型和输入数据移动到 GPU（如果可用）
-    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-    model.to(device)
-    inputs = inputs.to(device)
+    inputs = inputs.to(place_model(model))
 
     # 生成转录结果
     with torch.no_grad():
-        forced_decoder_ids = processor.get_decoder_prompt_ids(language="zh", task="transcribe")
-        predicted_ids = model.generate(inputs, forced_decoder_ids=forced_decoder_ids)
+        predicted_ids = model.generate(inputs, forced_decoder_ids=decoder_prompt_ids(processor))
 
     # 解码输出
     transcription = processor.batch_decode(predicted_ids, skip_special_tokens=True)
     print("语音识别结果: ", transcription[0])
+    return transcription[0]
+
+# 批量语音识别
+def transcribe_batch(model, audios, batch_size=16, language="zh"):
+    """
+    多段短音频批量识别：按输入顺序每 batch_size 段一起生成
+    Whisper 的特征提取会把每段音频补齐到 30 秒，批内长度不影响编码开销，因此不按长度分桶
+    :param model: WhisperForConditionalGeneration
+    :param audios: 16kHz 音频数组列表，每段不超过 30 秒
+    :param batch_size: 每次 generate 的音频数
+    :param language: 识别语言
+    :return: 与 audios 顺序一致的转录文本列表
+    """
+    import torch
+    start_time = time.time()
+    processor = registry.get('whisper_processor')
+    device = place_model(model)
+    forced_decoder_ids = decoder_prompt_ids(processor, language)
+
+    transcriptions = []
+    for i in range(0, len(audios), batch_size):
+        inputs = processor(audios[i:i + batch_size], sampling_rate=16000, return_tensors="pt").input_features.to(device)
+        with torch.no_grad():
+            predicted_ids = model.generate(inputs, forced_decoder_ids=forced_decoder_ids)
+        transcriptions.extend(processor.batch_decode(predicted_ids, skip_special_tokens=True))
+
+    elapsed = time.time() - start_time
+    clips_per_sec = len(audios) / elapsed if elapsed > 0 else 0.0
+    print(f"批量语音识别: {len(audios)} 段, 耗时 {elapsed:.2f}s, {clips_per_sec:.2f} 段/秒 (batch_size={batch_size})")
+    return transcriptions
+
+
+# 精度对比用的合成信号：几个谐波叠加少量噪声，固定随机种子保证结果可复现
+def sample_audio(seconds=5, sr=16000):
+    t = np.arange(int(seconds * sr)) / sr
+    audio = sum(np.sin(2 * np.pi * freq * t) / (i + 1) for i, freq in enumerate((220, 440, 660)))
+    audio += np.random.default_rng(0).normal(0, 0.01, t.shape)
+    return (0.1 * audio).astype(np.float32)
+
+def check_whisper_parity(model, audios=None, atol=1e-2, min_agreement=0.95):
+    """
+    对比导出后的 Whisper 与 PyTorch 原模型：以原模型生成的转录作为解码器输入，比较每一步的 logits，
+    Top-1 一致率低于 min_agreement 时抛出 InferenceBackend.ParityError
+    :param audios: 16kHz 音频数组列表，默认使用 sample_audio()
+    """
+    import torch
+    from transformers import WhisperForConditionalGeneration
+    processor = registry.get('whisper_processor')
+    reference = WhisperForConditionalGeneration.from_pretrained(trans_model_path).eval()
+    inputs = processor(audios or [sample_audio()], sampling_rate=16000, return_tensors="pt").input_features
+    with torch.no_grad():
+        tokens = reference.generate(inputs, forced_decoder_ids=decoder_prompt_ids(processor))
+        expected = reference(input_features=inputs, decoder_input_ids=tokens).logits
+        actual = model(input_features=inputs, decoder_input_ids=tokens).logits
+    report = InferenceBackend.compare_outputs(expected.numpy(), actual.cpu().numpy(), atol, min_agreement)
+    return InferenceBackend.report_parity(report)
+
+
+# 长音频转录：Whisper 单次最多处理 30 秒，更长的音频先做语音活动检测（VAD）再分窗口批量识别
+WHISPER_SAMPLE_RATE = 16000
+WHISPER_WINDOW_SECONDS = 30
+
+# 流式读取长音频时每块的时长（秒）
+AUDIO_BLOCK_SECONDS = 30
+
+# 加载长音频：直接以目标采样率（默认 16kHz）单声道解码，不经过整段降噪和增强
+def load_long_audio(audio_path, sr=WHISPER_SAMPLE_RATE):
+    import librosa
+    audio, _ = librosa.load(audio_path, sr=sr, mono=True)
+    return audio
+
+# 基于帧能量的语音活动检测
+def detect_speech(audio, sr, frame_seconds=0.03, threshold_db=-40, min_silence=0.5, min_speech=0.25, padding=0.2):
+    """
+    按帧计算能量，高于 (最大能量 + threshold_db) 的帧视为语音
+    :param audio: 音频数组
+    :param sr: 采样率
+    :param frame_seconds: 帧长（秒）
+    :param threshold_db: 相对最大能量的阈值（dB）
+    :param min_silence: 短于该时长的静音不切分（秒）
+    :param min_speech: 短于该时长的语音片段丢弃（秒）
+    :param padding: 语音片段前后保留的时长（秒）
+    :return: 语音片段列表 [(起始采样点, 结束采样点)]
+    """
+    frame = max(int(sr * frame_seconds), 1)
+    frame_count = len(audio) // frame
+    if frame_count == 0:
+        return [(0, len(audio))] if len(audio) else []
+    frames = audio[:frame_count * frame].reshape(frame_count, frame)
+    energy_db = 10 * np.log10(np.mean(frames ** 2, axis=1) + 1e-10)
+    voiced = energy_db > energy_db.max() + threshold_db
+    # 找出连续语音帧的起止位置
+    edges = np.diff(np.concatenate(([0], voiced.astype(np.int8), [0])))
+    starts = np.flatnonzero(edges == 1)
+    ends = np.flatnonzero(edges == -1)
+
+    segments = []
+    for start, end in zip(starts * frame, ends * frame):
+        if segments and start - segments[-1][1] < min_silence * sr:
+            segments[-1][1] = end
+        else:
+            segments.append([start, end])
+    pad = int(padding * sr)
+    return [
+        (int(max(start - pad, 0)), int(min(end + pad, len(audio))))
+        for start, end in segments if end - start >= min_speech * sr
+    ]
+
+# 把语音片段组合成不超过 30 秒的识别窗口
+def plan_windows(segments, sr, window_seconds=WHISPER_WINDOW_SECONDS, overlap_seconds=2):
+    """
+    相邻语音片段合并到同一窗口；超过窗口长度的片段切成相互重叠的多个窗口
+    :return: 窗口列表 [(起始采样点, 结束采样点, 负责区间起点, 负责区间终点)]，
+             重叠部分以中点为界，识别结果只保留落在各自负责区间内的句子
+    """
+    window = int(window_seconds * sr)
+    overlap = int(overlap_seconds * sr)
+    regions = []
+    for start, end in segments:
+        if regions and end - regions[-1][0] <= window:
+            regions[-1][1] = end
+        else:
+            regions.append([start, end])
+
+    windows = []
+    for start, end in regions:
+        if end - start <= window:
+            windows.append((start, end, start, end))
+            continue
+        stride = window - overlap
+        window_start = start
+        while True:
+            window_end = min(window_start + window, end)
+            own_start = start if window_start == start else window_start + overlap // 2
+            own_end = end if window_end == end else window_end - overlap // 2
+            windows.append((window_start, window_end, own_start, own_end))
+            if window_end == end:
+                break
+            window_start += stride
+    return windows
+
+# 分块读取长音频
+def iter_audio_blocks(audio_path, block_seconds=AUDIO_BLOCK_SECONDS, sr=WHISPER_SAMPLE_RATE):
+    """
+    用 soundfile 分块解码并逐块重采样，内存占用只与块大小有关，与音频时长无关；
+    soundfile 无法读取的格式退回整段解码后再分块
+    :return: 依次生成 float32 单声道音频块
+    """
+    import soundfile as sf
+    try:
+        native_sr = sf.info(audio_path).samplerate
+    except RuntimeError:
+        audio = load_long_audio(audio_path, sr)
+        block = int(block_seconds * sr)
+        for start in range(0, len(audio), block):
+            yield audio[start:start + block]
+        return
+    # 块长取重采样抽取倍数的整数倍，各块重采样后首尾相接，总长度与整段重采样一致
+    down = native_sr // gcd(native_sr, sr)
+    blocksize = max(int(block_seconds * native_sr) // down, 1) * down
+    for block in sf.blocks(audio_path, blocksize=blocksize, dtype='float32', always_2d=True):
+        yield resample_audio(block.mean(axis=1), native_sr, sr)
 
+class StreamingSpeechDetector:
+    """
+    增量语音活动检测：逐块送入音频，语音片段确定后立即返回，参数含义与 detect_speech 相同
+    阈值相对于目前为止的最大帧能量，而不是整段音频的最大能量，最大能量不低于 reference_db（接近语音的能量），
+    避免还没有遇到语音时把开头的静音和底噪判为语音；
+    连续语音超过 max_segment_seconds 时强制切分，需要缓存的音频有上限
+    """
+
+    def __init__(self, sr, frame_seconds=0.03, threshold_db=-40, min_silence=0.5, min_speech=0.25, padding=0.2,
+                 max_segment_seconds=300, reference_db=-20):
+        self.sr = sr
+        self.frame = max(int(sr * frame_seconds), 1)
+        self.threshold_db = threshold_db
+        self.min_silence = min_silence * sr
+        self.min_speech = min_speech * sr
+        self.pad = int(padding * sr)
+        self.max_segment = max_segment_seconds * sr
+        self.max_db = reference_db
+        # 已送入的采样点数，以及已计算能量的完整帧覆盖到的位置
+        self.total = 0
+        self.position = 0
+        self.remainder = np.zeros(0, dtype=np.float32)
+        # 尚未结束的语音片段 [起点, 终点]；已结束但末尾 padding 还没有读到的片段
+        self.segment = None
+        self.closed = []
+
+    def _close(self):
+        start, end = self.segment
+        self.segment = None
+        if end - start >= self.min_speech:
+            self.closed.append((max(start - self.pad, 0), end + self.pad))
+
+    def feed(self, block):
+        """
+        :param block: 音频块
+        :return: 新确定的语音片段 [(起始采样点, 结束采样点)]
+        """
+        self.total += len(block)
+        audio = np.concatenate((self.remainder, block)) if len(self.remainder) else block
+        count = len(audio) // self.frame
+        self.remainder = audio[count * self.frame:]
+        if count:
+            frames = audio[:count * self.frame].reshape(count, self.frame)
+            energy_db = 10 * np.log10(np.mean(frames ** 2, axis=1) + 1e-10)
+            self.max_db = max(self.max_db, float(energy_db.max()))
+            voiced = energy_db > self.max_db + self.threshold_db
+            edges = np.diff(np.concatenate(([0], voiced.astype(np.int8), [0])))
+            starts = self.position + np.flatnonzero(edges == 1) * self.frame
+            ends = self.position + np.flatnonzero(edges == -1) * self.frame
+            for start, end in zip(starts.tolist(), ends.tolist()):
+                if self.segment and start - self.segment[1] < self.min_silence:
+                    self.segment[1] = end
+                else:
+                    if self.segment:
+                        self._close()
+                    self.segment = [start, end]
+                if self.segment[1] - self.segment[0] >= self.max_segment:
+                    self._close()
+            self.position += count * self.frame
+        if self.segment and self.position - self.segment[1] >= self.min_silence:
+            self._close()
+        ready = 0
+        while ready < len(self.closed) and self.closed[ready][1] <= self.total:
+            ready += 1
+        segments, self.closed = self.closed[:ready], self.closed[ready:]
+        return segments
+
+    def finish(self):
+        """
+        音频结束：返回剩余的语音片段，终点截断到音频末尾
+        """
+        if self.segment:
+            self._close()
+        segments = [(start, min(end, self.total)) for start, end in self.closed]
+        self.closed = []
+        return segments
+
+    def pending_start(self):
+        # 之后返回的片段都不会早于该采样点，之前的音频可以丢弃
+        starts = [start for start, _ in self.closed[:1]]
+        if self.segment:
+            starts.append(self.segment[0] - self.pad)
+        starts.append(self.position - self.pad)
+        return max(min(starts), 0)
+
+# 流式分窗
+def iter_speech_windows(blocks, detector, window_seconds=WHISPER_WINDOW_SECONDS, overlap_seconds=2):
+    """
+    逐块做语音活动检测，相邻片段按 plan_windows 的规则合并为区域，下一个片段无法并入时该区域即确定并切分为窗口，
+    只缓存尚未输出的区域所需的音频
+    :param blocks: 音频块的可迭代对象，例如 iter_audio_blocks 的返回值
+    :param detector: StreamingSpeechDetector，结束后 detector.total 为音频总采样点数
+    :return: 依次生成 (窗口音频, 起始采样点, 结束采样点, 负责区间起点, 负责区间终点)
+    """
+    sr = detector.sr
+    window = int(window_seconds * sr)
+    buffer = np.zeros(0, dtype=np.float32)
+    buffer_start = 0
+    region = None
+    blocks = iter(blocks)
+    finished = False
+    while not finished:
+        block = next(blocks, None)
+        if block is None:
+            finished = True
+            segments = detector.finish()
+        else:
+            buffer = np.concatenate((buffer, block))
+            segments = detector.feed(block)
+        ready = []
+        for start, end in segments:
+            if region and end - region[0] <= window:
+                region[1] = end
+            else:
+                if region:
+                    ready.append(region)
+                region = [start, end]
+        if finished and region:
+            ready.append(region)
+        for start, end, own_start, own_end in plan_windows(ready, sr, window_seconds, overlap_seconds):
+            yield buffer[start - buffer_start:end - buffer_start].copy(), start, end, own_start, own_end
+        # 丢弃之后不再需要的音频
+        keep = min(region[0], detector.pending_start()) if region else detector.pending_start()
+        if keep > buffer_start:
+            buffer = buffer[keep - buffer_start:]
+            buffer_start = keep
+
+# 长音频语音识别
+def transcribe_long(model, audio_path, batch_size=8, language="zh", **vad_options):
+    """
+    流式解码音频并增量做 VAD，窗口确定后按 30 秒窗口批量送入 model.generate，按时间戳拼接重叠窗口的结果；
+    内存中只保留尚未识别的音频，与音频时长无关
+    :param model: WhisperForConditionalGeneration
+    :param audio_path: 音频文件路径
+    :param batch_size: 每次 generate 的窗口数
+    :param language: 识别语言
+    :param vad_options: 透传给 StreamingSpeechDetector 的参数
+    :return: 转录文本、带时间戳的句子和实时率（处理耗时 / 音频时长）
+    """
+    import torch
+    start_time = time.time()
+    processor = registry.get('whisper_processor')
+    sr = WHISPER_SAMPLE_RATE
+    detector = StreamingSpeechDetector(sr, **vad_options)
+    windows = iter_speech_windows(iter_audio_blocks(audio_path, sr=sr), detector)
+
+    device = place_model(model)
+    time_precision = processor.feature_extractor.chunk_length / model.config.max_source_positions
+
+    segments = []
+    window_count = 0
+    while True:
+        batch = list(itertools.islice(windows, batch_size))
+        if not batch:
+            break
+        window_count += len(batch)
+        inputs = processor(
+            [audio for audio, _, _, _, _ in batch], sampling_rate=sr, return_tensors="pt"
+        ).input_features.to(device)
+        with torch.no_grad():
+            predicted_ids = model.generate(inputs, language=language, task="transcribe", return_timestamps=True)
+        decoded = processor.batch_decode(
+            predicted_ids, skip_special_tokens=True, output_offsets=True, time_precision=time_precision
+        )
+        for (_, start, end, own_start, own_end), result in zip(batch, decoded):
+            offsets = result.get('offsets') or [{'text': result['text'], 'timestamp': (0.0, (end - start) / sr)}]
+            for offset in offsets:
+                text = offset['text'].strip()
+                seg_start, seg_end = offset['timestamp']
+                seg_start = start / sr + (seg_start or 0.0)
+                seg_end = start / sr + seg_end if seg_end is not None else end / sr
+                # 重叠窗口中同一句话会被识别两次，按句子中点归属到负责该时间段的窗口
+                if text and own_start / sr <= (seg_start + seg_end) / 2 < own_end / sr:
+                    segments.append({'start': round(seg_start, 2), 'end': round(seg_end, 2), 'text': text})
+
+    duration = detector.total / sr
+    elapsed = time.time() - start_time
+    rtf = elapsed / duration if duration else 0.0
+    print(f"长音频识别: 时长 {duration:.1f}s, {window_count} 个窗口, 耗时 {elapsed:.1f}s, 实时率 {rtf:.3f}")
+    return {
+        'transcription': ''.join(segment['text'] for segment in segments),
+        'segments': segments,
+        'duration': round(duration, 2),
+        'real_time_factor': round(rtf, 4),
+    }
+
+
+# 声学特征：STFT 只计算一次，所有特征共用同一个幅度谱
+# top_db 与 librosa 默认参数一致：计算 MFCC 前，对数梅尔谱低于整段最大值 top_db 的部分截断
+FEATURE_PARAMS = {'sr': 16000, 'n_fft': 2048, 'hop_length': 512, 'n_mfcc': 13, 'n_mels': 128, 'top_db': 80.0}
+DEFAULT_FEATURES = ('mfcc', 'spectral_centroid', 'spectral_bandwidth', 'spectral_flatness')
+
+# 各特征由幅度谱 S 逐块计算，返回 (特征维数, 帧数)
+def mfcc_feature(S, params):
+    # 分块时只计算对数梅尔谱；top_db 截断需要整段的最大值，全部分块完成后由 finish_mfcc 换算为 MFCC
+    import librosa
+    mel = librosa.feature.melspectrogram(S=S ** 2, sr=params['sr'], n_fft=params['n_fft'], n_mels=params['n_mels'])
+    return librosa.power_to_db(mel, top_db=None)
+
+def finish_mfcc(log_mel, max_db, params):
+    import librosa
+    return librosa.feature.mfcc(S=np.maximum(log_mel, max_db - params['top_db']), n_mfcc=params['n_mfcc'])
+
+def spectral_centroid_feature(S, params):
+    import librosa
+    return librosa.feature.spectral_centroid(S=S, sr=params['sr'], n_fft=params['n_fft'])
+
+def spectral_bandwidth_feature(S, params):
+    import librosa
+    return librosa.feature.spectral_bandwidth(S=S, sr=params['sr'], n_fft=params['n_fft'])
+
+def spectral_flatness_feature(S, params):
+    import librosa
+    return librosa.feature.spectral_flatness(S=S)
+
+def rms_feature(S, params):
+    import librosa
+    return librosa.feature.rms(S=S, frame_length=params['n_fft'])
+
+FEATURE_EXTRACTORS = {
+    'mfcc': mfcc_feature,
+    'spectral_centroid': spectral_centroid_feature,
+    'spectral_bandwidth': spectral_bandwidth_feature,
+    'spectral_flatness': spectral_flatness_feature,
+    'rms': rms_feature,
+}
+
+# 需要整段统计量的特征：finish(分块结果, 整段最大值, params) 返回最终结果，按帧逐段换算
+FEATURE_FINISHERS = {
+    'mfcc': finish_mfcc,
+}
+
+# 流式分块计算幅度谱
+def iter_spectrogram_blocks(blocks, n_fft, hop_length, block_frames):
+    """
+    逐块读入音频，每凑够 block_frames 帧的采样点就计算一次幅度谱，音频首尾按居中 STFT 的方式补零，
+    结果与对整段音频做居中 STFT（pad_mode='constant'）逐帧一致；只缓存尚未计算的帧所需的采样点
+    :param blocks: 音频块的可迭代对象，例如 iter_audio_blocks 的返回值；整段音频可传入 [audio]
+    :return: 依次生成 (起始帧号, 幅度谱)
+    """
+    import librosa
+    pad = n_fft // 2
+    # buffer[0] 对应的采样点位置，开头补 pad 个零
+    buffer = np.zeros(pad, dtype=np.float32)
+    buffer_start = -pad
+    first = 0
+    total_samples = 0
+
+    def spectrum(first, last):
+        start = first * hop_length - pad - buffer_start
+        end = (last - 1) * hop_length - pad + n_fft - buffer_start
+        return np.abs(librosa.stft(buffer[start:end], n_fft=n_fft, hop_length=hop_length, center=False))
+
+    for block in blocks:
+        buffer = np.concatenate((buffer, block))
+        total_samples += len(block)
+        available = buffer_start + len(buffer)
+        # 窗口完全落在已读入音频中的帧可以先计算
+        while (first + block_frames - 1) * hop_length - pad + n_fft <= available:
+            yield first, spectrum(first, first + block_frames)
+            first += block_frames
+        keep = first * hop_length - pad
+        buffer = buffer[keep - buffer_start:]
+        buffer_start = keep
+
+    # 音频结束：剩余的帧末尾补零
+    total = 1 + total_samples // hop_length
+    needed = (total - 1) * hop_length - pad + n_fft - buffer_start
+    if needed > len(buffer):
+        buffer = np.pad(buffer, (0, needed - len(buffer)))
+    while first < total:
+        last = min(first + block_frames, total)
+        yield first, spectrum(first, last)
+        first = last
 
 # 提取声学特征
+def extract_features(blocks, features=DEFAULT_FEATURES, block_frames=2048, allocate=None, spool_dir=None, **params):
+    """
+    流式分块计算幅度谱并提取多个特征，内存占用只与块大小有关，与音频时长无关：
+    各块的结果先按帧顺序写入临时文件（较小时留在内存中），音频读完、总帧数确定后再写入结果数组
+    :param blocks: 音频块的可迭代对象；整段音频可传入 [audio]
+    :param features: 特征名称，见 FEATURE_EXTRACTORS
+    :param block_frames: 每块帧数
+    :param allocate: allocate(name, shape) 返回用于保存结果的数组，可返回内存映射文件，默认分配内存
+    :param spool_dir: 临时文件目录
+    :param params: 覆盖 FEATURE_PARAMS 中的参数
+    :return: {特征名称: (特征维数, 帧数) float32 数组}
+    """
+    params = {**FEATURE_PARAMS, **params}
+    if allocate is None:
+        allocate = lambda name, shape: np.empty(shape, dtype=np.float32)
+    spools = {name: tempfile.SpooledTemporaryFile(max_size=64 * 1024 ** 2, dir=spool_dir) for name in features}
+    dims = {}
+    max_values = dict.fromkeys(features, -np.inf)
+    total = 0
+    try:
+        for first, S in iter_spectrogram_blocks(blocks, params['n_fft'], params['hop_length'], block_frames):
+            for name in features:
+                values = FEATURE_EXTRACTORS[name](S, params).astype(np.float32, copy=False)
+                dims[name] = values.shape[0]
+                max_values[name] = max(max_values[name], float(values.max()))
+                spools[name].write(np.ascontiguousarray(values.T).tobytes())
+            total = first + S.shape[1]
+
+        results = {}
+        for name in features:
+            spool = spools[name]
+            spool.seek(0)
+            finish = FEATURE_FINISHERS.get(name)
+            # 按块读回并转置为 (特征维数, 帧数)，需要整段统计量的特征在这里换算
+            for first in range(0, total, block_frames):
+                count = min(block_frames, total - first)
+                values = np.frombuffer(spool.read(count * dims[name] * 4), dtype=np.float32).reshape(count, dims[name]).T
+                if finish is not None:
+                    values = finish(values, max_values[name], params)
+                if name not in results:
+                    results[name] = allocate(name, (values.shape[0], total))
+                results[name][:, first:first + count] = values
+        return results
+    finally:
+        for spool in spools.values():
+            spool.close()
+
 def analyze_acoustic_features(audio, sr):
-    # 提取 MFCC 特征
-    mfccs = librosa.feature.mfcc(y=audio, sr=sr, n_mfcc=13)
-    # 提取频谱中analyze_audio_features心频率
-    spectral_centroids = librosa.feature.spectral_centroid(y=audio, sr=sr)
-    # 提取频谱带宽
-    spectral_bandwidth = librosa.feature.spectral_bandwidth(y=audio, sr=sr)
-    # 提取频谱平坦度
-    spectral_flatness = librosa.feature.spectral_flatness(y=audio)
+    features = extract_features([audio], sr=sr)
+    # MFCC、频谱质心、频谱带宽、频谱平坦度
+    return tuple(features[name] for name in DEFAULT_FEATURES)
+
+class FeatureStore:
+    """
+    声学特征存储：按 文件哈希 + 特征参数 分目录，每个特征保存为一个 .npy 文件，读取时使用内存映射
+    """
+
+    def __init__(self, root):
+        self.root = root
 
-    return mfccs,spectral_centroids,spectral_bandwidth,spectral_flatness
+    def directory(self, file_hash, params):
+        key = hashlib.sha1(json.dumps(params, sort_keys=True).encode()).hexdigest()[:16]
+        return os.path.join(self.root, file_hash[:2], file_hash, key)
 
+    def load(self, file_hash, features=DEFAULT_FEATURES, **params):
+        """
+        读取已保存的特征，数据按需从磁盘读取
+        :return: {特征名称: 只读内存映射数组}，有特征未保存时返回 None
+        """
+        directory = self.directory(file_hash, {**FEATURE_PARAMS, **params})
+        paths = {name: os.path.join(directory, f'{name}.npy') for name in features}
+        if not all(os.path.exists(path) for path in paths.values()):
+            return None
+        return {name: np.load(path, mmap_mode='r') for name, path in paths.items()}
 
+    def extract(self, file_hash, audio_path, features=DEFAULT_FEATURES, block_frames=2048, **params):
+        """
+        流式解码音频并提取尚未保存的特征，结果直接写入内存映射文件，内存占用与音频时长无关
+        :return: 同 load
+        """
+        params = {**FEATURE_PARAMS, **params}
+        directory = self.directory(file_hash, params)
+        missing = [name for name in features if not os.path.exists(os.path.join(directory, f'{name}.npy'))]
+        if missing:
+            os.makedirs(directory, exist_ok=True)
+            # 每次提取使用各自的临时文件，同一文件的并发提取不会写入同一个内存映射
+            tmp_paths = {}
+
+            def allocate(name, shape):
+                fd, tmp_paths[name] = tempfile.mkstemp(dir=directory, prefix=f'{name}.', suffix='.npy.tmp')
+                os.close(fd)
+                return np.lib.format.open_memmap(tmp_paths[name], mode='w+', dtype=np.float32, shape=shape)
+
+            try:
+                blocks = iter_audio_blocks(audio_path, sr=params['sr'])
+                arrays = extract_features(blocks, missing, block_frames, allocate, spool_dir=directory, **params)
+                for array in arrays.values():
+                    array.flush()
+                del arrays
+                # 写完后再改名，读取方不会看到不完整的文件
+                for name in missing:
+                    os.replace(tmp_paths.pop(name), os.path.join(directory, f'{name}.npy'))
+                fd, params_path = tempfile.mkstemp(dir=directory, prefix='params.', suffix='.json.tmp')
+                with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                    json.dump(params, f)
+                os.replace(params_path, os.path.join(directory, 'params.json'))
+            finally:
+                for path in tmp_paths.values():
+                    os.remove(path)
+        return self.load(file_hash, features, **params)
 
 if __name__ == "__main__":
-    trans_model_path=r"F:\a\apaper\project\project\algorithm\whisper-small"
-    # 加载处理器和模型
-    processor = WhisperProcessor.from_pretrained(trans_model_path)
-    trans_model = WhisperForConditionalGeneration.from_pretrained(trans_model_path)
+    import librosa
+
+    # 加载模型
+    trans_model = registry.get('whisper')
 
     # 读取音频文件
     audio_path = "common_voice_zh-CN_40970484.wav"
@@ -1,99 +1,288 @@
-from ultralytics import YOLO
-import supervision as sv
 from PIL import Image
 import numpy as np
-import matplotlib.pyplot as plt
-import torch
-from torchvision import models, transforms
+import functools
+import itertools
 import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
 
-# 定义图像预处理函数
-def preprocess_image(image):
-    preprocess = transforms.Compose([
+try:
+    from . import InferenceBackend
+    from .ModelRegistry import registry
+except ImportError:
+    import InferenceBackend
+    from ModelRegistry import registry
+
+# torch、torchvision 和 supervision 在用到的函数内导入，导入本模块时不加载这些库
+
+# ImageNet 标签文件与检测模型权重，与本脚本放在同一目录
+IMAGENET_LABELS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'imagenet_classes.txt')
+detect_model_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'yolov8m.pt')
+
+# 模型在第一次使用时加载
+def load_detect_model():
+    from ultralytics import YOLO
+    if InferenceBackend.use_onnx():
+        return InferenceBackend.yolo_model(detect_model_path, YOLO, check=check_detect_parity)
+    return YOLO(detect_model_path)
+
+def build_classify_model():
+    from torchvision import models
+    classify_model = models.resnet50(pretrained=True)
+    classify_model.eval()  # 设置为评估模式
+    return classify_model
+
+def load_classify_model():
+    if InferenceBackend.use_onnx():
+        # 只在导出时构建 PyTorch 模型，导出和精度对比共用同一个实例；已有导出结果时不加载 PyTorch 模型
+        reference = functools.lru_cache(maxsize=None)(build_classify_model)
+        return InferenceBackend.onnx_module(
+            'resnet50', reference, (4, 3, 224, 224),
+            check=lambda module: check_classify_parity(module, reference=reference())
+        )
+    return build_classify_model()
+
+registry.register('yolov8m', load_detect_model, path=detect_model_path)
+registry.register('resnet50', load_classify_model, version='torchvision-IMAGENET1K_V1')
+MODEL_NAMES = ('resnet50', 'yolov8m')
+
+# 分类预处理只构建一次；裁剪为固定大小，便于多张图像组成一个批次
+@functools.lru_cache(maxsize=None)
+def classify_transform():
+    from torchvision import transforms
+    return transforms.Compose([
         transforms.Resize(224),
+        transforms.CenterCrop(224),
         transforms.ToTensor(),
         transforms.Normalize(mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225])
     ])
-    image_tensor = preprocess(image)
-    image_tensor = image_tensor.unsqueeze(0)  # 添加一个维度以匹配模型输入要求
 
+# 加载 ImageNet 标签，只读取一次
+@functools.lru_cache(maxsize=None)
+def load_imagenet_labels():
+    with open(IMAGENET_LABELS_PATH) as f:
+        return [line.strip() for line in f.readlines()]
+
+# 保存预处理后的图像，用于调试
+def save_preprocessed_image(image_tensor, path):
+    from torchvision import transforms
     # 反归一化
     unnormalize = transforms.Normalize(
         mean=[-0.485 / 0.229, -0.456 / 0.224, -0.406 / 0.225],
         std=[1 / 0.229, 1 / 0.224, 1 / 0.225]
     )
-    unnormalized_tensor = unnormalize(image_tensor.squeeze(0))
-    # 将张量转换为 PIL 图像
-    to_pil = transforms.ToPILImage()
-    pil_image = to_pil(unnormalized_tensor)
-    # 保存为 PNG 格式
-    pil_image.save('preprocessed_image.png')
+    # 将张量转换为 PIL 图像后保存
+    transforms.ToPILImage()(unnormalize(image_tensor)).save(path)
 
-    return image_tensor
+# 定义图像预处理函数
+def preprocess_image(image, debug_path=None):
+    image_tensor = classify_transform()(image)
+    if debug_path:
+        save_preprocessed_image(image_tensor, debug_path)
+    return image_tensor.unsqueeze(0)  # 添加一个维度以匹配模型输入要求
 
 # 定义图像分类函数
-def classify_image(model, image):
-    image_tensor = preprocess_image(image)
+def classify_image(model, image, debug_path=None):
+    import torch
+    image_tensor = preprocess_image(image, debug_path)
     with torch.no_grad():
         output = model(image_tensor)
     _, predicted = torch.max(output, 1)
-    # 加载 ImageNet 标签
-    with open('imagenet_classes.txt') as f:
-        imagenet_labels = [line.strip() for line in f.readlines()]
-    return imagenet_labels[predicted.item()]
+    return load_imagenet_labels()[predicted.item()]
 
-def object_detection(image):
-    image = np.array(image)
+# 读取并预处理单张图像，无法读取时返回 None
+def load_classify_tensor(source):
+    try:
+        image = source if isinstance(source, Image.Image) else Image.open(source)
+        return classify_transform()(image.convert('RGB'))
+    except (OSError, ValueError):
+        return None
 
-    # 进行推理
-    results = detect_model(source=image, conf=0.25, verbose=False)[0]
-    detections = sv.Detections.from_ultralytics(results)
-
-    category_dict = {
-        0: 'person', 1: 'bicycle', 2: 'car', 3: 'motorcycle', 4: 'airplane', 5: 'bus',
-        6: 'train', 7: 'truck', 8: 'boat', 9: 'traffic light', 10: 'fire hydrant',
-        11: 'stop sign', 12: 'parking meter', 13: 'bench', 14: 'bird', 15: 'cat',
-        16: 'dog', 17: 'horse', 18: 'sheep', 19: 'cow', 20: 'elephant', 21: 'bear',
-        22: 'zebra', 23: 'giraffe', 24: 'backpack', 25: 'umbrella', 26: 'handbag',
-        27: 'tie', 28: 'suitcase', 29: 'frisbee', 30: 'skis', 31: 'snowboard',
-        32: 'sports ball', 33: 'kite', 34: 'baseball bat', 35: 'baseball glove',
-        36: 'skateboard', 37: 'surfboard', 38: 'tennis racket', 39: 'bottle',
-        40: 'wine glass', 41: 'cup', 42: 'fork', 43: 'knife', 44: 'spoon', 45: 'bowl',
-        46: 'banana', 47: 'apple', 48: 'sandwich', 49: 'orange', 50: 'broccoli',
-        51: 'carrot', 52: 'hot dog', 53: 'pizza', 54: 'donut', 55: 'cake',
-        56: 'chair', 57: 'couch', 58: 'potted plant', 59: 'bed', 60: 'dining table',
-        61: 'toilet', 62: 'tv', 63: 'laptop', 64: 'mouse', 65: 'remote', 66: 'keyboard',
-        67: 'cell phone', 68: 'microwave', 69: 'oven', 70: 'toaster', 71: 'sink',
-        72: 'refrigerator', 73: 'book', 74: 'clock', 75: 'vase', 76: 'scissors',
-        77: 'teddy bear', 78: 'hair drier', 79: 'toothbrush'
-    }
-
-    detection_results = []
-    for class_id, confidence, xyxy in zip(detections.class_id, detections.confidence, detections.xyxy):
-        label = category_dict[class_id]
-        result = {
-            "label": label,
+# 精度对比默认使用 ultralytics 自带的样例图像
+def sample_images():
+    from ultralytics.utils import ASSETS
+    return sorted(str(path) for path in ASSETS.glob('*.jpg'))
+
+def check_classify_parity(model, images=None, reference=None):
+    """
+    用真实图像对比导出后的分类模型与 PyTorch 原模型，不一致时抛出 InferenceBackend.ParityError
+    :param images: 图像路径列表，默认使用 sample_images()
+    :param reference: PyTorch 原模型，为 None 时重新加载
+    """
+    import torch
+    from torchvision import models
+    if reference is None:
+        reference = models.resnet50(pretrained=True).eval()
+    tensors = [load_classify_tensor(source) for source in images or sample_images()]
+    inputs = torch.stack([tensor for tensor in tensors if tensor is not None])
+    return InferenceBackend.check_parity(reference, model, inputs)
+
+def check_detect_parity(model, images=None):
+    """
+    对比导出后的检测模型与原 .pt 模型的检测框，不一致时抛出 InferenceBackend.ParityError
+    """
+    from ultralytics import YOLO
+    return InferenceBackend.check_detection_parity(YOLO(detect_model_path), model, images or sample_images())
+
+# 批量图像分类
+def classify_images(model, images, batch_size=32, top_k=5, workers=None):
+    """
+    多线程解码和预处理图像，按批送入分类模型；模型推理当前批次时线程池已在解码下一批
+    :param model: 分类模型
+    :param images: 图像路径或 PIL 图像的可迭代对象
+    :param batch_size: 每批图像数
+    :param top_k: 每张图像返回的候选类别数
+    :param workers: 解码线程数
+    :return: 与 images 顺序一致的列表，每项为 [{'label', 'score'}]，无法读取的图像为 None
+    """
+    import torch
+    start = time.time()
+    labels = load_imagenet_labels()
+    sources = iter(images)
+    results = []
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        def submit_batch():
+            return [executor.submit(load_classify_tensor, source) for source in itertools.islice(sources, batch_size)]
+
+        futures = submit_batch()
+        while futures:
+            next_futures = submit_batch()
+            tensors = [future.result() for future in futures]
+            batch_results = [None] * len(tensors)
+            valid = [i for i, tensor in enumerate(tensors) if tensor is not None]
+            if valid:
+                with torch.no_grad():
+                    probs = torch.softmax(model(torch.stack([tensors[i] for i in valid])), dim=1)
+                scores, class_ids = probs.topk(top_k, dim=1)
+                for i, row_scores, row_ids in zip(valid, scores.tolist(), class_ids.tolist()):
+                    batch_results[i] = [
+                        {'label': labels[class_id], 'score': round(score, 4)}
+                        for score, class_id in zip(row_scores, row_ids)
+                    ]
+            results.extend(batch_results)
+            futures = next_futures
+
+    elapsed = time.time() - start
+    images_per_sec = len(results) / elapsed if elapsed > 0 else 0.0
+    print(f"图像分类: {len(results)} 张, 耗时 {elapsed:.2f}s, {images_per_sec:.2f} 张/秒 (batch_size={batch_size})")
+    return results
+
+# 把检测结果转换为记录列表，类别名称使用模型自带的 names
+def detection_records(detections, names):
+    return [
+        {
+            "label": names[int(class_id)],
             "confidence": float(confidence),
             "bbox": xyxy.tolist()
         }
-        detection_results.append(result)
+        for class_id, confidence, xyxy in zip(detections.class_id, detections.confidence, detections.xyxy)
+    ]
+
+def object_detection(image, output_path=None):
+    import supervision as sv
+    detect_model = registry.get('yolov8m')
+    # 进行推理
+    results = detect_model(source=image, conf=0.25, verbose=False)[0]
+    detection_results = detection_records(sv.Detections.from_ultralytics(results), detect_model.names)
 
-    # 保存为 JSON 文件
-    with open('detection_results.json', 'w') as f:
-        json.dump(detection_results, f, indent=4)
+    # 指定路径时保存为 JSON 文件
+    if output_path:
+        with open(output_path, 'w') as f:
+            json.dump(detection_results, f, indent=4)
 
     return detection_results
 
+# 读取单张图像，无法读取时返回 None
+def load_detect_image(source):
+    try:
+        image = source if isinstance(source, Image.Image) else Image.open(source)
+        return image.convert('RGB')
+    except (OSError, ValueError):
+        return None
+
+# 批量目标检测
+def detect_objects(model, images, batch_size=16, workers=None, conf=0.25):
+    """
+    多线程解码图像，按批送入 YOLO；模型推理当前批次时线程池已在解码下一批
+    :param model: YOLO 模型
+    :param images: 图像路径或 PIL 图像的可迭代对象，可以是流式生成器
+    :param batch_size: 每批图像数
+    :param workers: 解码线程数
+    :param conf: 置信度阈值
+    :return: 按输入顺序依次生成 sv.Detections，无法读取的图像生成 None
+    """
+    import supervision as sv
+    start = time.time()
+    count = 0
+    sources = iter(images)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        def submit_batch():
+            return [executor.submit(load_detect_image, source) for source in itertools.islice(sources, batch_size)]
+
+        futures = submit_batch()
+        while futures:
+            next_futures = submit_batch()
+            decoded = [future.result() for future in futures]
+            valid = [image for image in decoded if image is not None]
+            results = iter(model(source=valid, conf=conf, verbose=False) if valid else [])
+            for image in decoded:
+                yield None if image is None else sv.Detections.from_ultralytics(next(results))
+            count += len(decoded)
+            futures = next_futures
+
+    elapsed = time.time() - start
+    images_per_sec = count / elapsed if elapsed > 0 else 0.0
+    print(f"目标检测: {count} 张, 耗时 {elapsed:.2f}s, {images_per_sec:.2f} 张/秒 (batch_size={batch_size})")
+
+class ColumnarDetectionWriter:
+    """
+    把一批图像的检测结果按列保存为一个 .npz 文件：每个检测框一行，
+    file_ids / class_ids / confidences / boxes 各为一列，另存文件列表和类别名称
+    """
+
+    def __init__(self, path, names):
+        self.path = path
+        self.names = names
+        self.files = []
+        self.columns = {'file_ids': [], 'class_ids': [], 'confidences': [], 'boxes': []}
+
+    def add(self, file_id, file_name, detections):
+        self.files.append((file_id, file_name))
+        count = len(detections)
+        self.columns['file_ids'].append(np.full(count, file_id, dtype=np.int64))
+        self.columns['class_ids'].append(np.asarray(detections.class_id, dtype=np.int32))
+        self.columns['confidences'].append(np.asarray(detections.confidence, dtype=np.float32))
+        self.columns['boxes'].append(np.asarray(detections.xyxy, dtype=np.float32).reshape(-1, 4))
+
+    def close(self):
+        columns = {
+            name: np.concatenate(values) if values else np.empty((0, 4) if name == 'boxes' else 0)
+            for name, values in self.columns.items()
+        }
+        # 先写临时文件再改名，并发运行时读取方不会看到写了一半的文件
+        tmp_path = f'{self.path}.{os.getpid()}.tmp'
+        try:
+            with open(tmp_path, 'wb') as f:
+                np.savez_compressed(
+                    f,
+                    file_table_ids=np.array([file_id for file_id, _ in self.files], dtype=np.int64),
+                    file_table_names=np.array([file_name for _, file_name in self.files]),
+                    names=np.array([self.names[i] for i in sorted(self.names)]),
+                    **columns
+                )
+            os.replace(tmp_path, self.path)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
 
 if __name__ == "__main__":
     image = Image.open('banana.jpg')
 
-    detect_model = YOLO('yolov8m.pt')
-    classify_model = models.resnet50(pretrained=True)
-    classify_model.eval()  # 设置为评估模式
+    classify_model = registry.get('resnet50')
 
     # 进行图像分类
-    predicted_label = classify_image(classify_model, image)
+    predicted_label = classify_image(classify_model, image, debug_path='preprocessed_image.png')
     print(f"预测的类别是: {predicted_label}")
 
-    object_detection(image)
+    object_detection(image, output_path='detection_results.json')
@@ -0,0 +1,283 @@
+import os
+import shutil
+import tempfile
+import time
+
+import numpy as np
+
+# 推理后端配置：torch 为 PyTorch 原生推理，onnx 为 ONNX Runtime，onnx-int8 为 ONNX Runtime + 动态 INT8 量化
+# 可通过环境变量设置，工作进程启动时也会用 Django settings 覆盖
+config = {
+    'backend': os.environ.get('INFERENCE_BACKEND', 'torch'),
+    'intra_op_threads': int(os.environ.get('INFERENCE_INTRA_OP_THREADS') or 0) or None,
+    'inter_op_threads': int(os.environ.get('INFERENCE_INTER_OP_THREADS') or 1),
+    # 导出和量化后的模型保存目录，导出一次后重复使用
+    'cache_dir': os.environ.get('ONNX_CACHE_DIR') or os.path.join(os.path.dirname(os.path.abspath(__file__)), 'onnx'),
+}
+
+BACKENDS = ('torch', 'onnx', 'onnx-int8')
+
+
+def use_onnx():
+    if config['backend'] not in BACKENDS:
+        raise ValueError(f"未知的推理后端: {config['backend']}")
+    return config['backend'] != 'torch'
+
+
+def use_int8():
+    return config['backend'] == 'onnx-int8'
+
+
+def session_options():
+    """
+    ONNX Runtime 会话参数：算子内并行线程数与算子间并行线程数
+    多进程部署时应把 intra_op_threads 设为 CPU 核数 / 进程数，避免线程争抢
+    """
+    import onnxruntime as ort
+    options = ort.SessionOptions()
+    options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+    if config['intra_op_threads']:
+        options.intra_op_num_threads = config['intra_op_threads']
+    options.inter_op_num_threads = config['inter_op_threads']
+    return options
+
+
+def create_session(path):
+    import onnxruntime as ort
+    return ort.InferenceSession(path, sess_options=session_options(), providers=['CPUExecutionProvider'])
+
+
+class OnnxModule:
+    """
+    包装 ONNX Runtime 会话，调用方式与 PyTorch 模型相同：传入 torch 张量时返回 torch 张量
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.session = create_session(path)
+        self.input_name = self.session.get_inputs()[0].name
+
+    def __call__(self, inputs):
+        is_tensor = hasattr(inputs, 'detach')
+        array = inputs.detach().cpu().numpy() if is_tensor else np.asarray(inputs)
+        output = self.session.run(None, {self.input_name: array.astype(np.float32, copy=False)})[0]
+        if is_tensor:
+            import torch
+            return torch.from_numpy(output)
+        return output
+
+    def eval(self):
+        return self
+
+
+def model_path(name, extension='.onnx'):
+    suffix = '-int8' if use_int8() else ''
+    return os.path.join(config['cache_dir'], f'{name}{suffix}{extension}')
+
+
+# 动态量化的算子：ONNX Runtime 的 CPU 后端没有 INT8 权重的 ConvInteger 内核，卷积被量化后模型无法加载，
+# 因此只量化 MatMul / Gemm，卷积保持 FP32
+QUANTIZED_OP_TYPES = ('MatMul', 'Gemm')
+
+
+def quantize_file(source, destination, op_types=QUANTIZED_OP_TYPES):
+    # 动态 INT8 量化：权重离线量化为 INT8，激活值在推理时动态量化，不需要校准数据
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+    quantize_dynamic(source, destination, op_types_to_quantize=list(op_types), weight_type=QuantType.QInt8)
+
+
+class ParityError(Exception):
+    # 导出或量化后的模型与 PyTorch 模型输出不一致
+    pass
+
+
+def compare_outputs(expected, actual, atol=1e-2, min_agreement=1.0):
+    """
+    对比两组输出（最后一维为类别或词表），最大误差不超过 atol 或 Top-1 一致率不低于 min_agreement 时通过
+    :return: {'max_abs_diff', 'top1_agreement', 'passed'}
+    """
+    expected = np.asarray(expected, dtype=np.float32)
+    actual = np.asarray(actual, dtype=np.float32)
+    if expected.shape != actual.shape:
+        raise ParityError(f'输出形状不一致: {expected.shape} != {actual.shape}')
+    max_abs_diff = float(np.abs(expected - actual).max()) if expected.size else 0.0
+    top1_agreement = float(np.mean(expected.argmax(axis=-1) == actual.argmax(axis=-1))) if expected.size else 1.0
+    return {
+        'max_abs_diff': max_abs_diff,
+        'top1_agreement': top1_agreement,
+        'passed': max_abs_diff <= atol or top1_agreement >= min_agreement,
+    }
+
+
+def report_parity(report):
+    """
+    打印对比结果，未通过时抛出 ParityError
+    """
+    status = '通过' if report['passed'] else '存在偏差'
+    message = f"最大误差 {report['max_abs_diff']:.5f}, Top-1 一致率 {report['top1_agreement']:.2%}"
+    print(f'精度对比{status}: {message}')
+    if not report['passed']:
+        raise ParityError(message)
+    return report
+
+
+def check_parity(reference, candidate, inputs, atol=1e-2, min_agreement=1.0):
+    """
+    对比 PyTorch 与 ONNX 的输出，不一致时抛出 ParityError
+    :param reference: PyTorch 模型
+    :param candidate: OnnxModule
+    :param inputs: 输入张量
+    :return: {'max_abs_diff', 'top1_agreement', 'passed'}
+    """
+    import torch
+    with torch.no_grad():
+        expected = reference(inputs).cpu().numpy()
+    actual = candidate(inputs.cpu().numpy())
+    return report_parity(compare_outputs(expected, actual, atol, min_agreement))
+
+
+def verify_export(model, path, check):
+    """
+    对新导出的模型做精度对比，不一致时删除导出结果再抛出 ParityError，避免之后直接加载有偏差的模型
+    :param check: 接收导出后模型的对比函数，为 None 时不对比
+    """
+    if check is None:
+        return model
+    try:
+        check(model)
+    except ParityError:
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+        elif os.path.exists(path):
+            os.remove(path)
+        raise
+    return model
+
+
+def onnx_module(name, load_model, input_shape, check=None):
+    """
+    把 PyTorch 模型导出为 ONNX（批大小可变），按配置量化，并与 PyTorch 输出做精度对比
+    已有导出结果时直接加载，不构建 PyTorch 模型
+    :param name: 模型名称，决定导出文件名
+    :param load_model: 返回处于 eval 模式的 PyTorch 模型的函数，只在需要导出时调用
+    :param input_shape: 示例输入的形状，用于导出；未指定 check 时也用于精度对比
+    :param check: 精度对比函数，接收导出后的 OnnxModule
+    :return: OnnxModule
+    """
+    fp32_path = os.path.join(config['cache_dir'], f'{name}.onnx')
+    path = model_path(name)
+    if not os.path.exists(path):
+        import torch
+        model = load_model()
+        sample_input = torch.randn(*input_shape)
+        os.makedirs(config['cache_dir'], exist_ok=True)
+        if not os.path.exists(fp32_path):
+            torch.onnx.export(
+                model, sample_input, fp32_path, input_names=['input'], output_names=['output'],
+                dynamic_axes={'input': {0: 'batch'}, 'output': {0: 'batch'}}, opset_version=17,
+            )
+        if path != fp32_path:
+            quantize_file(fp32_path, path)
+        if check is None:
+            check = lambda module: check_parity(model, module, sample_input)
+        return verify_export(OnnxModule(path), path, check)
+    return OnnxModule(path)
+
+
+def yolo_model(weights_path, model_class, check=None):
+    """
+    YOLO 系列模型通过 ultralytics 自带的导出功能转换为 ONNX，加载后由 ultralytics 调用 ONNX Runtime 推理，
+    调用方式与原模型相同
+    ultralytics 自行创建 ONNX Runtime 会话且不接受会话参数，intra_op_threads / inter_op_threads 对 YOLO 模型不生效，
+    其线程数由 ultralytics 和 ONNX Runtime 的默认值决定；多进程部署时需通过进程数或 CPU 亲和性限制
+    :param weights_path: .pt 权重路径
+    :param model_class: YOLO / YOLOv10 类
+    :param check: 精度对比函数，接收导出后的模型，只在新导出时调用
+    """
+    name = os.path.splitext(os.path.basename(weights_path))[0]
+    fp32_path = os.path.join(config['cache_dir'], f'{name}.onnx')
+    path = model_path(name)
+    if not os.path.exists(path):
+        os.makedirs(config['cache_dir'], exist_ok=True)
+        if not os.path.exists(fp32_path):
+            exported = model_class(weights_path).export(format='onnx', dynamic=True)
+            shutil.move(exported, fp32_path)
+        if path != fp32_path:
+            quantize_file(fp32_path, path)
+        return verify_export(model_class(path, task='detect'), path, check)
+    return model_class(path, task='detect')
+
+
+def check_detection_parity(reference, candidate, images, iou_threshold=0.5, min_matched_ratio=0.9, **predict_options):
+    """
+    对比两个 YOLO 模型在同一批图像上的检测结果，参考结果中能匹配上的框比例低于 min_matched_ratio 时抛出 ParityError
+    :param predict_options: 推理参数，例如 imgsz
+    :return: {'count_agreement', 'matched_ratio', 'passed'}：检测框数量一致的图像比例，参考结果中能匹配上的框比例
+    """
+    same_count = matched = total = 0
+    results = zip(reference(images, verbose=False, **predict_options), candidate(images, verbose=False, **predict_options))
+    for expected, actual in results:
+        expected_boxes = expected.boxes.xyxy.cpu().numpy()
+        actual_boxes = actual.boxes.xyxy.cpu().numpy()
+        same_count += len(expected_boxes) == len(actual_boxes)
+        total += len(expected_boxes)
+        if len(expected_boxes) and len(actual_boxes):
+            matched += int((box_iou(expected_boxes, actual_boxes).max(axis=1) >= iou_threshold).sum())
+    report = {
+        'count_agreement': same_count / len(images) if len(images) else 1.0,
+        'matched_ratio': matched / total if total else 1.0,
+    }
+    report['passed'] = report['matched_ratio'] >= min_matched_ratio
+    message = f"数量一致率 {report['count_agreement']:.2%}, 框匹配率 {report['matched_ratio']:.2%}（{total} 个框）"
+    print(f"检测精度对比{'通过' if report['passed'] else '存在偏差'}: {message}")
+    if not report['passed']:
+        raise ParityError(message)
+    return report
+
+
+def box_iou(boxes_a, boxes_b):
+    top_left = np.maximum(boxes_a[:, None, :2], boxes_b[None, :, :2])
+    bottom_right = np.minimum(boxes_a[:, None, 2:], boxes_b[None, :, 2:])
+    intersection = np.prod(np.clip(bottom_right - top_left, 0, None), axis=2)
+    area_a = np.prod(boxes_a[:, 2:] - boxes_a[:, :2], axis=1)
+    area_b = np.prod(boxes_b[:, 2:] - boxes_b[:, :2], axis=1)
+    return intersection / (area_a[:, None] + area_b[None, :] - intersection + 1e-9)
+
+
+def quantize_dir(source, destination):
+    """
+    量化导出目录中的每个 ONNX 文件，其余文件原样复制；在同一父目录下的临时目录中完成后整体改名，
+    之前中途失败留下的临时目录不影响本次量化
+    """
+    parent = os.path.dirname(destination)
+    tmp_root = tempfile.mkdtemp(dir=parent, prefix=os.path.basename(destination) + '.')
+    tmp_dir = os.path.join(tmp_root, 'model')
+    try:
+        shutil.copytree(source, tmp_dir, ignore=shutil.ignore_patterns('*.onnx', '*.onnx_data'))
+        for filename in os.listdir(source):
+            if filename.endswith('.onnx'):
+                quantize_file(os.path.join(source, filename), os.path.join(tmp_dir, filename))
+        os.replace(tmp_dir, destination)
+    finally:
+        shutil.rmtree(tmp_root)
+
+
+def whisper_model(pretrained_path, check=None):
+    """
+    Whisper 通过 optimum 导出为编码器、解码器两个 ONNX 模型，返回的模型同样支持 generate
+    INT8 模式下对导出目录中的每个 ONNX 文件做动态量化
+    :param check: 精度对比函数，接收导出后的模型，只在新导出时调用
+    """
+    from optimum.onnxruntime import ORTModelForSpeechSeq2Seq
+    name = os.path.basename(os.path.normpath(pretrained_path))
+    fp32_dir = os.path.join(config['cache_dir'], name)
+    path = model_path(name, extension='')
+    exported = not os.path.exists(path)
+    if not os.path.exists(fp32_dir):
+        start = time.time()
+        ORTModelForSpeechSeq2Seq.from_pretrained(pretrained_path, export=True).save_pretrained(fp32_dir)
+        print(f'模型 {name} 导出为 ONNX，耗时 {time.time() - start:.1f}s')
+    if path != fp32_dir and not os.path.exists(path):
+        quantize_dir(fp32_dir, path)
+    model = ORTModelForSpeechSeq2Seq.from_pretrained(path, session_options=session_options())
+    return verify_export(model, path, check) if exported else model
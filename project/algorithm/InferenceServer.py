@@ -0,0 +1,270 @@
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future, TimeoutError
+from importlib import import_module
+from multiprocessing.connection import Client, Listener
+
+try:
+    from .ModelRegistry import registry
+except ImportError:
+    from ModelRegistry import registry
+
+
+def _algorithm(name):
+    # 与其他算法模块一致：既可作为 algorithm 包导入，也可在本目录直接运行
+    return import_module(f'{__package__}.{name}' if __package__ else name)
+
+
+# 各任务的批处理函数：输入列表 -> 等长的结果列表
+def classify_task(inputs):
+    ImageProcess = _algorithm('ImageProcess')
+    return ImageProcess.classify_images(registry.get('resnet50'), inputs, batch_size=len(inputs))
+
+
+def detect_task(inputs):
+    ImageProcess = _algorithm('ImageProcess')
+    model = registry.get('yolov8m')
+    return [
+        None if detections is None else ImageProcess.detection_records(detections, model.names)
+        for detections in ImageProcess.detect_objects(model, inputs, batch_size=len(inputs))
+    ]
+
+
+def transcribe_task(inputs):
+    AudioProcess = _algorithm('AudioProcess')
+    return AudioProcess.transcribe_batch(registry.get('whisper'), inputs, batch_size=len(inputs))
+
+
+def transcribe_long_task(inputs):
+    # 输入为 (音频路径, 每次 generate 的窗口数)，窗口已在单个文件内部成批
+    AudioProcess = _algorithm('AudioProcess')
+    return [AudioProcess.transcribe_long(registry.get('whisper'), path, batch_size=batch_size) for path, batch_size in inputs]
+
+
+# 任务名称 -> (批处理函数, 最大批大小, 用到的模型)
+# PDF 和视频按文件整体处理，无法与其他请求合批，仍在调度器的各个工作进程中并行运行，不经过推理服务
+TASKS = {
+    'classify': (classify_task, 32, ('ImageProcess', ('resnet50',))),
+    'detect': (detect_task, 16, ('ImageProcess', ('yolov8m',))),
+    'transcribe': (transcribe_task, 16, ('AudioProcess', ('whisper_processor', 'whisper'))),
+    'transcribe_long': (transcribe_long_task, 1, ('AudioProcess', ('whisper_processor', 'whisper'))),
+}
+
+
+class InferenceError(Exception):
+    pass
+
+
+class DynamicBatcher:
+    """
+    动态批处理：收到第一个请求后最多等待 max_latency 秒，期间到达的请求合并为一批，
+    批满 max_batch_size 时立即执行；每个任务一个后台线程，用到相同模型的任务共用 lock，
+    模型同一时刻只被一个线程调用
+    """
+
+    def __init__(self, name, handler, max_batch_size, max_latency, lock=None):
+        self.name = name
+        self.handler = handler
+        self.max_batch_size = max_batch_size
+        self.max_latency = max_latency
+        self.lock = lock or threading.Lock()
+        self.queue = queue.Queue()
+        self.batches = 0
+        self.items = 0
+        self.busy_time = 0.0
+        threading.Thread(target=self._run, name=f'batcher-{name}', daemon=True).start()
+
+    def submit(self, item):
+        future = Future()
+        self.queue.put((item, future))
+        return future
+
+    def _collect(self):
+        batch = [self.queue.get()]
+        deadline = time.monotonic() + self.max_latency
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(self.queue.get(timeout=timeout))
+            except queue.Empty:
+                break
+        return batch
+
+    def _execute(self, batch):
+        """
+        执行一批请求并设置每个请求的结果；处理函数返回的结果少于请求数时，没有结果的请求设置异常
+        """
+        with self.lock:
+            outputs = list(self.handler([item for item, _ in batch]))
+        for (_, future), output in zip(batch, outputs):
+            future.set_result(output)
+        for _, future in batch[len(outputs):]:
+            future.set_exception(InferenceError(f'{self.name} 只返回了 {len(outputs)} 个结果，请求数为 {len(batch)}'))
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            start = time.time()
+            try:
+                self._execute(batch)
+            except Exception as e:
+                if len(batch) == 1:
+                    batch[0][1].set_exception(e)
+                else:
+                    # 一个输入出错会让整批失败，逐个重试，只让出错的请求失败，不影响同批的其他请求
+                    for request in batch:
+                        try:
+                            self._execute([request])
+                        except Exception as e:
+                            request[1].set_exception(e)
+            self.batches += 1
+            self.items += len(batch)
+            self.busy_time += time.time() - start
+
+    def stats(self):
+        return {
+            'batches': self.batches,
+            'items': self.items,
+            'mean_batch_size': self.items / self.batches if self.batches else 0.0,
+            'queued': self.queue.qsize(),
+            'busy_time': round(self.busy_time, 2),
+        }
+
+
+class InferenceServer:
+    """
+    本地推理服务：模型只在本进程加载一次，所有 Web 进程和后台工作进程通过 InferenceClient 调用，
+    并发请求按任务合并为动态批次
+    """
+
+    def __init__(self, address, authkey, tasks=None, max_latency=0.01, max_batch_size=None, timeout=600):
+        """
+        :param address: Unix socket 路径，或 (host, port)
+        :param authkey: 连接认证密钥（bytes）
+        :param tasks: 启用的任务，默认全部
+        :param max_latency: 凑批的最长等待时间（秒）
+        :param max_batch_size: 覆盖各任务的最大批大小上限
+        :param timeout: 单个请求等待结果的最长时间（秒），超时后返回错误
+        """
+        self.address = address
+        self.authkey = authkey
+        self.tasks = list(tasks or TASKS)
+        self.timeout = timeout
+        self.batchers = {}
+        # 用到相同模型的任务（如 transcribe 和 transcribe_long）共用一把锁
+        locks = {}
+        for name in self.tasks:
+            handler, batch_size, models = TASKS[name]
+            if max_batch_size:
+                batch_size = min(batch_size, max_batch_size)
+            lock = locks.setdefault(models, threading.Lock())
+            self.batchers[name] = DynamicBatcher(name, handler, batch_size, max_latency, lock)
+
+    def preload(self):
+        for name in self.tasks:
+            module_name, model_names = TASKS[name][2]
+            _algorithm(module_name)
+            registry.preload(*model_names)
+
+    def serve_forever(self):
+        if isinstance(self.address, str) and os.path.exists(self.address):
+            # 清理上次异常退出留下的 socket 文件
+            os.remove(self.address)
+        with Listener(self.address, authkey=self.authkey) as listener:
+            print(f'推理服务已启动: {self.address}，任务: {", ".join(self.tasks)}')
+            while True:
+                try:
+                    connection = listener.accept()
+                except (OSError, EOFError) as e:
+                    # 认证失败等错误只影响该连接
+                    print(f'连接失败: {e}')
+                    continue
+                threading.Thread(target=self._handle, args=(connection,), daemon=True).start()
+
+    def _handle(self, connection):
+        with connection:
+            while True:
+                try:
+                    request = connection.recv()
+                except (EOFError, OSError):
+                    return
+                try:
+                    connection.send(self._dispatch(request))
+                except (EOFError, OSError):
+                    return
+
+    def _dispatch(self, request):
+        task = request.get('task')
+        if task == 'stats':
+            return {'results': {name: batcher.stats() for name, batcher in self.batchers.items()}}
+        if task not in self.batchers:
+            return {'error': f'未启用的任务: {task}'}
+        # 请求中的每个输入单独排队，可以与其他连接的请求合并为同一批
+        futures = [self.batchers[task].submit(item) for item in request['inputs']]
+        deadline = time.monotonic() + self.timeout
+        try:
+            return {'results': [future.result(timeout=max(deadline - time.monotonic(), 0)) for future in futures]}
+        except TimeoutError:
+            return {'error': f'{task} 超过 {self.timeout} 秒未返回结果'}
+        except Exception as e:
+            return {'error': f'{type(e).__name__}: {e}'}
+
+
+class InferenceClient:
+    """
+    推理服务客户端，每个线程使用独立的连接，连接断开时自动重连一次
+    """
+
+    def __init__(self, address, authkey):
+        self.address = address
+        self.authkey = authkey
+        self._local = threading.local()
+
+    def _connection(self):
+        if getattr(self._local, 'connection', None) is None:
+            self._local.connection = Client(self.address, authkey=self.authkey)
+        return self._local.connection
+
+    def _reset(self):
+        connection = getattr(self._local, 'connection', None)
+        self._local.connection = None
+        if connection is not None:
+            connection.close()
+
+    def call(self, task, inputs):
+        """
+        :param task: 任务名称，见 TASKS
+        :param inputs: 输入列表
+        :return: 与输入等长的结果列表
+        """
+        request = {'task': task, 'inputs': list(inputs)}
+        for attempt in range(2):
+            try:
+                connection = self._connection()
+                connection.send(request)
+                response = connection.recv()
+                break
+            except (EOFError, OSError):
+                # 推理服务重启后旧连接失效
+                self._reset()
+                if attempt:
+                    raise
+        if 'error' in response:
+            raise InferenceError(response['error'])
+        return response['results']
+
+    def classify(self, images):
+        return self.call('classify', images)
+
+    def detect(self, images):
+        return self.call('detect', images)
+
+    def transcribe(self, audios):
+        return self.call('transcribe', audios)
+
+    def stats(self):
+        return self.call('stats', [])
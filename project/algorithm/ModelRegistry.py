@@ -0,0 +1,179 @@
+import gc
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+
+def _rss():
+    # 当前进程常驻内存，未安装 psutil 时返回 None
+    if psutil is None:
+        return None
+    return psutil.Process(os.getpid()).memory_info().rss
+
+
+def estimate_memory(model):
+    """
+    估算模型占用的内存：优先统计 torch 参数和缓冲区大小
+    :param model: 已加载的模型
+    :return: 字节数，无法估算时返回 None
+    """
+    for target in (model, getattr(model, 'model', None)):
+        if target is not None and hasattr(target, 'parameters') and hasattr(target, 'buffers'):
+            try:
+                tensors = list(target.parameters()) + list(target.buffers())
+                return sum(t.numel() * t.element_size() for t in tensors)
+            except (TypeError, AttributeError):
+                continue
+    return None
+
+
+class ModelRegistry:
+    """
+    进程内模型注册表：模型在第一次使用时加载，之后常驻并在同一进程的所有请求、任务间共享
+    设置 max_memory 后，超出预算时按最近最少使用（LRU）的顺序卸载其他模型
+    """
+
+    def __init__(self, max_memory=None):
+        self.max_memory = max_memory
+        self._loaders = {}
+        # name -> (版本号, 权重路径)，用于计算模型指纹
+        self._versions = {}
+        # name -> {'model', 'memory', 'load_time', 'last_used'}，按最近使用排序
+        self._models = OrderedDict()
+        self._lock = threading.Lock()
+        self._load_locks = {}
+
+    def register(self, name, loader, version=None, path=None):
+        """
+        注册模型加载函数，注册时不会加载模型
+        :param name: 模型名称
+        :param loader: 无参数的加载函数，返回模型对象
+        :param version: 模型版本号
+        :param path: 模型权重文件或目录，权重更新后模型指纹随之变化
+        """
+        with self._lock:
+            self._loaders[name] = loader
+            self._versions[name] = (version, path)
+            self._load_locks.setdefault(name, threading.Lock())
+
+    def fingerprint(self, name):
+        """
+        模型指纹：版本号加上权重文件的大小和修改时间，不需要加载模型
+        """
+        version, path = self._versions.get(name, (None, None))
+        parts = [str(version or '')]
+        if path and os.path.isdir(path):
+            for dirpath, _, filenames in sorted(os.walk(path)):
+                for filename in sorted(filenames):
+                    stat = os.stat(os.path.join(dirpath, filename))
+                    parts.append(f'{os.path.relpath(os.path.join(dirpath, filename), path)}:{stat.st_size}:{stat.st_mtime_ns}')
+        elif path and os.path.exists(path):
+            stat = os.stat(path)
+            parts.append(f'{stat.st_size}:{stat.st_mtime_ns}')
+        return hashlib.sha1('|'.join(parts).encode()).hexdigest()[:16]
+
+    def get(self, name):
+        """
+        获取模型，未加载时先加载
+        """
+        with self._lock:
+            if name in self._models:
+                self._models.move_to_end(name)
+                entry = self._models[name]
+                entry['last_used'] = time.time()
+                return entry['model']
+            if name not in self._loaders:
+                raise KeyError(f'未注册的模型: {name}')
+            load_lock = self._load_locks[name]
+
+        # 每个模型单独加锁，避免并发请求重复加载同一个模型，也不阻塞其他模型的读取
+        with load_lock:
+            with self._lock:
+                if name in self._models:
+                    return self._models[name]['model']
+            rss_before = _rss()
+            start = time.time()
+            model = self._loaders[name]()
+            load_time = time.time() - start
+            memory = estimate_memory(model)
+            if memory is None and rss_before is not None:
+                memory = max(_rss() - rss_before, 0)
+            with self._lock:
+                self._models[name] = {
+                    'model': model,
+                    'memory': memory or 0,
+                    'load_time': load_time,
+                    'last_used': time.time(),
+                }
+                self._evict_over_budget(keep=name)
+            print(f'模型 {name} 加载完成，耗时 {load_time:.1f}s，约占用 {(memory or 0) / 1024 ** 2:.0f}MB')
+            return model
+
+    def preload(self, *names):
+        """
+        显式预加载模型，例如在工作进程启动时调用
+        """
+        for name in names:
+            self.get(name)
+
+    def evict(self, name):
+        """
+        卸载模型，下次使用时重新加载
+        """
+        with self._lock:
+            evicted = self._models.pop(name, None) is not None
+        if evicted:
+            self._release_memory()
+
+    def _evict_over_budget(self, keep):
+        # 调用方需持有 self._lock
+        if not self.max_memory:
+            return
+        evicted = False
+        for name in list(self._models):
+            if self.memory_usage() <= self.max_memory:
+                break
+            if name == keep:
+                continue
+            del self._models[name]
+            evicted = True
+            print(f'内存超出预算，卸载模型 {name}')
+        if evicted:
+            self._release_memory()
+
+    def _release_memory(self):
+        gc.collect()
+        try:
+            import torch
+            if torch.cuda.is_available():
+                torch.cuda.empty_cache()
+        except ImportError:
+            pass
+
+    def memory_usage(self):
+        return sum(entry['memory'] for entry in self._models.values())
+
+    def stats(self):
+        """
+        已加载模型的内存与使用情况
+        """
+        with self._lock:
+            return {
+                name: {
+                    'memory': entry['memory'],
+                    'load_time': entry['load_time'],
+                    'last_used': entry['last_used'],
+                }
+                for name, entry in self._models.items()
+            }
+
+
+# 进程内共享的注册表；内存预算可通过环境变量 MODEL_REGISTRY_MAX_MEMORY（字节）设置
+registry = ModelRegistry(max_memory=int(os.environ.get('MODEL_REGISTRY_MAX_MEMORY') or 0) or None)
@@ -1,14 +1,27 @@
 import fitz  # PyMuPDF
 import numpy as np
 from PIL import Image
-from doclayout_yolo import YOLOv10
-import supervision as sv
-from paddleocr import PaddleOCR
+import atexit
+import functools
+import itertools
 import json
+import multiprocessing
+import os
+import textwrap
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 
-# 加载预训练模型
+try:
+    from . import InferenceBackend
+    from .ModelRegistry import registry
+except ImportError:
+    import InferenceBackend
+    from ModelRegistry import registry
+
+# 预训练模型路径
 model_path = r"F:\a\apaper\project\project\algorithm\doclayout_yolo_docstructbench_imgsz1024.pt"
-layout_model = YOLOv10(model_path)
 
 # 定义具体的分类标签
 CLASS_LABELS = {
@@ -24,172 +37,577 @@ CLASS_LABELS = {
     9: "Formula Caption",
 }
 
-# 初始化 PaddleOCR，设置语言为支持中文和英文
-ocr = PaddleOCR(use_angle_cls=True, lang='ch')
+# 模型在第一次使用时加载
+def load_layout_model():
+    from doclayout_yolo import YOLOv10
+    if InferenceBackend.use_onnx():
+        return InferenceBackend.yolo_model(model_path, YOLOv10, check=check_layout_parity)
+    return YOLOv10(model_path)
+
+# 多进程并行时每个进程的 OCR 线程数，为 None 时使用 PaddleOCR 默认值
+OCR_CPU_THREADS = None
+
+def load_ocr():
+    from paddleocr import PaddleOCR
+    # 初始化 PaddleOCR，设置语言为支持中文和英文
+    if OCR_CPU_THREADS:
+        return PaddleOCR(use_angle_cls=True, lang='ch', cpu_threads=OCR_CPU_THREADS)
+    return PaddleOCR(use_angle_cls=True, lang='ch')
+
+registry.register('doclayout_yolo', load_layout_model, path=model_path)
+registry.register('paddleocr', load_ocr, version='ch')
+MODEL_NAMES = ('doclayout_yolo', 'paddleocr')
+
+# 默认渲染分辨率：PDF 原始尺寸为 72 DPI，144 DPI 相当于 2 倍缩放
+DEFAULT_DPI = 144
 
 # 解析PDF文档
-def pdf_to_image(pdf_path):
+def iter_pdf_pages(pdf_path, dpi=DEFAULT_DPI, pages=None):
+    """
+    逐页将PDF渲染为图像数组，同一时刻只在内存中保留一页；同时读取页面文本层
+    :param pdf_path: PDF文件的路径
+    :param dpi: 渲染分辨率，可按文档调整
+    :param pages: 只处理这些页码（从 0 开始），为 None 时处理全部页面
+    :return: 依次生成 (页码, 图像数组, 文本层单词)，单词坐标已换算到图像像素坐标
+    """
+    zoom = dpi / 72
+    mat = fitz.Matrix(zoom, zoom)
+    with fitz.open(pdf_path) as doc:
+        for page_no in (range(doc.page_count) if pages is None else pages):
+            page = doc.load_page(page_no)
+            # 使用矩阵进行缩放
+            pix = page.get_pixmap(matrix=mat)
+            img = Image.frombytes("RGB", [pix.width, pix.height], pix.samples)
+            del pix
+            yield page_no, np.array(img), extract_page_words(page, page.rotation_matrix * mat)
+
+def extract_page_words(page, matrix):
+    """
+    读取页面文本层中的单词，扫描件没有文本层时返回空结果
+    :param matrix: PDF 坐标到图像像素坐标的变换
+    :return: (单词框数组 N x 4, 单词列表)
+    """
+    words = page.get_text("words")
+    boxes = np.array([tuple(fitz.Rect(word[:4]) * matrix) for word in words], dtype=np.float32).reshape(-1, 4)
+    return boxes, [word[4] for word in words]
+
+def pdf_to_image(pdf_path, dpi=DEFAULT_DPI):
     """
     将PDF文件的每一页转换为清晰的图像数组
     :param pdf_path: PDF文件的路径
+    :param dpi: 渲染分辨率
     :return: 包含每一页图像数组的列表
     """
-    doc = fitz.open(pdf_path)
-    images = []
-    # 提高图像分辨率，这里将缩放因子设置为2，可根据实际情况调整
-    zoom_x = 2.0
-    zoom_y = 2.0
-    mat = fitz.Matrix(zoom_x, zoom_y)
-    for page in doc:
-        # 使用矩阵进行缩放
-        pix = page.get_pixmap(matrix=mat)
-        img = Image.frombytes("RGB", [pix.width, pix.height], pix.samples)
-        images.append(np.array(img))
-    return images
+    return [image for _, image, _ in iter_pdf_pages(pdf_path, dpi)]
 
-# 布局检测
-def layout_detection(images):
+# 布局模型的输入尺寸，页面会按比例缩放并填充到该尺寸
+LAYOUT_IMGSZ = 1024
+# 批量布局检测时每批的页数
+DEFAULT_BATCH_SIZE = 8
+
+@functools.lru_cache(maxsize=None)
+def get_box_annotator():
+    import supervision as sv
+    # 创建 BoxAnnotator 实例，设置文本样式；所有页面共用一个实例
+    return sv.BoxAnnotator(
+        color=sv.Color.default(),
+        text_color=sv.Color.from_hex("#FFFFFF"),
+        text_scale=0.3,
+        text_thickness=1,
+        text_padding=5
+    )
+
+# 在图像上绘制检测框和标签
+def annotate_page(image, detections):
+    # 生成标签
+    labels = []
+    for class_id, confidence in zip(detections.class_id, detections.confidence):
+        if class_id in CLASS_LABELS:
+            label = f"{CLASS_LABELS[class_id]} {confidence:.2f}"
+        else:
+            label = f"未知类别 {confidence:.2f}"
+        labels.append(label)
+
+    # 注释图像，同时添加标签
+    return get_box_annotator().annotate(
+        scene=image.copy(),
+        detections=detections,
+        labels=labels
+    )
+
+# 批量布局检测
+def detect_layout_batch(images, page_nos, annotate=True):
     """
-    对图像进行布局检测
-    :param images: 包含图像数组的列表
-    :return: 包含检测结果和标注后图像的列表
+    把多页图像作为一个批次送入模型推理，模型内部将每页按比例缩放填充到 LAYOUT_IMGSZ，
+    输出的检测框已映射回各页原图坐标
+    :param images: 页面图像数组列表
+    :param page_nos: 对应的页码列表（从 0 开始）
+    :param annotate: 是否生成标注后的图像
+    :return: 每页的检测结果，annotate 为 True 时包含 annotated_image
     """
-    all_detections = []
-    for i, image in enumerate(images):
-        # 执行推理
-        results = layout_model(source=image, conf=0.25, verbose=False)[0]
-        detections = sv.Detections.from_ultralytics(results)
-
-        # 创建 BoxAnnotator 实例，设置文本样式
-        box_annotator = sv.BoxAnnotator(
-            color=sv.Color.default(),
-            text_color=sv.Color.from_hex("#FFFFFF"),
-            text_scale=0.3,
-            text_thickness=1,
-            text_padding=5
-        )
-
-        # 生成标签
-        labels = []
-        for class_id, confidence in zip(detections.class_id, detections.confidence):
-            if class_id in CLASS_LABELS:
-                label = f"{CLASS_LABELS[class_id]} {confidence:.2f}"
-            else:
-                label = f"未知类别 {confidence:.2f}"
-            labels.append(label)
-
-        # 注释图像，同时添加标签
-        annotated_image = box_annotator.annotate(
-            scene=image.copy(),
-            detections=detections,
-            labels=labels
-        )
-
-        all_detections.append({
+    import supervision as sv
+    layout_model = registry.get('doclayout_yolo')
+    # 执行推理
+    results = layout_model(source=list(images), imgsz=LAYOUT_IMGSZ, conf=0.25, verbose=False)
+
+    batch_detections = []
+    for image, page_no, result in zip(images, page_nos, results):
+        detections = sv.Detections.from_ultralytics(result)
+        detection_info = {
             "detections": detections,
-            "annotated_image": annotated_image,
             "page_info": {
-                "page_no": i,
+                "page_no": page_no,
                 "height": image.shape[0],
                 "width": image.shape[1]
             }
-        })
+        }
+        if annotate:
+            detection_info["annotated_image"] = annotate_page(image, detections)
+        batch_detections.append(detection_info)
+    return batch_detections
+
+# 单页布局检测
+def detect_page_layout(image, page_no, annotate=True):
+    """
+    对单页图像进行布局检测
+    :param image: 页面图像数组
+    :param page_no: 页码（从 0 开始）
+    :param annotate: 是否生成标注后的图像
+    :return: 检测结果，annotate 为 True 时包含 annotated_image
+    """
+    return detect_layout_batch([image], [page_no], annotate=annotate)[0]
+
+# 布局检测
+def layout_detection(images, batch_size=DEFAULT_BATCH_SIZE):
+    """
+    对图像进行布局检测，按 batch_size 分批推理并打印吞吐量，便于调整批大小
+    :param images: 包含图像数组的列表
+    :param batch_size: 每批页数
+    :return: 包含检测结果和标注后图像的列表
+    """
+    start = time.time()
+    all_detections = []
+    for batch_start in range(0, len(images), batch_size):
+        batch = images[batch_start:batch_start + batch_size]
+        page_nos = range(batch_start, batch_start + len(batch))
+        all_detections.extend(detect_layout_batch(batch, page_nos))
+    report_throughput('布局检测', len(images), time.time() - start, batch_size)
     return all_detections
 
+def sample_page_images(dpi=DEFAULT_DPI):
+    """
+    生成包含标题、正文段落、插图和图注的示例页面，用于布局模型的精度对比
+    :return: 页面图像数组列表
+    """
+    body = ' '.join(['The quick brown fox jumps over the lazy dog.'] * 12)
+    with fitz.open() as doc:
+        page = doc.new_page()
+        page.insert_text((72, 90), 'Document Layout Sample', fontsize=24)
+        page.insert_textbox(fitz.Rect(72, 120, 523, 260), body, fontsize=11)
+        page.draw_rect(fitz.Rect(122, 290, 473, 560), color=(0, 0, 0), fill=(0.75, 0.8, 0.9))
+        page.insert_text((122, 580), 'Figure 1. Sample figure caption.', fontsize=10)
+        page.insert_textbox(fitz.Rect(72, 610, 523, 770), body, fontsize=11)
+        pix = page.get_pixmap(matrix=fitz.Matrix(dpi / 72, dpi / 72))
+        return [np.array(Image.frombytes("RGB", [pix.width, pix.height], pix.samples))]
+
+def check_layout_parity(model, images=None):
+    """
+    对比导出后的布局模型与原 .pt 模型的检测框，不一致时抛出 InferenceBackend.ParityError
+    :param images: 页面图像（路径或数组）列表，默认使用 sample_page_images()
+    """
+    from doclayout_yolo import YOLOv10
+    return InferenceBackend.check_detection_parity(
+        YOLOv10(model_path), model, images or sample_page_images(), imgsz=LAYOUT_IMGSZ
+    )
+
+def report_throughput(stage, page_count, elapsed, batch_size):
+    pages_per_sec = page_count / elapsed if elapsed > 0 else 0.0
+    print(f"{stage}: {page_count} 页, 耗时 {elapsed:.2f}s, {pages_per_sec:.2f} 页/秒 (batch_size={batch_size})")
+    return pages_per_sec
+
+# 需要提取文字的版面类别
+TEXT_LAYOUT_TYPES = ["Plain Text", "Title", "Abandoned Text", "Figure Caption", "Table Caption", "Table Footnote", "Formula Caption", "Table"]
+
+# 从 PDF 文本层读取区域文字
+def text_from_layer(page_words, box):
+    """
+    取出中心点落在区域内的文本层单词，原生数字 PDF 无需 OCR
+    :param page_words: extract_page_words 的返回值
+    :param box: 区域坐标 (x1, y1, x2, y2)，图像像素坐标
+    :return: 区域文字，没有文本层时返回空字符串
+    """
+    if page_words is None:
+        return ""
+    boxes, words = page_words
+    if not words:
+        return ""
+    x1, y1, x2, y2 = box
+    cx = (boxes[:, 0] + boxes[:, 2]) / 2
+    cy = (boxes[:, 1] + boxes[:, 3]) / 2
+    inside = np.flatnonzero((cx >= x1) & (cx <= x2) & (cy >= y1) & (cy <= y2))
+    return " ".join(words[i] for i in inside).strip()
+
+# 逐区域 OCR
+def ocr_region(ocr, layout_image):
+    """
+    对单个区域做检测加识别
+    :return: (文字, 最高置信度)，未识别到文字时返回 None
+    """
+    result = ocr.ocr(layout_image, cls=True)
+    if result and result[0]:
+        full_text = " ".join([line[1][0] for line in result[0]])
+        score = max([line[1][1] for line in result[0]])  # 取最高置信度
+        return full_text, score
+    return None
+
+# 批量识别文字行图像
+def recognize_crops(ocr, crops, cls=True):
+    """
+    直接调用 PaddleOCR 的方向分类器和识别器：ocr.ocr 会把图像列表当作多张独立图像逐张处理，
+    识别器本身则按 rec_batch_num 成批推理
+    :param crops: 文字行图像列表
+    :return: 与 crops 一一对应的 [(文字, 置信度)]
+    """
+    if cls and getattr(ocr, 'use_angle_cls', False):
+        crops, _, _ = ocr.text_classifier(crops)
+    rec_result, _ = ocr.text_recognizer(crops)
+    return rec_result
+
+# 按文字行四边形透视变换裁剪出水平的文字行图像，与 PaddleOCR 的 get_rotate_crop_image 相同
+def get_rotate_crop_image(image, points):
+    import cv2
+    points = np.asarray(points, dtype=np.float32)
+    if len(points) != 4:
+        # 多边形检测框取最小外接矩形，顶点按左上、右上、右下、左下排列（同 get_minarea_rect_crop）
+        left, right = np.split(np.array(sorted(cv2.boxPoints(cv2.minAreaRect(points.astype(np.int32))), key=lambda p: p[0])), 2)
+        left, right = left[np.argsort(left[:, 1])], right[np.argsort(right[:, 1])]
+        points = np.float32([left[0], right[0], right[1], left[1]])
+    width = int(max(np.linalg.norm(points[0] - points[1]), np.linalg.norm(points[2] - points[3])))
+    height = int(max(np.linalg.norm(points[0] - points[3]), np.linalg.norm(points[1] - points[2])))
+    if width == 0 or height == 0:
+        return None
+    target = np.float32([[0, 0], [width, 0], [width, height], [0, height]])
+    crop = cv2.warpPerspective(
+        image, cv2.getPerspectiveTransform(points, target), (width, height),
+        borderMode=cv2.BORDER_REPLICATE, flags=cv2.INTER_CUBIC
+    )
+    # 竖排文字旋转为横排
+    if crop.shape[0] / crop.shape[1] >= 1.5:
+        crop = np.rot90(crop)
+    return crop
+
+# 批量 OCR
+def ocr_regions_batched(ocr, image, boxes):
+    """
+    整页只做一次文字行检测，把文字行分配到各区域后，所有文字行在一次调用中批量识别；
+    与 ocr.ocr 一样按检测四边形做透视校正裁剪，并丢弃置信度低于 ocr.drop_score 的识别结果
+    :param image: 页面图像数组
+    :param boxes: {区域编号: (x1, y1, x2, y2)}
+    :return: {区域编号: (文字, 最高置信度)}
+    """
+    det_result = ocr.ocr(image, det=True, rec=False, cls=False)
+    lines = det_result[0] if det_result and det_result[0] else []
+
+    # 按文字行中心点归属区域，区域内按从上到下、从左到右排序
+    region_lines = {region: [] for region in boxes}
+    for line in lines:
+        quad = np.array(line, dtype=np.float32).reshape(-1, 2)
+        lx1, ly1 = quad.min(axis=0)
+        lx2, ly2 = quad.max(axis=0)
+        cx, cy = (lx1 + lx2) / 2, (ly1 + ly2) / 2
+        for region, (x1, y1, x2, y2) in boxes.items():
+            if x1 <= cx <= x2 and y1 <= cy <= y2:
+                region_lines[region].append((float(ly1), float(lx1), quad))
+                break
+
+    crops = []
+    owners = []
+    for region, region_line_list in region_lines.items():
+        for _, _, quad in sorted(region_line_list, key=lambda line: line[:2]):
+            crop = get_rotate_crop_image(image, quad)
+            if crop is not None and crop.size:
+                crops.append(crop)
+                owners.append(region)
+    if not crops:
+        return {}
+
+    rec_result = recognize_crops(ocr, crops)
+    if len(rec_result) != len(crops):
+        raise RuntimeError(f'OCR 识别结果数量 {len(rec_result)} 与文字行数量 {len(crops)} 不一致')
+
+    # PaddleOCR 默认 drop_score 为 0.5
+    drop_score = getattr(ocr, 'drop_score', 0.5)
+    texts = {}
+    for region, (text, score) in zip(owners, rec_result):
+        if not text or score < drop_score:
+            continue
+        if region in texts:
+            full_text, best_score = texts[region]
+            texts[region] = (f"{full_text} {text}", max(best_score, score))
+        else:
+            texts[region] = (text, score)
+    return texts
+
+# 单页 OCR 识别
+def recognize_page(detection_info, image, page_words=None, ocr_mode="batch", output_dir=None):
+    """
+    对单页的布局检测结果进行文字提取：有文本层的区域直接读取文本层，其余区域送入 OCR
+    :param detection_info: detect_page_layout 的返回值
+    :param image: 页面图像数组
+    :param page_words: 页面文本层单词，为 None 时全部使用 OCR
+    :param ocr_mode: batch 为整页批量识别，region 为逐区域识别
+    :param output_dir: 插图区域的保存目录，为 None 时不保存
+    :return: 该页的识别结果，检测结果中带有标注图像时一并返回
+    """
+    detections = detection_info["detections"]
+    page_info = detection_info["page_info"]
+    page_no = page_info["page_no"]
+
+    # 按检测框的上边界坐标进行排序，依次收集需要提取文字的区域
+    regions = []
+    sorted_indices = np.argsort(detections.xyxy[:, 1])
+    for index in sorted_indices:
+        xyxy = detections.xyxy[index]
+        class_id = detections.class_id[index]
+        x1, y1, x2, y2 = map(int, xyxy)
+        layout_type = CLASS_LABELS.get(class_id, "未知类别")
+
+        if layout_type in TEXT_LAYOUT_TYPES:
+            regions.append((layout_type, (x1, y1, x2, y2)))
+        elif layout_type == "Figure" and output_dir is not None:
+            # 保存图片
+            figure_path = os.path.join(output_dir, f"page_{page_no + 1}_figure_{x1}_{y1}.png")
+            Image.fromarray(image[y1:y2, x1:x2]).save(figure_path)
+
+    # 优先使用文本层，只有纯图像区域才需要 OCR
+    texts = {}
+    pending = {}
+    for region, (_, box) in enumerate(regions):
+        layer_text = text_from_layer(page_words, box)
+        if layer_text:
+            texts[region] = (layer_text, 1.0)
+        else:
+            pending[region] = box
+    if pending:
+        ocr = registry.get('paddleocr')
+        if ocr_mode == "batch":
+            texts.update(ocr_regions_batched(ocr, image, pending))
+        else:
+            for region, (x1, y1, x2, y2) in pending.items():
+                result = ocr_region(ocr, image[y1:y2, x1:x2])
+                if result:
+                    texts[region] = result
+
+    # 提取布局内容
+    page_results = []
+    unique_texts = set()
+    for region, (layout_type, (x1, y1, x2, y2)) in enumerate(regions):
+        if region not in texts:
+            continue
+        full_text, score = texts[region]
+        if full_text not in unique_texts:
+            unique_texts.add(full_text)
+            page_results.append({
+                "category_type": layout_type.lower().replace(" ", "_"),
+                "poly": [x1, y1, x2, y1, x2, y2, x1, y2],
+                "text": full_text,
+                "score": score
+            })
+
+    page_result = {
+        "layout_dets": page_results,
+        "page_info": page_info
+    }
+    if "annotated_image" in detection_info:
+        page_result["annotated_image"] = detection_info["annotated_image"]
+    return page_result
+
 # OCR 识别
-def ocr_recognition(all_detections, images):
+def ocr_recognition(all_detections, images, ocr_mode="batch", output_dir=None):
     """
     对布局检测结果进行 OCR 识别
     :param all_detections: 包含检测结果和标注后图像的列表
     :param images: 包含图像数组的列表
+    :param ocr_mode: batch 为整页批量识别，region 为逐区域识别
+    :param output_dir: 插图区域的保存目录，为 None 时不保存
     :return: 包含识别结果和标注后图像的列表
     """
-    all_results = []
-    for i, detection_info in enumerate(all_detections):
-        detections = detection_info["detections"]
-        image = images[i]
-        annotated_image = detection_info["annotated_image"]
-        page_info = detection_info["page_info"]
-
-        # 提取布局内容
-        page_results = []
-        unique_texts = set()
-        # 按检测框的上边界坐标进行排序
-        sorted_indices = np.argsort(detections.xyxy[:, 1])
-        for index in sorted_indices:
-            xyxy = detections.xyxy[index]
-            class_id = detections.class_id[index]
-            x1, y1, x2, y2 = map(int, xyxy)
-            layout_image = image[y1:y2, x1:x2]
-            layout_type = CLASS_LABELS.get(class_id, "未知类别")
-
-            if layout_type in ["Plain Text", "Title", "Abandoned Text", "Figure Caption", "Table Caption", "Table Footnote", "Formula Caption"]:
-                result = ocr.ocr(layout_image, cls=True)
-                if result and result[0]:
-                    full_text = " ".join([line[1][0] for line in result[0]])
-                    score = max([line[1][1] for line in result[0]])  # 取最高置信度
-                    if full_text not in unique_texts:
-                        unique_texts.add(full_text)
-                        page_results.append({
-                            "category_type": layout_type.lower().replace(" ", "_"),
-                            "poly": [x1, y1, x2, y1, x2, y2, x1, y2],
-                            "text": full_text,
-                            "score": score
-                        })
-            elif layout_type == "Figure":
-                # 保存图片
-                Image.fromarray(layout_image).save(f"page_{i + 1}_figure_{x1}_{y1}.png")
-            elif layout_type == "Table":
-                result = ocr.ocr(layout_image, cls=True)
-                if result and result[0]:
-                    full_text = " ".join([line[1][0] for line in result[0]])
-                    score = max([line[1][1] for line in result[0]])  # 取最高置信度
-                    if full_text not in unique_texts:
-                        unique_texts.add(full_text)
-                        page_results.append({
-                            "category_type": "table",
-                            "poly": [x1, y1, x2, y1, x2, y2, x1, y2],
-                            "text": full_text,
-                            "score": score
-                        })
-
-        all_results.append({
-            "layout_dets": page_results,
-            "page_info": page_info,
-            "annotated_image": annotated_image
-        })
-    return all_results
+    return [
+        recognize_page(detection_info, images[i], ocr_mode=ocr_mode, output_dir=output_dir)
+        for i, detection_info in enumerate(all_detections)
+    ]
+
+# 流式处理整个文档
+def process_pdf_stream(pdf_path, dpi=DEFAULT_DPI, annotate=False, batch_size=DEFAULT_BATCH_SIZE,
+                       use_text_layer=True, ocr_mode="batch", pages=None, report=True, output_dir=None):
+    """
+    流式处理：每次渲染 batch_size 页并批量检测，识别后立即输出各页结果并释放图像，
+    内存占用只与批大小有关，与页数无关
+    :param pdf_path: PDF文件的路径
+    :param dpi: 渲染分辨率
+    :param annotate: 是否在结果中附带标注后的图像
+    :param batch_size: 每批页数
+    :param use_text_layer: 是否优先读取 PDF 文本层
+    :param ocr_mode: batch 为整页批量识别，region 为逐区域识别
+    :param pages: 只处理这些页码，为 None 时处理全部页面
+    :param report: 结束时是否打印吞吐量
+    :param output_dir: 插图区域的保存目录，为 None 时不保存；多进程和推理服务中没有统一的当前目录，需要显式传入
+    :return: 依次生成每一页的识别结果
+    """
+    start = time.time()
+    page_count = 0
+    pages = iter_pdf_pages(pdf_path, dpi, pages)
+    while True:
+        batch = list(itertools.islice(pages, batch_size))
+        if not batch:
+            break
+        page_nos = [page_no for page_no, _, _ in batch]
+        images = [image for _, image, _ in batch]
+        words = [page_words if use_text_layer else None for _, _, page_words in batch]
+        del batch
+        batch_detections = detect_layout_batch(images, page_nos, annotate=annotate)
+        for detection_info, image, page_words in zip(batch_detections, images, words):
+            yield recognize_page(detection_info, image, page_words, ocr_mode=ocr_mode, output_dir=output_dir)
+        page_count += len(images)
+        del images, words, batch_detections
+    if report:
+        report_throughput('PDF 处理', page_count, time.time() - start, batch_size)
+
+# 多进程并行处理
+def _init_pdf_worker(threads, backend_config):
+    """
+    进程池初始化：限制每个进程的计算线程数，避免多进程时线程过量争抢 CPU，并预加载模型常驻进程
+    进程以 spawn 方式启动，不继承父进程已加载的模型，线程数在模型创建之前生效
+    :param backend_config: 父进程的推理后端配置，spawn 启动的进程不会继承
+    """
+    global OCR_CPU_THREADS
+    OCR_CPU_THREADS = threads
+    InferenceBackend.config.update(backend_config, intra_op_threads=threads)
+    os.environ["OMP_NUM_THREADS"] = str(threads)
+    try:
+        import torch
+        torch.set_num_threads(threads)
+    except ImportError:
+        pass
+    registry.preload(*MODEL_NAMES)
+
+def _process_shard(pdf_path, pages, options):
+    # 在子进程中处理一段连续页面，结果中不带标注图像以减少进程间传输
+    return list(process_pdf_stream(pdf_path, pages=pages, annotate=False, report=False, **options))
+
+def _pdf_shards(pdf_path, pages_per_task):
+    with fitz.open(pdf_path) as doc:
+        page_count = doc.page_count
+    return [range(start, min(start + pages_per_task, page_count)) for start in range(0, page_count, pages_per_task)]
+
+# 常驻进程池：进程和其中的模型在整个进程生命周期内复用，进程数、线程数或推理后端变化时重建
+_pdf_pool = None
+_pdf_pool_config = None
+_pdf_pool_lock = threading.Lock()
+
+def get_pdf_pool(workers, threads_per_worker):
+    global _pdf_pool, _pdf_pool_config
+    config = (workers, threads_per_worker, dict(InferenceBackend.config))
+    with _pdf_pool_lock:
+        if _pdf_pool is not None and _pdf_pool_config != config:
+            _pdf_pool.shutdown(wait=True)
+            _pdf_pool = None
+        if _pdf_pool is None:
+            _pdf_pool = ProcessPoolExecutor(
+                max_workers=workers,
+                mp_context=multiprocessing.get_context('spawn'),
+                initializer=_init_pdf_worker,
+                initargs=(threads_per_worker, config[2]),
+            )
+            _pdf_pool_config = config
+        return _pdf_pool
+
+@atexit.register
+def shutdown_pdf_pool():
+    # 关闭常驻进程池，进程退出时自动调用；子进程异常退出后也调用，下次使用时重建
+    global _pdf_pool, _pdf_pool_config
+    with _pdf_pool_lock:
+        if _pdf_pool is not None:
+            _pdf_pool.shutdown(wait=True, cancel_futures=True)
+        _pdf_pool = _pdf_pool_config = None
+
+def process_pdfs_parallel(pdf_paths, workers=None, pages_per_task=16, threads_per_worker=1, **options):
+    """
+    多进程并行处理：把每个文档按 pages_per_task 页切分，所有文档的分片共用一个常驻进程池，
+    每个进程持有自己常驻的布局模型和 OCR 模型，多次调用之间不重复启动进程和加载模型，结果按页序重新拼接
+    :param pdf_paths: PDF文件路径列表
+    :param workers: 进程数，默认等于 CPU 核数
+    :param pages_per_task: 每个分片的页数，越小负载越均衡，越大调度开销越低
+    :param threads_per_worker: 每个进程的计算线程数
+    :param options: 透传给 process_pdf_stream 的参数，如 dpi、batch_size、ocr_mode、output_dir
+    :return: 依次生成 (pdf_path, 按页序排列的结果列表)，格式与 show_results 的输入一致
+    """
+    workers = workers or os.cpu_count()
+    start = time.time()
+    page_count = 0
+    executor = get_pdf_pool(workers, threads_per_worker)
+    # 先提交所有分片，使进程池在拼接前一个文档时继续处理后面的文档
+    documents = [
+        (pdf_path, [executor.submit(_process_shard, pdf_path, pages, options)
+                    for pages in _pdf_shards(pdf_path, pages_per_task)])
+        for pdf_path in pdf_paths
+    ]
+    try:
+        for pdf_path, futures in documents:
+            page_results = [page for future in futures for page in future.result()]
+            page_count += len(page_results)
+            yield pdf_path, page_results
+    except BrokenProcessPool:
+        shutdown_pdf_pool()
+        raise
+    finally:
+        # 调用方提前停止迭代时取消尚未开始的分片，常驻进程不被占用
+        for _, futures in documents:
+            for future in futures:
+                future.cancel()
+    report_throughput(f'PDF 并行处理（{workers} 进程）', page_count, time.time() - start,
+                      options.get('batch_size', DEFAULT_BATCH_SIZE))
+
+def process_pdf_parallel(pdf_path, workers=None, pages_per_task=16, threads_per_worker=1, **options):
+    """
+    多进程并行处理单个文档，参数同 process_pdfs_parallel
+    :return: 按页序排列的结果列表
+    """
+    for _, page_results in process_pdfs_parallel([pdf_path], workers, pages_per_task, threads_per_worker, **options):
+        return page_results
+    return []
 
 
 # 展示结果并导出为 JSON
-def show_results(all_results):
-    """
-    打印所有识别结果并将其导出为 JSON 格式
-    :param all_results: 包含每一页识别结果和标注后图像的列表
-    """
-    json_data = []
-    for result in all_results:
-        page_no = result["page_info"]["page_no"]
-        # 保存标注后的图片
-        annotated_image = Image.fromarray(result["annotated_image"])
-        annotated_image.save(f"page_{page_no + 1}_annotated.png")
-
-        # 准备 JSON 数据
-        json_result = {
-            "layout_dets": result["layout_dets"],
-            "page_info": result["page_info"]
-        }
-        json_data.append(json_result)
+def show_results(all_results, output_path='output.json'):
+    """
+    打印所有识别结果并将其导出为 JSON 格式，结果可以是逐页生成的迭代器，每页处理完立即写入
+    :param all_results: 包含每一页识别结果和标注后图像的列表或迭代器
+    :param output_path: JSON 输出路径
+    """
+    with open(output_path, 'w', encoding='utf-8') as f:
+        f.write('[')
+        page_count = 0
+        for result in all_results:
+            page_no = result["page_info"]["page_no"]
+            # 保存标注后的图片，与 JSON 文件放在同一目录
+            if "annotated_image" in result:
+                annotated_image = Image.fromarray(result["annotated_image"])
+                annotated_image.save(os.path.join(os.path.dirname(output_path), f"page_{page_no + 1}_annotated.png"))
 
-    json_output = json.dumps(json_data, ensure_ascii=False, indent=4)
-    print(json_output)
-    with open('output.json', 'w', encoding='utf-8') as f:
-        f.write(json_output)
+            # 准备 JSON 数据
+            json_result = {
+                "layout_dets": result["layout_dets"],
+                "page_info": result["page_info"]
+            }
+            page_output = json.dumps(json_result, ensure_ascii=False, indent=4)
+            print(page_output)
+            f.write((',' if page_count else '') + '\n' + textwrap.indent(page_output, '    '))
+            f.flush()
+            page_count += 1
+        f.write('\n]' if page_count else ']')
 
 # 主程序
 if __name__ == "__main__":
     pdf_path = r'F:\a\apaper\project\project\algorithm\pdf_test.pdf'
-    images = pdf_to_image(pdf_path)
-    detections = layout_detection(images)
-    results = ocr_recognition(detections, images)
-    show_results(results)
\ No newline at end of file
+    show_results(process_pdf_stream(pdf_path, annotate=True, output_dir='.'))
\ No newline at end of file
@@ -0,0 +1,191 @@
+import hashlib
+import json
+import os
+import shutil
+import threading
+
+
+class ResultCache:
+    """
+    磁盘结果缓存：键由文件内容哈希、模型标识与版本、处理参数组成，相同输入不再重复计算
+    每个命名空间（如项目类型）一个目录，总大小超过 max_size 时按最近访问时间（LRU）淘汰
+    缓存项为单个结果文件（get_file / put_file），或包含中间产物的整个结果目录（get_dir / put_dir）
+    """
+
+    # 目录缓存项中代替原结果目录路径的占位符
+    OUTPUT_DIR_MARKER = '${OUTPUT_DIR}'
+
+    def __init__(self, root, max_size=None):
+        self.root = root
+        self.max_size = max_size
+        # 当前进程估计的缓存总大小，首次写入时扫描目录得到
+        self._size = None
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(content_hash, models, params=None):
+        """
+        计算缓存键
+        :param content_hash: 输入文件内容的 sha256
+        :param models: {模型名称: 版本}，模型更新后版本变化，旧结果自然失效
+        :param params: 影响结果的处理参数
+        """
+        payload = json.dumps(
+            {'content': content_hash, 'models': models, 'params': params or {}}, sort_keys=True, default=str
+        )
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+    def path(self, namespace, key):
+        return os.path.join(self.root, namespace, key[:2], key + '.json')
+
+    def dir_path(self, namespace, key):
+        return os.path.join(self.root, namespace, key[:2], key)
+
+    def get_file(self, namespace, key, destination):
+        """
+        命中时把缓存的结果文件复制到 destination
+        :return: 是否命中
+        """
+        path = self.path(namespace, key)
+        try:
+            shutil.copyfile(path, destination)
+        except FileNotFoundError:
+            return False
+        # 以修改时间记录最近访问时间，供 LRU 淘汰使用
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            pass
+        return True
+
+    def put_file(self, namespace, key, source):
+        """
+        保存结果文件，先写临时文件再改名，多个进程同时写入同一个键时互不影响
+        """
+        path = self.path(namespace, key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        shutil.copyfile(source, tmp_path)
+        os.replace(tmp_path, path)
+        self._added(os.path.getsize(path))
+
+    @staticmethod
+    def _json_path(path):
+        # 路径在 JSON 文本中的写法（结果以 ensure_ascii=False 写出）
+        return json.dumps(path, ensure_ascii=False)[1:-1]
+
+    def _rewrite(self, path, old, new):
+        with open(path, encoding='utf-8') as f:
+            text = f.read()
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(text.replace(old, new))
+
+    def get_dir(self, namespace, key, destination, json_files=('result.json',)):
+        """
+        命中时把缓存的结果目录复制到 destination，json_files 中的占位符改写为 destination 的路径
+        :return: 是否命中
+        """
+        path = self.dir_path(namespace, key)
+        try:
+            shutil.copytree(path, destination, dirs_exist_ok=True)
+        except (FileNotFoundError, shutil.Error):
+            # 不存在，或复制过程中被其他进程淘汰
+            return False
+        for name in json_files:
+            target = os.path.join(destination, name)
+            if os.path.exists(target):
+                self._rewrite(target, self.OUTPUT_DIR_MARKER, self._json_path(os.path.abspath(destination)))
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            pass
+        return True
+
+    def put_dir(self, namespace, key, source, json_files=('result.json',)):
+        """
+        保存整个结果目录，json_files 中指向 source 的绝对路径改写为占位符，命中时再改写为新的结果目录
+        先复制到临时目录再改名；同一个键已存在时保留已有的缓存项
+        """
+        path = self.dir_path(namespace, key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        shutil.copytree(source, tmp_path)
+        for name in json_files:
+            target = os.path.join(tmp_path, name)
+            if os.path.exists(target):
+                self._rewrite(target, self._json_path(os.path.abspath(source)), self.OUTPUT_DIR_MARKER)
+        try:
+            os.rename(tmp_path, path)
+        except OSError:
+            shutil.rmtree(tmp_path, ignore_errors=True)
+            return
+        self._added(self._dir_size(path))
+
+    def invalidate(self, namespace=None):
+        """
+        删除某个命名空间（或全部）的缓存，例如模型以不改变版本号的方式被替换时
+        """
+        shutil.rmtree(os.path.join(self.root, namespace) if namespace else self.root, ignore_errors=True)
+        with self._lock:
+            self._size = None
+
+    @staticmethod
+    def _dir_size(path):
+        total = 0
+        for dirpath, _, filenames in os.walk(path):
+            for filename in filenames:
+                try:
+                    total += os.path.getsize(os.path.join(dirpath, filename))
+                except FileNotFoundError:
+                    pass
+        return total
+
+    def _entries(self):
+        # 缓存项位于 <命名空间>/<键前两位>/ 下：结果文件 <键>.json 或结果目录 <键>，跳过写入中的临时文件
+        for dirpath, dirnames, filenames in os.walk(self.root):
+            if os.path.relpath(dirpath, self.root).count(os.sep) != 1:
+                continue
+            for name in filenames + dirnames:
+                path = os.path.join(dirpath, name)
+                if name.endswith('.tmp') or not (name in dirnames or name.endswith('.json')):
+                    continue
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                yield stat.st_mtime, self._dir_size(path) if name in dirnames else stat.st_size, path
+            # 不再深入缓存项目录内部
+            dirnames.clear()
+
+    def _added(self, size):
+        if not self.max_size:
+            return
+        with self._lock:
+            if self._size is None:
+                self._size = sum(entry_size for _, entry_size, _ in self._entries())
+            else:
+                self._size += size
+            if self._size > self.max_size:
+                self._evict()
+
+    def _evict(self):
+        # 调用方需持有 self._lock；重新扫描目录，包含其他进程写入的结果，淘汰到上限的 90%
+        entries = sorted(self._entries())
+        total = sum(size for _, size, _ in entries)
+        target = self.max_size * 0.9
+        for _, size, path in entries:
+            if total <= target:
+                break
+            if os.path.isdir(path):
+                shutil.rmtree(path, ignore_errors=True)
+            else:
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+            total -= size
+        self._size = total
+
+    def size(self):
+        return sum(size for _, size, _ in self._entries())
+
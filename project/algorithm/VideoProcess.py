@@ -1,59 +1,428 @@
 import cv2
+import itertools
 import os
-from modelscope.pipelines import pipeline
-from modelscope.utils.constant import Tasks
+import time
 import numpy as np
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 
+try:
+    from .ModelRegistry import registry
+except ImportError:
+    from ModelRegistry import registry
 
-def preprocess_video(video_path, output_folder):
-    # 确保输出文件夹存在
-    if not os.path.exists(output_folder):
-        os.makedirs(output_folder)
 
-    # 打开视频文件
-    cap = cv2.VideoCapture(video_path)
-    frame_count = 0
+# 图像增强：直方图均衡化后缩放，OpenCV 运算期间会释放 GIL，可在线程池中并行
+def enhance_frame(frame, size=(224, 224)):
+    if len(frame.shape) == 3:
+        # 如果是彩色图像，将其转换为 YUV 颜色空间
+        yuv = cv2.cvtColor(frame, cv2.COLOR_BGR2YUV)
+        yuv[:, :, 0] = cv2.equalizeHist(yuv[:, :, 0])
+        frame = cv2.cvtColor(yuv, cv2.COLOR_YUV2BGR)
+    else:
+        # 如果是灰度图像，直接进行直方图均衡化
+        frame = cv2.equalizeHist(frame)
+    # 调整帧的大小，默认 224x224
+    return cv2.resize(frame, size)
+
+
+# 抽帧间隔：指定 sample_fps 时按视频帧率换算
+def sampling_step(cap, step=4, sample_fps=None):
+    if sample_fps:
+        video_fps = cap.get(cv2.CAP_PROP_FPS) or 25
+        return max(int(round(video_fps / sample_fps)), 1)
+    return step
 
-    while cap.isOpened():
+
+def sample_frames(cap, step=4, seek=False):
+    """
+    按固定间隔抽帧，跳过的帧只调用 grab() 不解码
+    :param cap: cv2.VideoCapture
+    :param step: 每 step 帧取一帧
+    :param seek: 为 True 时直接跳转到下一个采样位置，间隔很大时更快，但部分格式跳转不精确
+    :return: 依次生成 (帧号, BGR 图像)
+    """
+    frame_index = 0
+    while True:
+        if seek and frame_index:
+            cap.set(cv2.CAP_PROP_POS_FRAMES, frame_index)
         ret, frame = cap.read()
         if not ret:
-            break
-        # 每 4 帧提取一次（可根据需要调整）
-        if frame_count % 4 == 0:
-            # 图像增强：这里简单地进行直方图均衡化
-            if len(frame.shape) == 3:
-                # 如果是彩色图像，将其转换为 YUV 颜色空间
-                yuv = cv2.cvtColor(frame, cv2.COLOR_BGR2YUV)
-                yuv[:, :, 0] = cv2.equalizeHist(yuv[:, :, 0])
-                frame = cv2.cvtColor(yuv, cv2.COLOR_YUV2BGR)
+            return
+        yield frame_index, frame
+        if not seek:
+            for _ in range(step - 1):
+                if not cap.grab():
+                    return
+        frame_index += step
+
+
+# 场景变化检测用的缩略图：灰度并缩小到 64x36，差异计算开销可以忽略
+def scene_thumbnail(frame, size=(64, 36)):
+    if len(frame.shape) == 3:
+        frame = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+    return cv2.resize(frame, size, interpolation=cv2.INTER_AREA)
+
+
+# 两帧缩略图的平均像素差，范围 0~1
+def scene_difference(thumbnail, previous):
+    return float(cv2.absdiff(thumbnail, previous).mean()) / 255
+
+
+def sample_scene_changes(cap, threshold=0.08, max_fps=4, min_fps=0.1, seek=False):
+    """
+    按画面变化自适应抽帧：以 max_fps 的频率探测，与上一次保留的帧差异超过 threshold 时才保留，
+    静止画面只按 min_fps 保留少量帧，抽帧数量取决于画面内容而不是视频时长
+    :param cap: cv2.VideoCapture
+    :param threshold: 缩略图平均像素差阈值（0~1）
+    :param max_fps: 每秒最多保留的帧数，同时也是探测频率
+    :param min_fps: 每秒最少保留的帧数，画面长时间不变时按该频率强制保留，为 0 时不强制
+    :param seek: 是否通过跳转定位探测帧
+    :return: 依次生成 (帧号, BGR 图像)
+    """
+    fps = cap.get(cv2.CAP_PROP_FPS) or 25
+    max_gap = fps / min_fps if min_fps else float('inf')
+    previous = None
+    last_kept = 0
+    for index, frame in sample_frames(cap, sampling_step(cap, 1, max_fps), seek):
+        thumbnail = scene_thumbnail(frame)
+        if previous is None or index - last_kept >= max_gap or scene_difference(thumbnail, previous) > threshold:
+            previous, last_kept = thumbnail, index
+            yield index, frame
+
+
+class NpyFrameWriter:
+    """
+    把帧依次写入 frames.npy（形状为 帧数 x 高 x 宽 x 3），帧号写入 frame_indices.npy，
+    读取时可用 np.load(path, mmap_mode='r') 按需加载
+    """
+
+    def __init__(self, output_folder, expected_count, size):
+        self.path = os.path.join(output_folder, 'frames.npy')
+        self.indices_path = os.path.join(output_folder, 'frame_indices.npy')
+        self.tmp_path = self.path + '.tmp'
+        # 按视频头中的帧数预先分配，实际帧数不同时在 close 中修正
+        self.array = np.lib.format.open_memmap(
+            self.tmp_path, mode='w+', dtype=np.uint8, shape=(max(expected_count, 1), size[1], size[0], 3)
+        )
+        self.indices = []
+        self.overflow = []
+
+    def write(self, index, frame):
+        position = len(self.indices)
+        if position < len(self.array):
+            self.array[position] = frame
+        else:
+            self.overflow.append(frame)
+        self.indices.append(index)
+
+    def close(self):
+        count = len(self.indices)
+        array = self.array
+        self.array = None
+        array.flush()
+        if count == len(array):
+            del array
+            os.replace(self.tmp_path, self.path)
+        else:
+            kept = min(count, len(array))
+            resized = np.empty((0,) + array.shape[1:], dtype=np.uint8) if count == 0 else np.lib.format.open_memmap(
+                self.path + '.resize', mode='w+', dtype=np.uint8, shape=(count,) + array.shape[1:]
+            )
+            for start in range(0, kept, 256):
+                resized[start:min(start + 256, kept)] = array[start:min(start + 256, kept)]
+            for offset, frame in enumerate(self.overflow):
+                resized[kept + offset] = frame
+            del array
+            os.remove(self.tmp_path)
+            if count == 0:
+                np.save(self.path, resized)
             else:
-                # 如果是灰度图像，直接进行直方图均衡化
-                frame = cv2.equalizeHist(frame)
-            # 调整帧的大小为 224x224
-            frame = cv2.resize(frame, (224, 224))
+                resized.flush()
+                del resized
+                os.replace(self.path + '.resize', self.path)
+        np.save(self.indices_path, np.array(self.indices, dtype=np.int64))
+
+    def discard(self):
+        # 写入中途出错时删除临时文件；close 完成后调用不做任何事
+        self.array = None
+        for path in (self.tmp_path, self.path + '.resize'):
+            if os.path.exists(path):
+                os.remove(path)
+
+
+class ImageFrameWriter:
+    """
+    每帧保存为一张图片，在线程池中并行编码；排队中的帧不超过线程数的两倍，
+    编码跟不上解码时 write 等待最早的帧写完，内存占用与视频长度无关
+    """
+
+    def __init__(self, output_folder, extension='.jpg', jpeg_quality=90, workers=None):
+        self.output_folder = output_folder
+        self.extension = extension
+        self.params = [cv2.IMWRITE_JPEG_QUALITY, jpeg_quality] if extension == '.jpg' else []
+        # 默认线程数与 ThreadPoolExecutor 相同
+        workers = workers or min(32, (os.cpu_count() or 1) + 4)
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self.max_pending = 2 * workers
+        self.futures = deque()
+
+    def _write_frame(self, index, frame):
+        cv2.imwrite(os.path.join(self.output_folder, f"frame_{index:04d}{self.extension}"), frame, self.params)
 
-            # 保存帧为 PNG 图片
-            image_path = os.path.join(output_folder, f"frame_{frame_count:04d}.png")
-            cv2.imwrite(image_path, frame)
+    def write(self, index, frame):
+        # 丢弃已写完的任务，排队的帧达到上限时等待最早的帧写完
+        while self.futures and (self.futures[0].done() or len(self.futures) >= self.max_pending):
+            self.futures.popleft().result()
+        self.futures.append(self.executor.submit(self._write_frame, index, frame))
 
-        frame_count += 1
+    def close(self):
+        self.executor.shutdown(wait=True)
+        for future in self.futures:
+            future.result()
 
+    def discard(self):
+        # 写入中途出错时取消尚未开始的编码任务，已保存的图片保留
+        self.executor.shutdown(wait=True, cancel_futures=True)
+
+
+def video_info(video_path, step=4, sample_fps=None, adaptive=None):
+    """
+    读取视频帧率和总帧数，并确定抽帧间隔；自适应抽帧时为探测间隔
+    :return: {'fps', 'frame_count', 'step'}
+    """
+    cap = cv2.VideoCapture(video_path)
+    if adaptive is not None:
+        step, sample_fps = 1, adaptive.get('max_fps', 4)
+    info = {
+        'fps': cap.get(cv2.CAP_PROP_FPS) or 25,
+        'frame_count': int(cap.get(cv2.CAP_PROP_FRAME_COUNT)),
+        'step': sampling_step(cap, step, sample_fps),
+    }
     cap.release()
+    return info
+
+
+def iter_video_frames(video_path, step=4, size=(224, 224), workers=None, seek=False, chunk_size=64, adaptive=None):
+    """
+    抽帧并增强，主线程解码下一批帧的同时线程池增强上一批，同时在内存中的帧数不超过两批
+    :param video_path: 视频路径
+    :param step: 每 step 帧取一帧
+    :param size: 输出帧大小 (宽, 高)
+    :param workers: 线程数，默认由 ThreadPoolExecutor 决定
+    :param seek: 是否通过跳转定位采样帧
+    :param chunk_size: 每批处理的帧数
+    :param adaptive: 传入 dict 时按画面变化抽帧，键为 sample_scene_changes 的参数，此时忽略 step
+    :return: 依次生成 (帧号, 增强后的 BGR 图像)
+    """
+    cap = cv2.VideoCapture(video_path)
+    if adaptive is None:
+        frames = sample_frames(cap, step, seek)
+    else:
+        frames = sample_scene_changes(cap, seek=seek, **adaptive)
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            pending = []
+            while True:
+                batch = list(itertools.islice(frames, chunk_size))
+                # 提交后立即返回，增强与下一批的解码并行进行
+                submitted = [(index, executor.submit(enhance_frame, frame, size)) for index, frame in batch]
+                for index, future in pending:
+                    yield index, future.result()
+                if not submitted:
+                    break
+                pending = submitted
+    finally:
+        cap.release()
+
+
+def write_frames(frames, writer):
+    """
+    把帧写入 writer 后原样传给下游，抽帧结果可以同时保存和用于识别，不必重复解码
+    """
+    for index, frame in frames:
+        writer.write(index, frame)
+        yield index, frame
+    writer.close()
+
+
+def frame_writer(output_folder, output_format, expected_count, size):
+    if output_format == 'npy':
+        return NpyFrameWriter(output_folder, expected_count, size)
+    return ImageFrameWriter(output_folder, f'.{output_format}')
+
+
+def preprocess_video(video_path, output_folder, step=4, sample_fps=None, size=(224, 224),
+                     output_format='npy', workers=None, seek=False, chunk_size=64, adaptive=None):
+    """
+    视频预处理：抽帧、直方图均衡化并缩放后保存
+    :param video_path: 视频路径
+    :param output_folder: 输出文件夹
+    :param step: 每 step 帧取一帧，指定 sample_fps 时忽略
+    :param sample_fps: 每秒抽取的帧数
+    :param size: 输出帧大小 (宽, 高)
+    :param output_format: npy 保存为单个数组文件，jpg / png 保存为逐帧图片
+    :param workers: 线程数
+    :param seek: 是否通过跳转定位采样帧
+    :param chunk_size: 每批处理的帧数，决定同时在内存中的帧数
+    :param adaptive: 传入 dict 时按画面变化抽帧，见 sample_scene_changes
+    :return: 输出文件夹路径
+    """
+    # 确保输出文件夹存在
+    os.makedirs(output_folder, exist_ok=True)
+    info = video_info(video_path, step, sample_fps, adaptive)
+    writer = frame_writer(output_folder, output_format, -(-info['frame_count'] // info['step']), size)
+
+    start_time = time.time()
+    frames = iter_video_frames(video_path, info['step'], size, workers, seek, chunk_size, adaptive)
+    try:
+        sampled = sum(1 for _ in write_frames(frames, writer))
+    finally:
+        writer.discard()
+    report_frame_rate('视频预处理', sampled, info, time.time() - start_time)
     return output_folder
 
 
+def report_frame_rate(stage, sampled, info, elapsed):
+    frames_per_sec = sampled / elapsed if elapsed > 0 else 0.0
+    ratio = sampled / info['frame_count'] if info['frame_count'] else 0.0
+    print(f"{stage}: 共 {info['frame_count']} 帧, 采样 {sampled} 帧 ({ratio:.2%}), "
+          f"耗时 {elapsed:.2f}s, {frames_per_sec:.1f} 帧/秒")
+
+
 action_recog_model_path = r"F:\a\apaper\project\project\algorithm\cv_TAdaConv_action-recognition"
 
-recognition_pipeline = pipeline(Tasks.action_recognition, model=action_recog_model_path)
 
-# 本地视频文件路径，你可以根据实际情况修改
-local_video_path = 'https://modelscope.oss-cn-beijing.aliyuncs.com/test/videos/action_detection_test_video.mp4'
-# 输出图片文件夹路径
-output_folder = r"F:\a\apaper\project\project\algorithm\output_frames"
+def load_recognition_pipeline():
+    from modelscope.pipelines import pipeline
+    from modelscope.utils.constant import Tasks
+    return pipeline(Tasks.action_recognition, model=action_recog_model_path)
+
+registry.register('action_recognition', load_recognition_pipeline, path=action_recog_model_path)
+MODEL_NAMES = ('action_recognition',)
+
+
+def _clip_config(recognition_pipeline):
+    # 从模型配置中读取每个片段的帧数和归一化参数
+    data_cfg = recognition_pipeline.cfg.DATA
+    mean = np.array(getattr(data_cfg, 'MEAN', (0.45, 0.45, 0.45)), dtype=np.float32).reshape(3, 1, 1)
+    std = np.array(getattr(data_cfg, 'STD', (0.225, 0.225, 0.225)), dtype=np.float32).reshape(3, 1, 1)
+    return getattr(data_cfg, 'NUM_INPUT_FRAMES', 8), mean, std
+
+
+def _action_label(recognition_pipeline, class_id):
+    label_mapping = recognition_pipeline.label_mapping
+    if isinstance(label_mapping, dict):
+        return label_mapping.get(str(class_id), label_mapping.get(class_id))
+    return label_mapping[class_id]
+
+
+def iter_clip_windows(frames, window, stride):
+    """
+    在帧序列上滑动固定长度的窗口，帧数不足一个窗口时重复最后一帧补齐
+    :return: 依次生成 (窗口内帧号列表, 窗口内帧列表)
+    """
+    indices, clip = [], []
+    # 上一个窗口之后新加入的帧数
+    fresh = 0
+    for index, frame in frames:
+        indices.append(index)
+        clip.append(frame)
+        fresh += 1
+        if len(clip) == window:
+            yield list(indices), list(clip)
+            fresh = 0
+            del indices[:stride], clip[:stride]
+    if fresh:
+        padding = window - len(clip)
+        yield indices + indices[-1:] * padding, clip + clip[-1:] * padding
+
+
+def recognize_actions(frames, fps, window=None, stride=None, batch_size=8):
+    """
+    基于已抽取的帧做动作识别：滑动窗口切成多个片段，按批送入 TAdaConv 模型，
+    输出每个时间段的动作以及整段视频的动作
+    :param frames: 可迭代的 (帧号, 增强后的 BGR 图像)，如 iter_video_frames 的输出
+    :param fps: 视频帧率，用于把帧号换算为秒
+    :param window: 每个片段的帧数，默认使用模型配置
+    :param stride: 相邻片段的间隔帧数，默认为半个片段
+    :param batch_size: 每次推理的片段数
+    :return: {'labels': 整段视频的动作, 'timeline': [{'start', 'end', 'label', 'score'}]}
+    """
+    import torch
+
+    recognition_pipeline = registry.get('action_recognition')
+    model = recognition_pipeline.infer_model
+    device = next(model.parameters()).device
+    model_window, mean, std = _clip_config(recognition_pipeline)
+    window = window or model_window
+    stride = stride or max(window // 2, 1)
+
+    def to_tensor(frame):
+        # BGR -> RGB，归一化后转为 (C, H, W)
+        return (frame[:, :, ::-1].transpose(2, 0, 1).astype(np.float32) / 255 - mean) / std
+
+    def infer(batch):
+        clips = np.stack([np.stack(clip, axis=1) for _, clip in batch])
+        with torch.no_grad():
+            probs = torch.softmax(model(torch.from_numpy(clips).to(device))[0], dim=-1)
+        return [(indices, prob) for (indices, _), prob in zip(batch, probs.cpu().numpy())]
+
+    start_time = time.time()
+    tensors = ((index, to_tensor(frame)) for index, frame in frames)
+    predictions = []
+    batch = []
+    for clip in iter_clip_windows(tensors, window, stride):
+        batch.append(clip)
+        if len(batch) == batch_size:
+            predictions.extend(infer(batch))
+            batch = []
+    if batch:
+        predictions.extend(infer(batch))
+    if not predictions:
+        return {'labels': None, 'timeline': []}
+
+    timeline = []
+    for indices, prob in predictions:
+        class_id = int(prob.argmax())
+        label = _action_label(recognition_pipeline, class_id)
+        start, end = indices[0] / fps, indices[-1] / fps
+        # 相邻片段动作相同时合并为一段
+        if timeline and timeline[-1]['label'] == label:
+            timeline[-1]['end'] = round(end, 2)
+            timeline[-1]['score'] = max(timeline[-1]['score'], round(float(prob[class_id]), 4))
+        else:
+            timeline.append({'start': round(start, 2), 'end': round(end, 2), 'label': label,
+                             'score': round(float(prob[class_id]), 4)})
+    overall = int(np.mean([prob for _, prob in predictions], axis=0).argmax())
+    print(f"动作识别: {len(predictions)} 个片段, 耗时 {time.time() - start_time:.2f}s")
+    return {'labels': _action_label(recognition_pipeline, overall), 'timeline': timeline}
+
+
+def analyze_video(video_path, output_folder, step=4, sample_fps=None, size=(224, 224),
+                  output_format='npy', window=None, stride=None, batch_size=8, adaptive=None):
+    """
+    只解码一遍视频：抽取的帧一边保存到 output_folder，一边直接送入动作识别
+    :return: recognize_actions 的结果
+    """
+    os.makedirs(output_folder, exist_ok=True)
+    info = video_info(video_path, step, sample_fps, adaptive)
+    writer = frame_writer(output_folder, output_format, -(-info['frame_count'] // info['step']), size)
+    try:
+        frames = write_frames(iter_video_frames(video_path, info['step'], size, adaptive=adaptive), writer)
+        return recognize_actions(frames, info['fps'], window, stride, batch_size)
+    finally:
+        # 解码或识别中途出错时 write_frames 不会执行到 close，删除写了一半的临时文件
+        writer.discard()
+
 
-# 进行视频预处理
-preprocessed_folder = preprocess_video(local_video_path, output_folder)
+if __name__ == "__main__":
+    # 本地视频文件路径，你可以根据实际情况修改
+    local_video_path = 'https://modelscope.oss-cn-beijing.aliyuncs.com/test/videos/action_detection_test_video.mp4'
+    # 输出图片文件夹路径
+    output_folder = r"F:\a\apaper\project\project\algorithm\output_frames"
 
-result = recognition_pipeline(local_video_path)
+    # 进行视频预处理，并用抽取的帧做动作识别
+    result = analyze_video(local_video_path, output_folder)
 
-print(f'recognition output: {result}.')
\ No newline at end of file
+    print(f'recognition output: {result}.')
\ No newline at end of file
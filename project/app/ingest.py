@@ -0,0 +1,144 @@
+# 批量导入：逐个读取 zip / tar 压缩包的成员，流式写入内容寻址存储，按批批量登记 Blob 和 ProjectFile
+import os
+import tarfile
+import zipfile
+
+from django.conf import settings
+from django.db.models.functions import Lower
+
+from .models import ProjectFile
+from .storage import blob_transaction, clean_file_name, commit_blobs, discard_tmp_files, spool_chunks
+
+# 读取压缩包成员的块大小
+MEMBER_CHUNK_SIZE = 1024 * 1024
+
+
+def member_file_name(path):
+    """
+    压缩包内路径 -> 文件名：各级目录用 _ 连接，避免不同目录下的同名文件冲突；
+    与上传接口一样经过 clean_file_name，去掉成员路径中的控制字符和引号
+    :return: 文件名，隐藏文件、系统生成的目录和清理后为空的名称返回 None
+    """
+    parts = [part for part in path.replace('\\', '/').split('/') if part not in ('', '.', '..')]
+    if not parts or parts[-1].startswith('.') or '__MACOSX' in parts:
+        return None
+    return clean_file_name('_'.join(parts))
+
+
+def iter_zip_members(fileobj):
+    with zipfile.ZipFile(fileobj) as archive:
+        for info in archive.infolist():
+            if info.is_dir():
+                continue
+            with archive.open(info) as member:
+                yield info.filename, member
+
+
+def iter_tar_members(fileobj):
+    # r|* 按顺序流式读取，支持 gzip / bz2 / xz 压缩，不需要随机访问，可以直接读取请求体
+    with tarfile.open(fileobj=fileobj, mode='r|*') as archive:
+        for info in archive:
+            # 跳过目录、链接和设备文件
+            if not info.isfile():
+                continue
+            yield info.name, archive.extractfile(info)
+
+
+def iter_archive_members(fileobj, seekable=True):
+    """
+    依次生成 (成员路径, 可 read 的文件对象)，每个成员读完后才读取下一个
+    :param seekable: fileobj 是否支持随机访问；zip 需要读取末尾的目录，只能从可随机访问的文件中读取
+    """
+    if seekable:
+        is_zip = zipfile.is_zipfile(fileobj)
+        fileobj.seek(0)
+        if is_zip:
+            yield from iter_zip_members(fileobj)
+            return
+    yield from iter_tar_members(fileobj)
+
+
+def existing_file_names(project, names):
+    """
+    同一项目内文件名唯一；MySQL 默认排序规则比较时不区分大小写，这里同样不区分大小写查找
+    :return: 该项目已存在、与 names 中某个名称仅大小写不同或完全相同的文件名集合（数据库中的写法）
+    """
+    lowered = list({name.lower() for name in names})
+    return set(
+        ProjectFile.objects.filter(project=project)
+        .annotate(lower_name=Lower('file_name'))
+        .filter(lower_name__in=lowered)
+        .values_list('file_name', flat=True)
+    )
+
+
+def save_files(project, batch):
+    """
+    在一个事务内登记一批已写入临时文件的内容并批量创建 ProjectFile
+    :param batch: [(文件名, 临时文件路径, sha256, 大小, 扩展名)]
+    :return: 创建的文件数
+    """
+    try:
+        with blob_transaction():
+            blobs = commit_blobs([entry[1:] for entry in batch])
+            ProjectFile.objects.bulk_create(
+                [
+                    ProjectFile(project=project, file_name=file_name, local_path=blobs[digest].path, blob=blobs[digest])
+                    for file_name, _, digest, _, _ in batch
+                ],
+                batch_size=settings.INGEST_BATCH_SIZE,
+            )
+    except BaseException:
+        discard_tmp_files([tmp_path for _, tmp_path, _, _, _ in batch])
+        raise
+    return len(batch)
+
+
+def import_archive(project, fileobj, allowed_extensions, seekable=True, batch_size=None):
+    """
+    导入压缩包中的所有文件，扩展名不在 allowed_extensions 中或与已有文件重名的成员跳过
+    每 batch_size 个文件提交一次事务，导入中途失败时已提交的批次保留
+    :param project: 目标项目
+    :param fileobj: 压缩包文件对象
+    :param allowed_extensions: 该项目类型允许的扩展名
+    :param seekable: fileobj 是否支持随机访问
+    :param batch_size: 每批文件数，默认 settings.INGEST_BATCH_SIZE
+    :return: (导入的文件数, 跳过的成员路径列表)
+    """
+    batch_size = batch_size or settings.INGEST_BATCH_SIZE
+    imported = 0
+    skipped = []
+    batch = []
+    members = []
+    # 本次导入已使用的文件名；MySQL 默认排序规则比较时不区分大小写，按小写判断重名
+    seen = set()
+
+    def flush():
+        # 与项目已有文件重名的成员跳过，其余批量登记
+        existing = {name.lower() for name in existing_file_names(project, [entry[0] for entry in batch])}
+        duplicated = [entry[0].lower() in existing for entry in batch]
+        discard_tmp_files([entry[1] for entry, duplicate in zip(batch, duplicated) if duplicate])
+        skipped.extend(path for path, duplicate in zip(members, duplicated) if duplicate)
+        count = save_files(project, [entry for entry, duplicate in zip(batch, duplicated) if not duplicate])
+        batch.clear()
+        members.clear()
+        return count
+
+    try:
+        for path, member in iter_archive_members(fileobj, seekable):
+            file_name = member_file_name(path)
+            extension = os.path.splitext(file_name or '')[1].lower()
+            if file_name is None or extension not in allowed_extensions or file_name.lower() in seen:
+                skipped.append(path)
+                continue
+            seen.add(file_name.lower())
+            tmp_path, digest, size = spool_chunks(iter(lambda: member.read(MEMBER_CHUNK_SIZE), b''))
+            batch.append((file_name, tmp_path, digest, size, extension))
+            members.append(path)
+            if len(batch) >= batch_size:
+                imported += flush()
+        if batch:
+            imported += flush()
+    finally:
+        discard_tmp_files([tmp_path for _, tmp_path, _, _, _ in batch])
+    return imported, skipped
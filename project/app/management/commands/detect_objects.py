@@ -0,0 +1,70 @@
+import itertools
+import json
+import os
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from algorithm.ModelRegistry import registry
+from app.models import Project
+
+
+class Command(BaseCommand):
+    help = '对图像项目中的所有文件批量进行目标检测'
+
+    def add_arguments(self, parser):
+        parser.add_argument('project_name', help='图像项目名称')
+        parser.add_argument(
+            '--format', choices=('per_file', 'columnar'), default='per_file',
+            help='per_file 为每个文件写一个 detections.json，columnar 为整个项目写一个 detections.npz',
+        )
+        parser.add_argument('--batch-size', type=int, default=16, help='每批图像数')
+        parser.add_argument('--workers', type=int, help='解码线程数')
+        parser.add_argument('--conf', type=float, default=0.25, help='置信度阈值')
+
+    def handle(self, *args, **options):
+        from algorithm import ImageProcess
+
+        project = Project.objects.filter(name=options['project_name'], type='image').first()
+        if project is None:
+            raise CommandError('图像项目不存在')
+        model = registry.get('yolov8m')
+        project_dir = os.path.join(settings.RESULT_ROOT, project.name)
+        os.makedirs(project_dir, exist_ok=True)
+
+        # 流式读取文件列表，检测结果与输入顺序一致
+        rows, paths = itertools.tee(
+            project.files.order_by('id').values_list('id', 'file_name', 'local_path').iterator()
+        )
+        all_detections = ImageProcess.detect_objects(
+            model, (local_path for _, _, local_path in paths),
+            batch_size=options['batch_size'], workers=options['workers'], conf=options['conf'],
+        )
+        writer = None
+        if options['format'] == 'columnar':
+            writer = ImageProcess.ColumnarDetectionWriter(os.path.join(project_dir, 'detections.npz'), model.names)
+
+        failed = 0
+        for (file_id, file_name, _), detections in zip(rows, all_detections):
+            if detections is None:
+                failed += 1
+                self.stderr.write(f'{file_name} 无法读取')
+                continue
+            if writer is not None:
+                writer.add(file_id, file_name, detections)
+                continue
+            output_dir = os.path.join(project_dir, file_name)
+            os.makedirs(output_dir, exist_ok=True)
+            # 每个文件写入各自的目录，先写临时文件再改名，多个进程同时运行时不会互相覆盖
+            output_path = os.path.join(output_dir, 'detections.json')
+            tmp_path = f'{output_path}.{os.getpid()}.tmp'
+            try:
+                with open(tmp_path, 'w', encoding='utf-8') as f:
+                    json.dump(ImageProcess.detection_records(detections, model.names), f, ensure_ascii=False, indent=4)
+                os.replace(tmp_path, output_path)
+            except BaseException:
+                os.remove(tmp_path)
+                raise
+        if writer is not None:
+            writer.close()
+        self.stdout.write(f'目标检测完成，{failed} 个文件无法读取')
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from app.storage import expire_upload_sessions
+
+
+class Command(BaseCommand):
+    help = '删除超过 UPLOAD_SESSION_TTL 未继续上传的断点续传会话及其临时文件，可由 cron 定期执行'
+
+    def handle(self, *args, **options):
+        expired = expire_upload_sessions()
+        self.stdout.write(f'已删除 {expired} 个过期的上传会话')
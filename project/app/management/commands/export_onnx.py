@@ -0,0 +1,50 @@
+from importlib import import_module
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from algorithm import InferenceBackend
+from algorithm.ModelRegistry import registry
+
+# 可导出的模型 -> (所在算法模块, 精度对比函数)
+EXPORTABLE_MODELS = {
+    'resnet50': ('algorithm.ImageProcess', 'check_classify_parity'),
+    'yolov8m': ('algorithm.ImageProcess', 'check_detect_parity'),
+    'doclayout_yolo': ('algorithm.PDFProcess', 'check_layout_parity'),
+    'whisper': ('algorithm.AudioProcess', 'check_whisper_parity'),
+}
+
+
+class Command(BaseCommand):
+    help = '把模型导出为 ONNX（可选 INT8 量化）并与 PyTorch 推理结果做精度对比，对比未通过时导出失败'
+
+    def add_arguments(self, parser):
+        parser.add_argument('models', nargs='*', help='要导出的模型，默认全部')
+        parser.add_argument('--int8', action='store_true', help='导出后做动态 INT8 量化')
+        parser.add_argument('--images', nargs='*', default=[], help='用于对比图像和布局模型精度的样例图像，默认使用内置样例')
+        parser.add_argument('--audios', nargs='*', default=[], help='用于对比语音识别模型精度的样例音频，默认使用合成信号')
+
+    def handle(self, *args, **options):
+        names = options['models'] or list(EXPORTABLE_MODELS)
+        unknown = [name for name in names if name not in EXPORTABLE_MODELS]
+        if unknown:
+            raise CommandError(f'不支持导出的模型: {", ".join(unknown)}')
+        InferenceBackend.config.update(
+            backend='onnx-int8' if options['int8'] else 'onnx',
+            intra_op_threads=settings.INFERENCE_INTRA_OP_THREADS,
+            inter_op_threads=settings.INFERENCE_INTER_OP_THREADS,
+        )
+        for name in names:
+            module_name, check_name = EXPORTABLE_MODELS[name]
+            module = import_module(module_name)
+            try:
+                # 加载时完成导出和量化，新导出的模型已对比过一次；已导出的模型也在这里重新对比
+                model = registry.get(name)
+                if name == 'whisper':
+                    samples = [module.load_audio(path) for path in options['audios']]
+                else:
+                    samples = options['images']
+                getattr(module, check_name)(model, samples or None)
+            except InferenceBackend.ParityError as e:
+                raise CommandError(f'{name} 精度对比未通过: {e}')
+            self.stdout.write(f'{name} 已导出到 {InferenceBackend.config["cache_dir"]}')
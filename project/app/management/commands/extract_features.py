@@ -0,0 +1,49 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from app.models import Project
+from app.storage import file_sha256
+
+
+class Command(BaseCommand):
+    help = '批量提取音频项目中所有文件的声学特征，已提取的文件直接跳过'
+
+    def add_arguments(self, parser):
+        parser.add_argument('project_name', help='音频项目名称')
+        parser.add_argument(
+            '--feature', action='append', dest='features', metavar='NAME',
+            help='要提取的特征，可重复指定，默认提取 MFCC、频谱质心、频谱带宽和频谱平坦度',
+        )
+        parser.add_argument('--sr', type=int, help='采样率')
+        parser.add_argument('--n-fft', type=int, help='STFT 窗口长度')
+        parser.add_argument('--hop-length', type=int, help='STFT 帧移')
+        parser.add_argument('--block-frames', type=int, default=2048, help='分块计算时每块的帧数，决定内存占用')
+
+    def handle(self, *args, **options):
+        from algorithm.AudioProcess import DEFAULT_FEATURES, FEATURE_EXTRACTORS, FeatureStore
+
+        project = Project.objects.filter(name=options['project_name'], type='audio').first()
+        if project is None:
+            raise CommandError('音频项目不存在')
+        features = options['features'] or DEFAULT_FEATURES
+        unknown = [name for name in features if name not in FEATURE_EXTRACTORS]
+        if unknown:
+            raise CommandError(f'未知的特征: {", ".join(unknown)}')
+        params = {
+            key: options[key] for key in ('sr', 'n_fft', 'hop_length') if options[key] is not None
+        }
+
+        store = FeatureStore(settings.FEATURE_ROOT)
+        files = project.files.select_related('blob').order_by('id')
+        for project_file in files.iterator():
+            # 内容相同的文件共用同一份特征
+            file_hash = project_file.blob.sha256 if project_file.blob else file_sha256(project_file.local_path)
+            try:
+                result = store.extract(
+                    file_hash, project_file.local_path, features, options['block_frames'], **params
+                )
+            except Exception as e:
+                self.stderr.write(f'{project_file.file_name} 特征提取失败: {e}')
+                continue
+            shapes = ', '.join(f'{name}{tuple(array.shape)}' for name, array in result.items())
+            self.stdout.write(f'{project_file.file_name}: {shapes}')
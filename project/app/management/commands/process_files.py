@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from app.worker import PIPELINES, Scheduler
+
+
+class Command(BaseCommand):
+    help = '启动后台处理进程，按项目类型并行处理所有待处理文件'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--concurrency', action='append', default=[], metavar='TYPE=N',
+            help='覆盖某类型的并发进程数，例如 --concurrency image=8，可重复指定',
+        )
+        parser.add_argument('--poll-interval', type=float, help='轮询待处理文件的间隔（秒）')
+        parser.add_argument('--once', action='store_true', help='处理完当前所有待处理文件后退出')
+
+    def handle(self, *args, **options):
+        concurrency = {}
+        for item in options['concurrency']:
+            project_type, _, workers = item.partition('=')
+            if project_type not in PIPELINES or not workers.isdigit():
+                raise CommandError(f'无效的并发配置: {item}')
+            concurrency[project_type] = int(workers)
+
+        scheduler = Scheduler(concurrency=concurrency, poll_interval=options['poll_interval'])
+        self.stdout.write(f'后台处理已启动，并发配置: {scheduler.concurrency}')
+        scheduler.run(once=options['once'])
+        self.stdout.write('后台处理已退出')
@@ -0,0 +1,44 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from algorithm import InferenceBackend
+from algorithm.InferenceServer import TASKS, InferenceServer
+from algorithm.ModelRegistry import registry
+
+
+class Command(BaseCommand):
+    help = '启动本地推理服务，模型只加载一次，所有工作进程的推理请求合并为动态批次'
+
+    def add_arguments(self, parser):
+        parser.add_argument('tasks', nargs='*', help=f'启用的任务，默认全部：{", ".join(TASKS)}')
+        parser.add_argument('--address', help='Unix socket 路径或 host:port，默认使用 INFERENCE_SERVER_ADDRESS')
+        parser.add_argument('--max-latency', type=float, help='凑批的最长等待时间（秒）')
+        parser.add_argument('--max-batch-size', type=int, help='各任务最大批大小的上限')
+        parser.add_argument('--no-preload', action='store_true', help='不预加载模型，第一次请求时再加载')
+
+    def handle(self, *args, **options):
+        unknown = [task for task in options['tasks'] if task not in TASKS]
+        if unknown:
+            raise CommandError(f'未知的任务: {", ".join(unknown)}')
+        address = options['address'] or settings.INFERENCE_SERVER_ADDRESS
+        if not address:
+            raise CommandError('未配置推理服务地址，请设置 INFERENCE_SERVER_ADDRESS 或使用 --address')
+        if isinstance(address, str) and ':' in address and not address.startswith('/'):
+            host, _, port = address.rpartition(':')
+            address = (host, int(port))
+
+        if settings.MODEL_REGISTRY_MAX_MEMORY:
+            registry.max_memory = settings.MODEL_REGISTRY_MAX_MEMORY
+        InferenceBackend.config.update(
+            backend=settings.INFERENCE_BACKEND,
+            intra_op_threads=settings.INFERENCE_INTRA_OP_THREADS,
+            inter_op_threads=settings.INFERENCE_INTER_OP_THREADS,
+        )
+        server = InferenceServer(
+            address, settings.INFERENCE_SERVER_AUTHKEY.encode(), tasks=options['tasks'],
+            max_latency=options['max_latency'] or settings.INFERENCE_SERVER_MAX_LATENCY,
+            max_batch_size=options['max_batch_size'], timeout=settings.INFERENCE_SERVER_TIMEOUT,
+        )
+        if not options['no_preload']:
+            server.preload()
+        server.serve_forever()
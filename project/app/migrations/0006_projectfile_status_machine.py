@@ -0,0 +1,114 @@
+# Generated by Django 4.2.30 on 2026-10-18 19:47
+
+from django.db import migrations, models
+import django.utils.timezone
+
+# 旧的中文状态 -> 新的状态值；迁移时调度器不在运行，处理中的文件重新排队
+STATUS_MAPPING = {
+    "待处理": "pending",
+    "处理中": "pending",
+    "已处理": "done",
+    "处理失败": "failed",
+}
+
+
+def rename_duplicate_projects(apps, schema_editor):
+    # 名称改为唯一之前，重名项目除最早创建的一个外加上 id 后缀
+    Project = apps.get_model("app", "Project")
+    seen = set()
+    for project in Project.objects.order_by("id"):
+        if project.name in seen:
+            project.name = f"{project.name[:240]}-{project.id}"
+            project.save(update_fields=["name"])
+        seen.add(project.name)
+
+
+def convert_status(apps, schema_editor):
+    ProjectFile = apps.get_model("app", "ProjectFile")
+    for old, new in STATUS_MAPPING.items():
+        ProjectFile.objects.filter(status=old).update(status=new)
+    ProjectFile.objects.exclude(status__in=["pending", "done", "failed"]).update(
+        status="pending"
+    )
+
+
+def restore_status(apps, schema_editor):
+    ProjectFile = apps.get_model("app", "ProjectFile")
+    for new, old in [
+        ("pending", "待处理"),
+        ("claimed", "待处理"),
+        ("running", "待处理"),
+        ("done", "已处理"),
+        ("failed", "处理失败"),
+    ]:
+        ProjectFile.objects.filter(status=new).update(status=old)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("app", "0005_uploadsession"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="projectfile",
+            name="attempts",
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="projectfile",
+            name="claimed_at",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="projectfile",
+            name="created_at",
+            field=models.DateTimeField(
+                auto_now_add=True, default=django.utils.timezone.now
+            ),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name="projectfile",
+            name="error",
+            field=models.TextField(blank=True, default=""),
+        ),
+        migrations.AddField(
+            model_name="projectfile",
+            name="started_at",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.RunPython(rename_duplicate_projects, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name="project",
+            name="name",
+            field=models.CharField(max_length=255, unique=True),
+        ),
+        migrations.RunPython(convert_status, restore_status),
+        migrations.AlterField(
+            model_name="projectfile",
+            name="status",
+            field=models.CharField(
+                choices=[
+                    ("pending", "待处理"),
+                    ("claimed", "已认领"),
+                    ("running", "处理中"),
+                    ("done", "已处理"),
+                    ("failed", "处理失败"),
+                ],
+                default="pending",
+                max_length=20,
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="projectfile",
+            index=models.Index(
+                fields=["project", "file_name"], name="projectfile_project_name_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="projectfile",
+            index=models.Index(fields=["status", "id"], name="projectfile_status_idx"),
+        ),
+    ]
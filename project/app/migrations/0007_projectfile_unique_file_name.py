@@ -0,0 +1,42 @@
+# Generated by Django 4.2.30 on 2026-10-18 19:59
+
+import os
+
+from django.db import migrations, models
+
+
+def rename_duplicate_files(apps, schema_editor):
+    # 文件名改为项目内唯一之前，重名文件除最早创建的一个外在扩展名前加上 id 后缀
+    # MySQL 默认排序规则比较时不区分大小写，按小写判断重名
+    ProjectFile = apps.get_model("app", "ProjectFile")
+    seen = set()
+    for project_file in ProjectFile.objects.order_by("id").only("id", "project_id", "file_name").iterator():
+        key = (project_file.project_id, project_file.file_name.lower())
+        if key in seen:
+            stem, extension = os.path.splitext(project_file.file_name)
+            project_file.file_name = f"{stem[:240 - len(extension)]}-{project_file.id}{extension}"
+            project_file.save(update_fields=["file_name"])
+            key = (project_file.project_id, project_file.file_name.lower())
+        seen.add(key)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("app", "0006_projectfile_status_machine"),
+    ]
+
+    operations = [
+        migrations.RunPython(rename_duplicate_files, migrations.RunPython.noop),
+        # 先建唯一约束再删除普通索引，project 外键列始终有索引可用
+        migrations.AddConstraint(
+            model_name="projectfile",
+            constraint=models.UniqueConstraint(
+                fields=("project", "file_name"), name="projectfile_project_name_uniq"
+            ),
+        ),
+        migrations.RemoveIndex(
+            model_name="projectfile",
+            name="projectfile_project_name_idx",
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 4.2.30 on 2026-10-18 21:10
+
+from django.db import migrations, models
+from django.db.models.functions import Coalesce
+
+
+def fill_heartbeat(apps, schema_editor):
+    # 已认领和处理中的文件以开始处理或认领的时间作为最近一次心跳
+    ProjectFile = apps.get_model("app", "ProjectFile")
+    ProjectFile.objects.filter(status__in=["claimed", "running"]).update(
+        heartbeat_at=Coalesce("started_at", "claimed_at")
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("app", "0007_projectfile_unique_file_name"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="projectfile",
+            name="heartbeat_at",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.RunPython(fill_heartbeat, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 4.2.30 on 2026-10-18 23:40
+
+import app.models
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("app", "0008_projectfile_heartbeat_at"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="uploadsession",
+            name="expires_at",
+            field=models.DateTimeField(db_index=True, default=app.models.upload_session_expiry),
+        ),
+    ]
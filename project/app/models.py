@@ -1,8 +1,14 @@
 # 2222/project/app/models.py
+import uuid
+from datetime import timedelta
+
+from django.conf import settings
 from django.db import models
+from django.utils import timezone
 
 class Project(models.Model):
-    name = models.CharField(max_length=255)
+    # 视图都按名称查找项目，名称唯一并带索引
+    name = models.CharField(max_length=255, unique=True)
     created_at = models.DateTimeField(auto_now_add=True)
     # 新增 type 字段，使用 CharField 并设置 choices 参数
     TYPE_CHOICES = [
@@ -14,9 +20,68 @@ class Project(models.Model):
     type = models.CharField(max_length=20, choices=TYPE_CHOICES, default='text')
 
 
+# 内容寻址存储的文件实体，相同内容只在磁盘上保存一份
+class Blob(models.Model):
+    sha256 = models.CharField(max_length=64, unique=True)
+    size = models.BigIntegerField()
+    path = models.CharField(max_length=255)
+    # 引用该内容的 ProjectFile 数量，降为 0 时删除磁盘文件
+    ref_count = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+
 class ProjectFile(models.Model):
+    # 文件处理状态：待处理 -> 已认领（进入调度队列）-> 处理中（工作进程已开始）-> 已处理 / 处理失败
+    class Status(models.TextChoices):
+        PENDING = 'pending', '待处理'
+        CLAIMED = 'claimed', '已认领'
+        RUNNING = 'running', '处理中'
+        DONE = 'done', '已处理'
+        FAILED = 'failed', '处理失败'
+
     project = models.ForeignKey(Project, on_delete=models.CASCADE, related_name='files')
     file_name = models.CharField(max_length=255)
-    status = models.CharField(max_length=20, default='待处理')
+    status = models.CharField(max_length=20, choices=Status.choices, default=Status.PENDING)
+    # 已认领的次数，失败后重新排队时累加
+    attempts = models.PositiveIntegerField(default=0)
+    # 最近一次处理失败的原因
+    error = models.TextField(blank=True, default='')
+    created_at = models.DateTimeField(auto_now_add=True)
+    claimed_at = models.DateTimeField(null=True, blank=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    # 调度器为已认领和处理中的文件定期刷新的心跳时间，长时间未刷新说明调度器已退出
+    heartbeat_at = models.DateTimeField(null=True, blank=True)
+    # 处理结束（成功或失败）的时间
     processed_at = models.DateTimeField(null=True, blank=True)
-    local_path = models.CharField(max_length=255, null=True, blank=True)
\ No newline at end of file
+    local_path = models.CharField(max_length=255, null=True, blank=True)
+    blob = models.ForeignKey(Blob, on_delete=models.PROTECT, related_name='files', null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            # 调度器按状态取最早的待处理文件
+            models.Index(fields=['status', 'id'], name='projectfile_status_idx'),
+        ]
+        constraints = [
+            # 同一项目内文件名唯一，结果目录按文件名创建；也用于按项目和文件名读取文件内容
+            models.UniqueConstraint(fields=['project', 'file_name'], name='projectfile_project_name_uniq'),
+        ]
+
+
+def upload_session_expiry():
+    return timezone.now() + timedelta(seconds=settings.UPLOAD_SESSION_TTL)
+
+
+# 断点续传的上传会话，完成前不会创建 ProjectFile
+class UploadSession(models.Model):
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    project = models.ForeignKey(Project, on_delete=models.CASCADE, related_name='upload_sessions')
+    file_name = models.CharField(max_length=255)
+    size = models.BigIntegerField()
+    # 客户端声明的整个文件的 sha256，可为空
+    sha256 = models.CharField(max_length=64, blank=True, default='')
+    # 已接收的字节区间，按起点排序并合并，形如 [[0, 1048576], [2097152, 3145728]]
+    received = models.JSONField(default=list)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    # 每次接收分块后顺延，过期后会话和临时文件由 expire_uploads 命令删除
+    expires_at = models.DateTimeField(default=upload_session_expiry, db_index=True)
\ No newline at end of file
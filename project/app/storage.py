@@ -0,0 +1,284 @@
+# 内容寻址的上传文件存储：按 sha256 保存，相同内容只写一份，删除时按引用计数回收
+import hashlib
+import os
+import shutil
+import tempfile
+import threading
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+from django.utils.text import get_valid_filename
+
+from .models import Blob, UploadSession
+
+
+def blob_path(digest, extension=''):
+    # 按哈希前两位分目录，避免单个目录下文件过多
+    return os.path.join(settings.BLOB_ROOT, digest[:2], digest + extension)
+
+
+def clean_file_name(name):
+    """
+    清理客户端提供的文件名：只保留最后一级并去掉特殊字符，结果目录按文件名创建，不能包含路径
+    :return: 安全的文件名，无效时返回 None
+    """
+    try:
+        name = get_valid_filename(os.path.basename(str(name).replace('\\', '/')))
+    except SuspiciousFileOperation:
+        return None
+    return name if len(name) <= 255 else None
+
+
+# 当前线程中尚未结束的 blob_transaction，每层记录本层移入内容寻址目录的文件
+_blob_moves = threading.local()
+
+
+@contextmanager
+def blob_transaction():
+    """
+    登记 Blob 的事务：commit_blob / commit_blobs 在事务内就把临时文件移动到最终位置，
+    事务因异常回滚时在释放行锁之前把本事务移入的文件移回临时路径，不会留下没有记录的文件；
+    嵌套使用时内层提交的移动交给外层，外层回滚时一并撤销
+    """
+    stack = _blob_moves.__dict__.setdefault('stack', [])
+    moves = []
+    stack.append(moves)
+    try:
+        with transaction.atomic():
+            try:
+                yield
+            except BaseException:
+                for tmp_path, path in reversed(moves):
+                    if os.path.exists(path):
+                        os.replace(path, tmp_path)
+                raise
+    finally:
+        stack.pop()
+    if stack:
+        stack[-1].extend(moves)
+
+
+def _place_blob_file(tmp_path, path):
+    # 内容已存在时丢弃临时文件，否则移动到最终位置并登记到当前事务
+    if os.path.exists(path):
+        os.remove(tmp_path)
+        return
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    os.replace(tmp_path, path)
+    _blob_moves.stack[-1].append((tmp_path, path))
+
+
+def commit_blob(tmp_path, digest, size, extension):
+    """
+    把已写完的临时文件登记为 Blob：内容已存在时丢弃临时文件，否则移动到最终位置
+    在外层事务中调用时应使用 blob_transaction，外层回滚时移入的文件会被移回临时路径
+    :return: 引用计数已加一的 Blob
+    """
+    with blob_transaction():
+        blob, created = Blob.objects.select_for_update().get_or_create(
+            sha256=digest,
+            defaults={'size': size, 'path': blob_path(digest, extension)}
+        )
+        _place_blob_file(tmp_path, blob.path)
+        Blob.objects.filter(pk=blob.pk).update(ref_count=F('ref_count') + 1)
+    return blob
+
+
+def commit_blobs(entries):
+    """
+    commit_blob 的批量版本：在一个事务内登记一批临时文件，查询次数与批大小无关
+    :param entries: [(临时文件路径, sha256, 大小, 扩展名)]，同一内容可以出现多次
+    :return: {sha256: Blob}，每个条目都为对应的 Blob 增加一个引用
+    """
+    counts = Counter(digest for _, digest, _, _ in entries)
+    new_blobs = {}
+    for _, digest, size, extension in entries:
+        new_blobs.setdefault(digest, Blob(sha256=digest, size=size, path=blob_path(digest, extension)))
+    with blob_transaction():
+        # 已存在的内容跳过插入，再统一加行锁读取；插入后、加锁前被并发的 release_blob 删除的记录重新插入
+        blobs = {}
+        missing = list(counts)
+        while missing:
+            Blob.objects.bulk_create([new_blobs[digest] for digest in missing], ignore_conflicts=True)
+            blobs.update(
+                (blob.sha256, blob) for blob in Blob.objects.select_for_update().filter(sha256__in=missing)
+            )
+            missing = [digest for digest in missing if digest not in blobs]
+        for tmp_path, digest, _, _ in entries:
+            _place_blob_file(tmp_path, blobs[digest].path)
+        # 引用数相同的 Blob 用一条 UPDATE 更新
+        ids_by_count = defaultdict(list)
+        for digest, count in counts.items():
+            ids_by_count[count].append(blobs[digest].pk)
+        for count, ids in ids_by_count.items():
+            Blob.objects.filter(pk__in=ids).update(ref_count=F('ref_count') + count)
+    return blobs
+
+
+def file_sha256(path, chunk_size=1024 * 1024):
+    sha256 = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+def in_thread(func):
+    """
+    在异步视图中调用阻塞的文件操作：放到线程池执行，不阻塞事件循环，也不占用 ORM 使用的线程
+    """
+    return sync_to_async(func, thread_sensitive=False)
+
+
+def spool_chunks(chunks):
+    """
+    把数据块写入临时文件，写入的同时计算 sha256
+    :param chunks: bytes 的可迭代对象
+    :return: (临时文件路径, sha256, 大小)
+    """
+    tmp_dir = os.path.join(settings.BLOB_ROOT, 'tmp')
+    os.makedirs(tmp_dir, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=tmp_dir)
+    sha256 = hashlib.sha256()
+    size = 0
+    try:
+        with os.fdopen(fd, 'wb') as destination:
+            for chunk in chunks:
+                sha256.update(chunk)
+                destination.write(chunk)
+                size += len(chunk)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+    return tmp_path, sha256.hexdigest(), size
+
+
+def spool_upload(file):
+    """
+    :param file: Django UploadedFile
+    :return: (临时文件路径, sha256, 大小)
+    """
+    return spool_chunks(file.chunks())
+
+
+def discard_tmp_files(paths):
+    # 导入失败时删除尚未登记的临时文件
+    for path in paths:
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def acquire_blob(digest):
+    """
+    按哈希引用已存在的内容，客户端已知哈希时可以跳过上传
+    :return: 引用计数已加一的 Blob，内容不存在时返回 None
+    """
+    with transaction.atomic():
+        blob = Blob.objects.select_for_update().filter(sha256=digest.lower()).first()
+        if blob is None or not os.path.exists(blob.path):
+            return None
+        Blob.objects.filter(pk=blob.pk).update(ref_count=F('ref_count') + 1)
+    return blob
+
+
+def release_blob(blob_id, count=1):
+    """
+    释放 count 个引用，引用计数降为 0 时删除记录和磁盘文件
+    需要在引用它的 ProjectFile 删除之后调用
+    """
+    with transaction.atomic():
+        blob = Blob.objects.select_for_update().filter(pk=blob_id).first()
+        if blob is None:
+            return
+        if blob.ref_count > count:
+            Blob.objects.filter(pk=blob.pk).update(ref_count=F('ref_count') - count)
+            return
+        # 在持有行锁时删除文件，避免并发上传相同内容时误删新写入的文件
+        if os.path.exists(blob.path):
+            os.remove(blob.path)
+        blob.delete()
+
+
+# 断点续传分块在内存中缓冲的上限（字节），超出时缓冲到临时文件
+CHUNK_MEMORY_LIMIT = 8 * 1024 * 1024
+
+
+def upload_tmp_path(upload_id):
+    # 断点续传的数据直接写入该文件，完成后整体移动到内容寻址目录
+    return os.path.join(settings.BLOB_ROOT, 'tmp', f'upload-{upload_id}')
+
+
+def expire_upload_sessions():
+    """
+    删除已过期的断点续传会话及其临时文件；逐个删除，正在完成的会话持有行锁，完成后已不存在，不会误删文件
+    :return: 删除的会话数
+    """
+    now = timezone.now()
+    expired = 0
+    for upload_id in UploadSession.objects.filter(expires_at__lt=now).values_list('id', flat=True):
+        deleted, _ = UploadSession.objects.filter(id=upload_id, expires_at__lt=now).delete()
+        if not deleted:
+            continue
+        tmp_path = upload_tmp_path(upload_id)
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        expired += 1
+    return expired
+
+
+def read_chunk(stream, length, chunk_size=64 * 1024):
+    """
+    把请求体读入临时缓冲区，边读边计算 sha256；分块校验通过后再用 write_chunk 写入目标文件，
+    校验失败的重传不会覆盖已接收的数据
+    :param stream: 可 read(n) 的请求流
+    :param length: 期望读取的字节数
+    :return: (缓冲区文件对象, sha256, 实际读取字节数)，调用方负责关闭缓冲区
+    """
+    tmp_dir = os.path.join(settings.BLOB_ROOT, 'tmp')
+    os.makedirs(tmp_dir, exist_ok=True)
+    # 小于 CHUNK_MEMORY_LIMIT 的分块留在内存中，更大的分块写入临时文件
+    buffer = tempfile.SpooledTemporaryFile(max_size=CHUNK_MEMORY_LIMIT, dir=tmp_dir)
+    sha256 = hashlib.sha256()
+    received = 0
+    try:
+        while received < length:
+            data = stream.read(min(chunk_size, length - received))
+            if not data:
+                break
+            sha256.update(data)
+            buffer.write(data)
+            received += len(data)
+    except BaseException:
+        buffer.close()
+        raise
+    return buffer, sha256.hexdigest(), received
+
+
+def write_chunk(path, offset, buffer, chunk_size=1024 * 1024):
+    """
+    把已校验的分块从 offset 处写入文件
+    :param buffer: read_chunk 返回的缓冲区
+    """
+    buffer.seek(0)
+    with open(path, 'r+b') as f:
+        f.seek(offset)
+        shutil.copyfileobj(buffer, f, chunk_size)
+
+
+def merge_range(ranges, start, end):
+    """
+    把 [start, end) 合并进已排序的区间列表
+    """
+    merged = []
+    for range_start, range_end in sorted(ranges + [[start, end]]):
+        if merged and range_start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], range_end)
+        else:
+            merged.append([range_start, range_end])
+    return merged
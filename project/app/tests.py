@@ -1,3 +1,1438 @@
-from django.test import TestCase
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+import types
+import zipfile
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import timedelta
+from importlib import import_module
+from io import StringIO
+from unittest import mock, skipUnless
 
-# Create your tests here.
+import numpy as np
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.utils import timezone
+
+from algorithm import InferenceBackend
+from algorithm.ModelRegistry import ModelRegistry
+from algorithm.ResultCache import ResultCache
+
+from .ingest import import_archive, member_file_name
+from .models import Blob, Project, ProjectFile, UploadSession
+from .storage import clean_file_name, commit_blob, commit_blobs, merge_range, spool_chunks, upload_tmp_path
+from .views import parse_range, upload_complete
+from .worker import Scheduler, cache_key, get_result_cache, process_image, process_image_batch, run_pipeline
+
+
+def importable(*names):
+    # 算法模块依赖的库未安装时跳过对应测试
+    for name in names:
+        try:
+            import_module(name)
+        except ImportError:
+            return False
+    return True
+
+
+class TempStorageMixin:
+    # 上传文件和处理结果写到临时目录，测试结束后删除
+    def setUp(self):
+        super().setUp()
+        self.storage_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.storage_root, ignore_errors=True)
+        storage_settings = override_settings(
+            BLOB_ROOT=os.path.join(self.storage_root, 'blobs'),
+            RESULT_ROOT=os.path.join(self.storage_root, 'results'),
+            RESULT_CACHE_ROOT=os.path.join(self.storage_root, 'cache'),
+        )
+        storage_settings.enable()
+        self.addCleanup(storage_settings.disable)
+        get_result_cache.cache_clear()
+        self.addCleanup(get_result_cache.cache_clear)
+
+
+class StubOcr:
+    # 只实现批量 OCR 用到的接口：整页检测返回固定的文字行，识别器返回每个图像块的高度
+    use_angle_cls = False
+
+    def __init__(self, lines):
+        self.lines = lines
+        self.recognizer_calls = []
+
+    def ocr(self, image, det=True, rec=True, cls=True):
+        return [self.lines]
+
+    def text_recognizer(self, crops):
+        self.recognizer_calls.append(len(crops))
+        return [(f'h{crop.shape[0]}', 0.9) for crop in crops], 0.0
+
+
+def quad(x1, y1, x2, y2):
+    return [[x1, y1], [x2, y1], [x2, y2], [x1, y2]]
+
+
+@skipUnless(importable('fitz', 'cv2'), '需要 PyMuPDF 和 OpenCV')
+class OcrRegionsBatchedTests(SimpleTestCase):
+    def test_each_crop_gets_its_own_text_in_order(self):
+        from algorithm import PDFProcess
+        image = np.zeros((200, 100, 3), dtype=np.uint8)
+        # 文字行高度各不相同，识别结果可以对应回具体的行
+        ocr = StubOcr([
+            quad(0, 30, 90, 41), quad(0, 10, 90, 20), quad(0, 50, 90, 62),
+            quad(0, 120, 90, 133), quad(0, 150, 90, 164),
+        ])
+        texts = PDFProcess.ocr_regions_batched(ocr, image, {0: (0, 0, 100, 99), 1: (0, 100, 100, 200)})
+        self.assertEqual(ocr.recognizer_calls, [5])
+        self.assertEqual(texts[0][0], 'h10 h11 h12')
+        self.assertEqual(texts[1][0], 'h13 h14')
+
+    def test_skewed_lines_are_rectified(self):
+        from algorithm import PDFProcess
+        image = np.zeros((200, 200, 3), dtype=np.uint8)
+        # 倾斜的文字行：宽约 100、高约 10，外接矩形高约 60
+        ocr = StubOcr([[[10, 60], [96, 10], [101, 19], [15, 69]]])
+        texts = PDFProcess.ocr_regions_batched(ocr, image, {0: (0, 0, 200, 200)})
+        self.assertEqual(texts[0][0], 'h10')
+
+    def test_low_confidence_results_are_dropped(self):
+        from algorithm import PDFProcess
+        ocr = StubOcr([quad(0, 10, 90, 20), quad(0, 30, 90, 41)])
+        ocr.drop_score = 0.5
+        ocr.text_recognizer = lambda crops: ([('noise', 0.2), ('text', 0.8)], 0.0)
+        texts = PDFProcess.ocr_regions_batched(ocr, np.zeros((100, 100, 3), dtype=np.uint8), {0: (0, 0, 100, 100)})
+        self.assertEqual(texts, {0: ('text', 0.8)})
+
+    def test_no_lines(self):
+        from algorithm import PDFProcess
+        ocr = StubOcr([])
+        self.assertEqual(PDFProcess.ocr_regions_batched(ocr, np.zeros((10, 10, 3), dtype=np.uint8), {0: (0, 0, 10, 10)}), {})
+        self.assertEqual(ocr.recognizer_calls, [])
+
+
+def speech_audio(sr, pattern):
+    # pattern 为 (静音秒数, 语音秒数) 序列，语音用等幅正弦信号代替
+    parts = []
+    for silence, speech in pattern:
+        parts.append(np.zeros(int(silence * sr), dtype=np.float32))
+        parts.append((0.5 * np.sin(np.arange(int(speech * sr)) / 5)).astype(np.float32))
+    return np.concatenate(parts)
+
+
+class SpeechWindowTests(SimpleTestCase):
+    sr = 16000
+
+    def test_detect_speech_merges_short_silence_and_pads(self):
+        from algorithm import AudioProcess
+        audio = speech_audio(self.sr, [(1, 2), (0.3, 1), (2, 0.1), (1.5, 1)])
+        segments = AudioProcess.detect_speech(audio, self.sr)
+        # 0.3 秒的停顿不切分，0.1 秒的片段丢弃，片段前后各保留 0.2 秒
+        self.assertEqual(len(segments), 2)
+        self.assertAlmostEqual(segments[0][0] / self.sr, 0.8, delta=0.05)
+        self.assertAlmostEqual(segments[0][1] / self.sr, 4.5, delta=0.05)
+        self.assertEqual(segments[1][1], len(audio))
+
+    def test_plan_windows_splits_long_regions_with_overlap(self):
+        from algorithm import AudioProcess
+        sr = self.sr
+        windows = AudioProcess.plan_windows([(0, 10 * sr), (12 * sr, 25 * sr), (40 * sr, 110 * sr)], sr)
+        self.assertEqual(windows[0], (0, 25 * sr, 0, 25 * sr))
+        long_windows = windows[1:]
+        self.assertEqual(long_windows[0][:2], (40 * sr, 70 * sr))
+        self.assertEqual(long_windows[-1][1], 110 * sr)
+        # 负责区间首尾相接，覆盖整个区域且没有重叠
+        for previous, current in zip(long_windows, long_windows[1:]):
+            self.assertEqual(previous[3], current[2])
+            self.assertLess(current[0], previous[1])
+        self.assertTrue(all(end - start <= 30 * sr for start, end, _, _ in windows))
+
+    def test_streaming_windows_match_whole_file(self):
+        from algorithm import AudioProcess
+        rng = np.random.default_rng(0)
+        audio = speech_audio(self.sr, [(rng.uniform(0.1, 3), rng.uniform(0.1, 20)) for _ in range(30)])
+        expected = AudioProcess.plan_windows(AudioProcess.detect_speech(audio, self.sr), self.sr)
+        for block_size in (37, 16000, 30 * 16000):
+            detector = AudioProcess.StreamingSpeechDetector(self.sr)
+            blocks = (audio[i:i + block_size] for i in range(0, len(audio), block_size))
+            windows = list(AudioProcess.iter_speech_windows(blocks, detector))
+            self.assertEqual([window[1:] for window in windows], expected)
+            for window_audio, start, end, _, _ in windows:
+                np.testing.assert_array_equal(window_audio, audio[start:end])
+            self.assertEqual(detector.total, len(audio))
+
+    def test_leading_noise_is_not_speech(self):
+        from algorithm import AudioProcess
+        # 语音之前 2 秒约 -70 dB 的底噪
+        noise = np.random.default_rng(0).normal(0, 3e-4, 2 * self.sr).astype(np.float32)
+        audio = np.concatenate((noise, speech_audio(self.sr, [(0, 2), (1, 1)])))
+        expected = AudioProcess.detect_speech(audio, self.sr)
+        self.assertAlmostEqual(expected[0][0] / self.sr, 1.8, delta=0.05)
+        detector = AudioProcess.StreamingSpeechDetector(self.sr)
+        segments = []
+        for i in range(0, len(audio), 4000):
+            segments.extend(detector.feed(audio[i:i + 4000]))
+        segments.extend(detector.finish())
+        self.assertEqual(segments, expected)
+
+
+class StubWhisperProcessor:
+    # 与 Whisper 一样把每段音频补齐到固定长度，特征只保留前几个采样点
+    frames = 4
+
+    def __call__(self, audios, sampling_rate, return_tensors):
+        import torch
+        features = torch.zeros(len(audios), self.frames)
+        for row, audio in enumerate(audios):
+            head = torch.as_tensor(audio[:self.frames], dtype=torch.float32)
+            features[row, :len(head)] = head
+        return types.SimpleNamespace(input_features=features)
+
+    def get_decoder_prompt_ids(self, language, task):
+        return [(1, 0)]
+
+    def batch_decode(self, ids, skip_special_tokens):
+        # 0 为补齐用的特殊标记
+        return [' '.join(str(token) for token in row.tolist() if token or not skip_special_tokens) for row in ids]
+
+
+class StubWhisperModel:
+    def __init__(self):
+        import torch
+        self.device = torch.device('cpu')
+        self.batches = []
+
+    def generate(self, inputs, forced_decoder_ids):
+        # 每段输出的标记数随内容变化，批内较短的输出用 0 补齐
+        self.batches.append(len(inputs))
+        ids = (inputs * 10).long().clamp(min=0) + 1
+        lengths = (inputs > 0).sum(dim=1).clamp(min=1)
+        for row, length in enumerate(lengths.tolist()):
+            ids[row, length:] = 0
+        return ids
+
+
+@skipUnless(importable('torch'), '需要 PyTorch')
+class TranscribeBatchTests(SimpleTestCase):
+    def test_batched_matches_per_file(self):
+        from algorithm import AudioProcess
+        rng = np.random.default_rng(0)
+        audios = [rng.uniform(0.05, 1, size).astype(np.float32) for size in (4, 1, 3, 6, 2)]
+        processor = StubWhisperProcessor()
+        model = StubWhisperModel()
+        with mock.patch.object(AudioProcess.registry, 'get', return_value=processor), \
+                mock.patch.object(AudioProcess, 'get_device', return_value=model.device):
+            single = [AudioProcess.transcribe_batch(model, [audio], batch_size=1)[0] for audio in audios]
+            batched = AudioProcess.transcribe_batch(model, audios, batch_size=2)
+        self.assertEqual(batched, single)
+        self.assertEqual(len(set(single)), len(audios))
+        self.assertEqual(model.batches, [1] * len(audios) + [2, 2, 1])
+
+
+@skipUnless(importable('librosa', 'soundfile'), '需要 librosa 和 soundfile')
+class AcousticFeatureTests(SimpleTestCase):
+    sr = 16000
+
+    def setUp(self):
+        self.audio = speech_audio(self.sr, [(0.3, 1.2), (0.5, 0.7)])
+        self.audio += np.random.default_rng(0).normal(0, 0.01, self.audio.shape).astype(np.float32)
+        # 开头的数字静音比最大能量低 80dB 以上，MFCC 的截断会生效
+        self.audio[:self.sr // 5] = 0
+
+    def test_streamed_stft_matches_whole_file(self):
+        import librosa
+        from algorithm import AudioProcess
+        expected = np.abs(librosa.stft(self.audio, n_fft=2048, hop_length=512, center=True, pad_mode='constant'))
+        for block_size, block_frames in ((37, 5), (16000, 7), (len(self.audio), 2048)):
+            with self.subTest(block_size=block_size, block_frames=block_frames):
+                blocks = (self.audio[i:i + block_size] for i in range(0, len(self.audio), block_size))
+                spectrogram = np.zeros_like(expected)
+                for first, S in AudioProcess.iter_spectrogram_blocks(blocks, 2048, 512, block_frames):
+                    spectrogram[:, first:first + S.shape[1]] = S
+                    last = first + S.shape[1]
+                self.assertEqual(last, expected.shape[1])
+                np.testing.assert_allclose(spectrogram, expected, rtol=1e-5, atol=1e-5)
+
+    def test_features_match_librosa_defaults(self):
+        import librosa
+        from algorithm import AudioProcess
+        blocks = [self.audio[i:i + 5000] for i in range(0, len(self.audio), 5000)]
+        features = AudioProcess.extract_features(blocks, block_frames=7, sr=self.sr)
+        # 与直接调用 librosa 的结果一致，MFCC 同样按整段最大值做 80dB 截断
+        expected = {
+            'mfcc': librosa.feature.mfcc(y=self.audio, sr=self.sr, n_mfcc=13),
+            'spectral_centroid': librosa.feature.spectral_centroid(y=self.audio, sr=self.sr),
+            'spectral_bandwidth': librosa.feature.spectral_bandwidth(y=self.audio, sr=self.sr),
+            'spectral_flatness': librosa.feature.spectral_flatness(y=self.audio),
+        }
+        for name, values in expected.items():
+            with self.subTest(name=name):
+                self.assertEqual(features[name].shape, values.shape)
+                np.testing.assert_allclose(features[name], values, rtol=1e-3, atol=1e-3)
+
+    def test_feature_store_streams_audio_file(self):
+        import soundfile as sf
+        from algorithm import AudioProcess
+        root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, root)
+        audio_path = os.path.join(root, 'a.wav')
+        sf.write(audio_path, self.audio, self.sr, subtype='FLOAT')
+        store = AudioProcess.FeatureStore(os.path.join(root, 'features'))
+        self.assertIsNone(store.load('ab' * 32))
+        stored = store.extract('ab' * 32, audio_path, block_frames=7)
+        expected = AudioProcess.extract_features([self.audio])
+        for name in AudioProcess.DEFAULT_FEATURES:
+            np.testing.assert_allclose(stored[name], expected[name], rtol=1e-5, atol=1e-5)
+        directory = store.directory('ab' * 32, AudioProcess.FEATURE_PARAMS)
+        self.assertEqual(sorted(os.listdir(directory)), sorted([f'{name}.npy' for name in AudioProcess.DEFAULT_FEATURES] + ['params.json']))
+
+    def test_feature_store_uses_private_temp_files(self):
+        from algorithm import AudioProcess
+        root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, root)
+        store = AudioProcess.FeatureStore(root)
+        paths = []
+
+        def failing_extract(blocks, features, block_frames, allocate, **params):
+            array = allocate('mfcc', (2, 3))
+            paths.append(array.filename)
+            raise RuntimeError('decode failed')
+
+        with mock.patch.object(AudioProcess, 'extract_features', failing_extract), \
+                mock.patch.object(AudioProcess, 'iter_audio_blocks', return_value=iter(())):
+            for _ in range(2):
+                with self.assertRaises(RuntimeError):
+                    store.extract('ab' * 32, 'a.wav', features=['mfcc'])
+        # 两次提取写入不同的临时文件，失败后临时文件被删除
+        self.assertNotEqual(paths[0], paths[1])
+        self.assertEqual(os.listdir(store.directory('ab' * 32, AudioProcess.FEATURE_PARAMS)), [])
+
+
+def blank_pdf(path, page_count):
+    import fitz
+    with fitz.open() as doc:
+        for _ in range(page_count):
+            doc.new_page(width=100, height=100)
+        doc.save(path)
+
+
+@skipUnless(importable('fitz'), '需要 PyMuPDF')
+class PdfPoolTests(SimpleTestCase):
+    def test_pool_is_reused_until_config_changes(self):
+        from algorithm import PDFProcess
+        self.addCleanup(PDFProcess.shutdown_pdf_pool)
+        pool = PDFProcess.get_pdf_pool(2, 1)
+        self.assertIs(PDFProcess.get_pdf_pool(2, 1), pool)
+        self.assertIsNot(PDFProcess.get_pdf_pool(2, 2), pool)
+        PDFProcess.shutdown_pdf_pool()
+        self.assertIsNone(PDFProcess._pdf_pool)
+
+    def test_parallel_pages_are_reassembled_in_order(self):
+        import random
+        from algorithm import PDFProcess
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        pdf_paths = [os.path.join(directory, name) for name in ('a.pdf', 'b.pdf')]
+        for pdf_path, page_count in zip(pdf_paths, (7, 4)):
+            blank_pdf(pdf_path, page_count)
+        # 各分片按打乱后的顺序依次完成
+        shards = [(pdf_path, pages[0]) for pdf_path in pdf_paths for pages in PDFProcess._pdf_shards(pdf_path, 2)]
+        order = random.Random(0).sample(shards, len(shards))
+        done = {shard: threading.Event() for shard in shards}
+        finished = []
+
+        def process_shard(pdf_path, pages, options):
+            shard = (pdf_path, pages[0])
+            position = order.index(shard)
+            if position:
+                done[order[position - 1]].wait(5)
+            finished.append(shard)
+            done[shard].set()
+            return [{'page_info': {'page_no': page_no}} for page_no in pages]
+
+        executor = ThreadPoolExecutor(max_workers=len(shards))
+        self.addCleanup(executor.shutdown)
+        with mock.patch.object(PDFProcess, 'get_pdf_pool', return_value=executor), \
+                mock.patch.object(PDFProcess, '_process_shard', process_shard):
+            results = list(PDFProcess.process_pdfs_parallel(pdf_paths, workers=2, pages_per_task=2))
+        self.assertEqual(finished, order)
+        self.assertNotEqual(finished, shards)
+        self.assertEqual([pdf_path for pdf_path, _ in results], pdf_paths)
+        self.assertEqual([[page['page_info']['page_no'] for page in pages] for _, pages in results],
+                         [list(range(7)), list(range(4))])
+
+
+@skipUnless(importable('fitz', 'cv2', 'supervision'), '需要 PyMuPDF、OpenCV 和 supervision')
+class PdfStreamTests(SimpleTestCase):
+    def test_pages_are_streamed_in_detection_batches(self):
+        import supervision as sv
+        from algorithm import PDFProcess
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        pdf_path = os.path.join(directory, 'a.pdf')
+        blank_pdf(pdf_path, 5)
+        events = []
+
+        def layout_model(source, **kwargs):
+            # 每页返回一个覆盖整页的正文区域
+            events.append(('detect', len(source)))
+            return [sv.Detections(xyxy=np.array([[0, 0, 100, 100]], dtype=np.float32), class_id=np.array([1]))
+                    for _ in source]
+
+        models = {'doclayout_yolo': layout_model, 'paddleocr': StubOcr([quad(0, 10, 90, 20)])}
+        with mock.patch.object(PDFProcess.registry, 'get', side_effect=models.get), \
+                mock.patch.object(sv.Detections, 'from_ultralytics', side_effect=lambda result: result):
+            for page in PDFProcess.process_pdf_stream(pdf_path, dpi=72, batch_size=2, use_text_layer=False, report=False):
+                events.append(('page', page['page_info']['page_no']))
+                self.assertEqual(page['layout_dets'][0]['text'], 'h10')
+        # 每批检测之后逐页输出，下一批在前一批的页面全部取走后才检测
+        self.assertEqual(events, [
+            ('detect', 2), ('page', 0), ('page', 1),
+            ('detect', 2), ('page', 2), ('page', 3),
+            ('detect', 1), ('page', 4),
+        ])
+
+
+class UploadFileNameTests(TempStorageMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        Project.objects.create(name='videos', type='video')
+
+    def test_clean_file_name(self):
+        self.assertEqual(clean_file_name('../../../tmp/x.mp4'), 'x.mp4')
+        self.assertEqual(clean_file_name('a\\..\\b.wav'), 'b.wav')
+        self.assertIsNone(clean_file_name('..'))
+        self.assertIsNone(clean_file_name(''))
+
+    def test_init_upload_strips_directories(self):
+        response = self.client.post(
+            '/api/init_upload/videos/', {'file_name': '../../../tmp/x.mp4', 'size': 10}, content_type='application/json'
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['file_name'], 'x.mp4')
+        self.assertEqual(UploadSession.objects.get().file_name, 'x.mp4')
+
+    def test_init_upload_rejects_invalid_name(self):
+        response = self.client.post('/api/init_upload/videos/', {'file_name': '..', 'size': 10}, content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+
+
+class LinkFilesTests(TempStorageMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        Project.objects.create(name='sounds', type='audio')
+        tmp_path, self.digest, size = spool_chunks([b'RIFF'])
+        self.blob = commit_blob(tmp_path, self.digest, size, '.wav')
+
+    def link(self, files):
+        return self.client.post('/api/link_files/sounds/', {'files': files}, content_type='application/json')
+
+    def test_links_existing_blob_with_clean_name(self):
+        response = self.link([{'name': '../../a.wav', 'sha256': self.digest}, {'name': 'b.wav', 'sha256': '0' * 64}])
+        self.assertEqual(response.json(), {'linked': ['../../a.wav'], 'missing': ['b.wav']})
+        self.assertEqual(ProjectFile.objects.get().file_name, 'a.wav')
+        self.assertEqual(Blob.objects.get().ref_count, 2)
+
+    def test_rejects_malformed_entries(self):
+        for files in (['a.wav'], [{'name': 'a.wav'}], [{'name': 1, 'sha256': self.digest}], {'name': 'a.wav'}):
+            self.assertEqual(self.link(files).status_code, 400)
+        self.assertFalse(ProjectFile.objects.exists())
+
+    def test_failed_create_releases_reference(self):
+        with mock.patch.object(ProjectFile.objects, 'create', side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                self.link([{'name': 'a.wav', 'sha256': self.digest}])
+        self.assertEqual(Blob.objects.get().ref_count, 1)
+
+
+class DuplicateFileNameTests(TempStorageMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.project = Project.objects.create(name='docs', type='text')
+        self.client.post('/api/upload_files/docs/', {'files': [SimpleUploadedFile('a.txt', b'a')]})
+
+    def test_upload_rejects_existing_and_repeated_names(self):
+        response = self.client.post('/api/upload_files/docs/', {'files': [SimpleUploadedFile('a.txt', b'b')]})
+        self.assertEqual(response.status_code, 400)
+        response = self.client.post(
+            '/api/upload_files/docs/', {'files': [SimpleUploadedFile('b.txt', b'b'), SimpleUploadedFile('B.txt', b'c')]}
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.project.files.count(), 1)
+
+    def test_init_upload_rejects_existing_name(self):
+        response = self.client.post('/api/init_upload/docs/', {'file_name': 'a.txt', 'size': 1}, content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+
+    def test_ingest_skips_existing_and_repeated_names(self):
+        archive = tempfile.TemporaryFile()
+        with zipfile.ZipFile(archive, 'w') as zf:
+            for name in ('a.txt', 'x/y.txt', 'x_y.txt', 'c.txt'):
+                zf.writestr(name, name)
+        archive.seek(0)
+        response = self.client.post('/api/ingest_archive/docs/', {'archive': SimpleUploadedFile('a.zip', archive.read())})
+        self.assertEqual(response.json()['imported'], 2)
+        self.assertEqual(response.json()['skipped'], ['x_y.txt', 'a.txt'])
+        self.assertEqual(sorted(self.project.files.values_list('file_name', flat=True)), ['a.txt', 'c.txt', 'x_y.txt'])
+        self.assertFalse(os.listdir(os.path.join(self.storage_root, 'blobs', 'tmp')))
+
+    def test_get_file_content(self):
+        response = self.client.get('/api/get_file_content/docs/a.txt/')
+        self.assertEqual(b''.join(response), b'a')
+        self.assertEqual(self.client.get('/api/get_file_content/docs/b.txt/').status_code, 404)
+
+
+class CreateProjectTests(TempStorageMixin, TestCase):
+    def create(self, *files):
+        return self.client.post('/api/create_project/', {'project_name': 'docs', 'project_type': 'text', 'files': list(files)})
+
+    def test_files_are_bulk_created(self):
+        with mock.patch.object(ProjectFile.objects, 'create', side_effect=AssertionError):
+            response = self.create(SimpleUploadedFile('a.txt', b'same'), SimpleUploadedFile('b.txt', b'same'))
+        self.assertEqual(response.status_code, 200)
+        files = response.json()['files']
+        self.assertEqual([file['name'] for file in files], ['a.txt', 'b.txt'])
+        self.assertEqual([file['id'] for file in files], list(ProjectFile.objects.order_by('id').values_list('id', flat=True)))
+        self.assertEqual(Blob.objects.get().ref_count, 2)
+
+    def test_failed_save_discards_spooled_files(self):
+        with mock.patch('app.ingest.commit_blobs', side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                self.create(SimpleUploadedFile('a.txt', b'a'))
+        self.assertFalse(ProjectFile.objects.exists())
+        self.assertFalse(os.listdir(os.path.join(self.storage_root, 'blobs', 'tmp')))
+
+    def test_rollback_after_commit_removes_blob_file(self):
+        # Blob 已登记并移入存储后外层事务回滚：记录和文件都不应留下
+        with mock.patch.object(ProjectFile.objects, 'bulk_create', side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                self.create(SimpleUploadedFile('a.txt', b'a'))
+        self.assertFalse(Blob.objects.exists())
+        blob_root = os.path.join(self.storage_root, 'blobs')
+        self.assertEqual([files for _, _, files in os.walk(blob_root) if files], [])
+
+    def test_commit_blobs_reinserts_concurrently_released_rows(self):
+        tmp_path, digest, size = spool_chunks([b'a'])
+        bulk_create = Blob.objects.bulk_create
+        calls = []
+
+        def flaky_bulk_create(objs, **kwargs):
+            # 第一次插入的记录在加锁读取之前被并发的 release_blob 删除
+            calls.append([blob.sha256 for blob in objs])
+            return [] if len(calls) == 1 else bulk_create(objs, **kwargs)
+
+        with mock.patch.object(Blob.objects, 'bulk_create', flaky_bulk_create):
+            blobs = commit_blobs([(tmp_path, digest, size, '.txt')])
+        self.assertEqual(calls, [[digest], [digest]])
+        self.assertEqual(blobs[digest].sha256, digest)
+        self.assertEqual(Blob.objects.get().ref_count, 1)
+        self.assertTrue(os.path.exists(blobs[digest].path))
+
+
+class RangeRequestTests(TempStorageMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        Project.objects.create(name='docs', type='text')
+        self.client.post('/api/upload_files/docs/', {'files': [SimpleUploadedFile('a.txt', b'0123456789')]})
+
+    def get(self, method='get', **headers):
+        return getattr(self.client, method)('/api/get_file_content/docs/a.txt/', headers=headers)
+
+    def test_parse_range(self):
+        self.assertEqual(parse_range('bytes=0-4', 10), (0, 4))
+        self.assertEqual(parse_range('bytes=2-4', 10), (2, 4))
+        self.assertEqual(parse_range('bytes=5-', 10), (5, 9))
+        self.assertEqual(parse_range('bytes=8-100', 10), (8, 9))
+        self.assertEqual(parse_range('bytes=-3', 10), (7, 9))
+        self.assertEqual(parse_range('bytes=-30', 10), (0, 9))
+        for header in (None, 'items=0-1', 'bytes=0-1,3-4', 'bytes=a-b', 'bytes=5-2'):
+            self.assertIsNone(parse_range(header, 10))
+        for header in ('bytes=10-', 'bytes=10-12', 'bytes=-0'):
+            with self.assertRaises(ValueError):
+                parse_range(header, 10)
+        with self.assertRaises(ValueError):
+            parse_range('bytes=-5', 0)
+
+    def test_partial_content(self):
+        response = self.get(Range='bytes=2-4')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(b''.join(response), b'234')
+        self.assertEqual(response['Content-Range'], 'bytes 2-4/10')
+        response = self.get(Range='bytes=-3')
+        self.assertEqual(b''.join(response), b'789')
+
+    def test_unsatisfiable_range(self):
+        response = self.get(Range='bytes=10-')
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response['Content-Range'], 'bytes */10')
+
+    def test_invalid_range_returns_full_content(self):
+        response = self.get(Range='bytes=5-2')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join(response), b'0123456789')
+
+    def test_if_range_mismatch_returns_full_content(self):
+        response = self.get(Range='bytes=2-4', If_Range='"stale"')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join(response), b'0123456789')
+
+    def test_head(self):
+        response = self.get('head')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Length'], '10')
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+        self.assertEqual(self.get(If_None_Match=response['ETag']).status_code, 304)
+
+
+class ListProjectsTests(TestCase):
+    def setUp(self):
+        self.projects = [Project.objects.create(name=name, type='text') for name in ('a', 'b', 'c')]
+        ProjectFile.objects.create(project=self.projects[0], file_name='a1.txt')
+        ProjectFile.objects.create(project=self.projects[0], file_name='a2.txt', status=ProjectFile.Status.DONE)
+        ProjectFile.objects.create(project=self.projects[2], file_name='c1.txt')
+
+    async def get(self, **params):
+        response = await self.async_client.get('/api/list_projects/', params)
+        if not response.streaming:
+            return response, None
+        content = b''.join([chunk async for chunk in response.streaming_content])
+        return response, content.decode()
+
+    async def test_cursor_across_pages(self):
+        names, files, cursor = [], {}, ''
+        for _ in range(len(self.projects)):
+            response, content = await self.get(cursor=cursor, limit=2)
+            self.assertEqual(response['Content-Type'], 'application/json')
+            page = json.loads(content)
+            for project in page['projects']:
+                names.append(project['name'])
+                files[project['name']] = [(file['name'], file['status']) for file in project['files']]
+            cursor = page['next_cursor']
+            if cursor is None:
+                break
+        self.assertEqual(names, ['a', 'b', 'c'])
+        self.assertEqual(files, {'a': [('a1.txt', '待处理'), ('a2.txt', '已处理')], 'b': [], 'c': [('c1.txt', '待处理')]})
+        # 最后一页没有下一页游标
+        _, content = await self.get(cursor=self.projects[1].id, limit=2)
+        self.assertEqual(json.loads(content)['next_cursor'], None)
+
+    async def test_fields(self):
+        _, content = await self.get(fields='id,name', file_fields='none', limit=1)
+        page = json.loads(content)
+        self.assertEqual(page['projects'], [{'id': self.projects[0].id, 'name': 'a'}])
+        self.assertEqual(page['next_cursor'], self.projects[0].id)
+        _, content = await self.get(fields='name', file_fields='name')
+        self.assertEqual(json.loads(content)['projects'][0], {'name': 'a', 'files': [{'name': 'a1.txt'}, {'name': 'a2.txt'}]})
+
+    async def test_ndjson(self):
+        response, content = await self.get(format='ndjson', fields='name', file_fields='none', limit=2)
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        lines = [json.loads(line) for line in content.splitlines()]
+        self.assertEqual(lines, [{'name': 'a'}, {'name': 'b'}, {'next_cursor': self.projects[1].id}])
+        _, content = await self.get(format='ndjson', fields='name', file_fields='none', cursor=self.projects[1].id)
+        self.assertEqual([json.loads(line) for line in content.splitlines()], [{'name': 'c'}, {'next_cursor': None}])
+
+    async def test_invalid_parameters(self):
+        for params in ({'cursor': 'abc'}, {'limit': '0'}, {'limit': 'x'}, {'fields': 'id,password'},
+                       {'file_fields': 'blob'}, {'fields': 'none'}, {'format': 'xml'}):
+            response, _ = await self.get(**params)
+            self.assertEqual(response.status_code, 400, params)
+        response = await self.async_client.post('/api/list_projects/')
+        self.assertEqual(response.status_code, 400)
+
+
+class ChunkedUploadTests(SimpleTestCase):
+    def test_merge_range(self):
+        self.assertEqual(merge_range([], 0, 5), [[0, 5]])
+        self.assertEqual(merge_range([[0, 5]], 5, 8), [[0, 8]])
+        self.assertEqual(merge_range([[0, 2], [6, 8]], 3, 4), [[0, 2], [3, 4], [6, 8]])
+        self.assertEqual(merge_range([[0, 2], [6, 8]], 1, 7), [[0, 8]])
+        # 重复上传的块不改变已接收的区间
+        self.assertEqual(merge_range([[0, 8]], 2, 4), [[0, 8]])
+
+    def test_upload_complete(self):
+        self.assertTrue(upload_complete(UploadSession(size=10, received=[[0, 10]])))
+        self.assertFalse(upload_complete(UploadSession(size=10, received=[[0, 4], [5, 10]])))
+        self.assertFalse(upload_complete(UploadSession(size=10, received=[])))
+        self.assertTrue(upload_complete(UploadSession(size=0, received=[])))
+
+
+class ChunkRetryTests(TempStorageMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        Project.objects.create(name='videos', type='video')
+        response = self.client.post('/api/init_upload/videos/', {'file_name': 'a.mp4', 'size': 8}, content_type='application/json')
+        self.upload_id = response.json()['upload_id']
+
+    def put(self, offset, data, checksum=None):
+        checksum = checksum or hashlib.sha256(data).hexdigest()
+        return self.client.put(
+            f'/api/upload_chunk/{self.upload_id}/?offset={offset}', data, content_type='application/octet-stream',
+            headers={'X-Chunk-SHA256': checksum}
+        )
+
+    def test_failed_retry_keeps_accepted_range(self):
+        self.assertEqual(self.put(0, b'0123').json()['received'], [[0, 4]])
+        # 校验失败的重传不能覆盖已接收的数据
+        self.assertEqual(self.put(0, b'xxxx', checksum='0' * 64).status_code, 400)
+        self.assertEqual(self.put(4, b'4567').json()['received'], [[0, 8]])
+        response = self.client.post(f'/api/finalize_upload/{self.upload_id}/')
+        self.assertEqual(response.status_code, 200)
+        with open(response.json()['file']['local_path'], 'rb') as f:
+            self.assertEqual(f.read(), b'01234567')
+
+    def test_expired_sessions_are_removed(self):
+        UploadSession.objects.update(expires_at=timezone.now() + timedelta(seconds=5))
+        # 接收分块后顺延过期时间
+        self.put(0, b'0123')
+        self.assertGreater(UploadSession.objects.get().expires_at, timezone.now() + timedelta(hours=1))
+        stale = UploadSession.objects.create(
+            project=Project.objects.get(), file_name='b.mp4', size=8, expires_at=timezone.now() - timedelta(seconds=1)
+        )
+        open(upload_tmp_path(stale.id), 'wb').close()
+        out = StringIO()
+        call_command('expire_uploads', stdout=out)
+        self.assertEqual(out.getvalue().strip(), '已删除 1 个过期的上传会话')
+        self.assertEqual([str(session.id) for session in UploadSession.objects.all()], [self.upload_id])
+        self.assertFalse(os.path.exists(upload_tmp_path(stale.id)))
+        self.assertTrue(os.path.exists(upload_tmp_path(self.upload_id)))
+
+    def test_expired_session_rejects_chunks(self):
+        UploadSession.objects.update(expires_at=timezone.now() - timedelta(seconds=1))
+        self.assertEqual(self.put(0, b'0123').status_code, 410)
+        self.assertEqual(UploadSession.objects.get().received, [])
+
+    def test_session_removed_during_write(self):
+        # 分块写入期间会话被 expire_uploads 删除，登记已接收区间时记录已不存在
+        with mock.patch('app.views.save_chunk_range', side_effect=UploadSession.DoesNotExist):
+            self.assertEqual(self.put(0, b'0123').status_code, 404)
+
+
+class ImportArchiveTests(TempStorageMixin, TestCase):
+    def test_member_file_name(self):
+        self.assertEqual(member_file_name('a.txt'), 'a.txt')
+        self.assertEqual(member_file_name('./x/../y/a.txt'), 'x_y_a.txt')
+        self.assertEqual(member_file_name('x\\a.txt'), 'x_a.txt')
+        self.assertEqual(member_file_name('x/a\x00"b\x1b.txt'), 'x_ab.txt')
+        for path in ('', './', 'x/.hidden', '__MACOSX/x/a.txt', '\x01\x02', '"\x00'):
+            self.assertIsNone(member_file_name(path))
+
+    def test_hostile_member_names_are_cleaned(self):
+        project = Project.objects.create(name='docs', type='text')
+        archive = tempfile.TemporaryFile()
+        with zipfile.ZipFile(archive, 'w') as zf:
+            zf.writestr('x/\x1b[31m"a\r\n"; b.txt', b'a')
+            zf.writestr('\x07\x08', b'b')
+        self.assertEqual(import_archive(project, archive, ['.txt']), (1, ['\x07\x08']))
+        self.assertEqual(project.files.get().file_name, 'x_31ma_b.txt')
+
+    def test_existing_names_differing_in_case_are_skipped(self):
+        project = Project.objects.create(name='docs', type='text')
+        project.files.create(file_name='a.txt')
+        archive = tempfile.TemporaryFile()
+        with zipfile.ZipFile(archive, 'w') as zf:
+            zf.writestr('A.txt', b'a')
+            zf.writestr('b.txt', b'b')
+        self.assertEqual(import_archive(project, archive, ['.txt']), (1, ['A.txt']))
+        self.assertEqual(sorted(project.files.values_list('file_name', flat=True)), ['a.txt', 'b.txt'])
+        self.assertFalse(os.listdir(os.path.join(self.storage_root, 'blobs', 'tmp')))
+
+    def test_files_are_saved_in_batches(self):
+        project = Project.objects.create(name='docs', type='text')
+        archive = tempfile.TemporaryFile()
+        with zipfile.ZipFile(archive, 'w') as zf:
+            for index in range(5):
+                zf.writestr(f'{index}.txt', b'same' if index < 2 else str(index))
+            zf.writestr('skip.bin', b'x')
+        bulk_create = mock.patch.object(ProjectFile.objects, 'bulk_create', wraps=ProjectFile.objects.bulk_create)
+        with bulk_create as mocked:
+            imported, skipped = import_archive(project, archive, ['.txt'], batch_size=2)
+        self.assertEqual((imported, skipped), (5, ['skip.bin']))
+        self.assertEqual([len(call.args[0]) for call in mocked.call_args_list], [2, 2, 1])
+        self.assertEqual(Blob.objects.count(), 4)
+        self.assertEqual(Blob.objects.get(size=4).ref_count, 2)
+        self.assertFalse(os.listdir(os.path.join(self.storage_root, 'blobs', 'tmp')))
+
+
+class StubTensor:
+    def __init__(self, size):
+        self.size = size
+
+    def numel(self):
+        return self.size
+
+    def element_size(self):
+        return 1
+
+
+class StubModel:
+    # 按 torch 模块的接口报告参数大小，estimate_memory 据此估算内存
+    def __init__(self, memory):
+        self.memory = memory
+
+    def parameters(self):
+        return [StubTensor(self.memory)]
+
+    def buffers(self):
+        return []
+
+
+class ModelRegistryTests(SimpleTestCase):
+    def setUp(self):
+        self.loads = []
+
+    def loader(self, name, memory=100, delay=0):
+        def load():
+            time.sleep(delay)
+            self.loads.append(name)
+            return StubModel(memory)
+        return load
+
+    def test_models_are_loaded_once_on_first_use(self):
+        registry = ModelRegistry()
+        registry.register('a', self.loader('a'))
+        self.assertEqual(self.loads, [])
+        model = registry.get('a')
+        self.assertIs(registry.get('a'), model)
+        self.assertEqual(self.loads, ['a'])
+        self.assertEqual(registry.stats()['a']['memory'], 100)
+        with self.assertRaises(KeyError):
+            registry.get('b')
+
+    def test_concurrent_first_use_loads_once(self):
+        registry = ModelRegistry()
+        registry.register('a', self.loader('a', delay=0.05))
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            models = list(executor.map(lambda _: registry.get('a'), range(4)))
+        self.assertEqual(self.loads, ['a'])
+        self.assertTrue(all(model is models[0] for model in models))
+
+    def test_least_recently_used_models_are_evicted(self):
+        registry = ModelRegistry(max_memory=250)
+        for name in 'abc':
+            registry.register(name, self.loader(name))
+        registry.preload('a', 'b')
+        registry.get('a')
+        # 加载 c 后超出预算，卸载最久未使用的 b
+        registry.get('c')
+        self.assertEqual(list(registry.stats()), ['a', 'c'])
+        registry.get('b')
+        self.assertEqual(list(registry.stats()), ['c', 'b'])
+        self.assertEqual(self.loads, ['a', 'b', 'c', 'b'])
+
+    def test_model_over_budget_is_kept_after_loading(self):
+        registry = ModelRegistry(max_memory=150)
+        registry.register('a', self.loader('a'))
+        registry.register('big', self.loader('big', memory=200))
+        registry.get('a')
+        model = registry.get('big')
+        self.assertEqual(list(registry.stats()), ['big'])
+        self.assertIs(registry.get('big'), model)
+
+    def test_fingerprint_changes_with_version_and_weights(self):
+        root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, root)
+        weights = os.path.join(root, 'model.pt')
+        with open(weights, 'wb') as f:
+            f.write(b'v1')
+        registry = ModelRegistry()
+        registry.register('file', self.loader('file'), version='1', path=weights)
+        registry.register('dir', self.loader('dir'), version='1', path=root)
+        fingerprints = registry.fingerprint('file'), registry.fingerprint('dir')
+        self.assertEqual((registry.fingerprint('file'), registry.fingerprint('dir')), fingerprints)
+        with open(weights, 'wb') as f:
+            f.write(b'v2-weights')
+        self.assertNotEqual(registry.fingerprint('file'), fingerprints[0])
+        self.assertNotEqual(registry.fingerprint('dir'), fingerprints[1])
+        file_fingerprint = registry.fingerprint('file')
+        registry.register('file', self.loader('file'), version='2', path=weights)
+        self.assertNotEqual(registry.fingerprint('file'), file_fingerprint)
+        # 计算指纹不需要加载模型
+        self.assertEqual(self.loads, [])
+
+
+class ResultCacheTests(SimpleTestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root, ignore_errors=True)
+        self.source = os.path.join(self.root, 'source.json')
+        with open(self.source, 'w') as f:
+            f.write('x' * 40)
+
+    def test_get_file_copies_cached_result(self):
+        cache = ResultCache(os.path.join(self.root, 'cache'))
+        destination = os.path.join(self.root, 'out.json')
+        self.assertFalse(cache.get_file('image', 'ab', destination))
+        cache.put_file('image', 'ab', self.source)
+        self.assertTrue(cache.get_file('image', 'ab', destination))
+        with open(destination) as f:
+            self.assertEqual(f.read(), 'x' * 40)
+
+    def test_least_recently_used_entries_are_evicted(self):
+        cache = ResultCache(os.path.join(self.root, 'cache'), max_size=100)
+        cache.put_file('image', 'aa', self.source)
+        cache.put_file('image', 'bb', self.source)
+        os.utime(cache.path('image', 'aa'), (1000, 1000))
+        os.utime(cache.path('image', 'bb'), (2000, 2000))
+        # 读取 aa 后 bb 成为最久未访问的结果
+        cache.get_file('image', 'aa', os.path.join(self.root, 'out.json'))
+        cache.put_file('audio', 'cc', self.source)
+        self.assertFalse(os.path.exists(cache.path('image', 'bb')))
+        self.assertTrue(os.path.exists(cache.path('image', 'aa')))
+        self.assertTrue(os.path.exists(cache.path('audio', 'cc')))
+        self.assertEqual(cache.size(), 80)
+
+    def make_output_dir(self, name):
+        output_dir = os.path.join(self.root, name)
+        os.makedirs(os.path.join(output_dir, 'frames'))
+        with open(os.path.join(output_dir, 'frames', 'frames.npy'), 'wb') as f:
+            f.write(b'x' * 40)
+        with open(os.path.join(output_dir, 'result.json'), 'w', encoding='utf-8') as f:
+            json.dump({'frames_folder': os.path.join(output_dir, 'frames')}, f, ensure_ascii=False)
+        return output_dir
+
+    def test_get_dir_rewrites_output_paths(self):
+        cache = ResultCache(os.path.join(self.root, 'cache'))
+        destination = os.path.join(self.root, '视频', 'b.mp4')
+        self.assertFalse(cache.get_dir('video', 'ab', destination))
+        cache.put_dir('video', 'ab', self.make_output_dir('a.mp4'))
+        self.assertTrue(cache.get_dir('video', 'ab', destination))
+        with open(os.path.join(destination, 'result.json'), encoding='utf-8') as f:
+            self.assertEqual(json.load(f), {'frames_folder': os.path.join(destination, 'frames')})
+        with open(os.path.join(destination, 'frames', 'frames.npy'), 'rb') as f:
+            self.assertEqual(f.read(), b'x' * 40)
+
+    def test_directory_entries_are_evicted(self):
+        cache = ResultCache(os.path.join(self.root, 'cache'), max_size=200)
+        cache.put_dir('video', 'aa', self.make_output_dir('a.mp4'))
+        os.utime(cache.dir_path('video', 'aa'), (1000, 1000))
+        cache.put_file('image', 'bb', self.source)
+        # 目录缓存项按其中所有文件的总大小计算
+        self.assertGreater(cache.size(), 80)
+        cache.put_dir('video', 'cc', self.make_output_dir('c.mp4'))
+        self.assertFalse(os.path.exists(cache.dir_path('video', 'aa')))
+        self.assertTrue(os.path.exists(cache.dir_path('video', 'cc')))
+        self.assertTrue(os.path.exists(cache.path('image', 'bb')))
+        self.assertLessEqual(cache.size(), 180)
+
+
+@skipUnless(importable('cv2'), '需要 OpenCV')
+class ClipWindowTests(SimpleTestCase):
+    def test_iter_clip_windows(self):
+        from algorithm.VideoProcess import iter_clip_windows
+        frames = [(index, f'f{index}') for index in range(7)]
+        windows = [indices for indices, _ in iter_clip_windows(frames, 4, 2)]
+        self.assertEqual(windows, [[0, 1, 2, 3], [2, 3, 4, 5], [4, 5, 6, 6]])
+        self.assertEqual([indices for indices, _ in iter_clip_windows(frames[:6], 4, 2)], [[0, 1, 2, 3], [2, 3, 4, 5]])
+        self.assertEqual(list(iter_clip_windows(frames[:2], 4, 4)), [([0, 1, 1, 1], ['f0', 'f1', 'f1', 'f1'])])
+        self.assertEqual(list(iter_clip_windows([], 4, 2)), [])
+
+
+class SyntheticCapture:
+    # 按 cv2.VideoCapture 的接口逐帧生成画面：frame(index) 返回第 index 帧，共 count 帧
+    def __init__(self, frame, count, fps=25):
+        self.frame = frame
+        self.count = count
+        self.fps = fps
+        self.position = 0
+
+    def get(self, prop):
+        import cv2
+        return {cv2.CAP_PROP_FPS: self.fps, cv2.CAP_PROP_FRAME_COUNT: self.count}.get(prop, 0)
+
+    def grab(self):
+        if self.position >= self.count:
+            return False
+        self.position += 1
+        return True
+
+    def read(self):
+        if self.position >= self.count:
+            return False, None
+        self.position += 1
+        return True, self.frame(self.position - 1)
+
+
+@skipUnless(importable('cv2'), '需要 OpenCV')
+class SceneSamplingTests(SimpleTestCase):
+    def test_samples_cluster_at_cut_with_min_fps_floor(self):
+        from algorithm.VideoProcess import sample_scene_changes
+        # 25 fps：0~60 秒静止的暗画面，60~62 秒切换为剧烈变化的画面，之后 40 秒静止的亮画面
+        dark = np.full((90, 160, 3), 20, dtype=np.uint8)
+        bright = np.full((90, 160, 3), 200, dtype=np.uint8)
+
+        def frame(index):
+            if index < 1500:
+                return dark
+            if index < 1550:
+                blocks = np.random.default_rng(index).integers(0, 256, (9, 16, 3), dtype=np.uint8)
+                return blocks.repeat(10, axis=0).repeat(10, axis=1)
+            return bright
+
+        capture = SyntheticCapture(frame, 2500)
+        kept = [index for index, _ in sample_scene_changes(capture, threshold=0.08, max_fps=5, min_fps=0.1)]
+        static = [index for index in kept if index < 1500]
+        action = [index for index in kept if 1500 <= index < 1550]
+        after = [index for index in kept if index >= 1550]
+        # 剧烈变化的 2 秒内每个探测帧（每 5 帧）都保留，静止的 60 秒只按 min_fps 每 10 秒保留一帧
+        self.assertEqual(action, list(range(1500, 1550, 5)))
+        self.assertEqual(static, list(range(0, 1500, 250)))
+        self.assertGreater(len(action), len(static))
+        self.assertEqual(after[0], 1550)
+        self.assertTrue(all(later - earlier <= 250 for earlier, later in zip(after, after[1:])))
+        self.assertGreaterEqual(len(after), 950 // 250)
+
+
+@skipUnless(importable('cv2'), '需要 OpenCV')
+class NpyFrameWriterTests(SimpleTestCase):
+    def test_npy_frame_writer(self):
+        from algorithm.VideoProcess import NpyFrameWriter
+        # 预估帧数与实际相同、偏少、偏多以及没有帧
+        for expected, count in ((3, 3), (2, 5), (5, 2), (3, 0)):
+            with self.subTest(expected=expected, count=count), tempfile.TemporaryDirectory() as folder:
+                writer = NpyFrameWriter(folder, expected, (4, 2))
+                frames = [np.full((2, 4, 3), index, dtype=np.uint8) for index in range(count)]
+                for index, frame in enumerate(frames):
+                    writer.write(index * 10, frame)
+                writer.close()
+                array = np.load(os.path.join(folder, 'frames.npy'), mmap_mode='r')
+                self.assertEqual(array.shape, (count, 2, 4, 3))
+                np.testing.assert_array_equal(array, np.array(frames, dtype=np.uint8).reshape(array.shape))
+                del array
+                indices = np.load(os.path.join(folder, 'frame_indices.npy'))
+                self.assertEqual(indices.tolist(), [index * 10 for index in range(count)])
+                self.assertEqual(sorted(os.listdir(folder)), ['frame_indices.npy', 'frames.npy'])
+                writer.discard()
+                self.assertEqual(sorted(os.listdir(folder)), ['frame_indices.npy', 'frames.npy'])
+
+    def test_failed_decode_removes_temp_files(self):
+        from algorithm import VideoProcess
+
+        def frames(*args, **kwargs):
+            yield 0, np.zeros((2, 4, 3), dtype=np.uint8)
+            raise RuntimeError('decode failed')
+
+        def recognize_actions(frames, *args):
+            return list(frames)
+
+        info = {'fps': 25, 'frame_count': 8, 'step': 4}
+        with tempfile.TemporaryDirectory() as folder, \
+                mock.patch.object(VideoProcess, 'video_info', return_value=info), \
+                mock.patch.object(VideoProcess, 'iter_video_frames', frames), \
+                mock.patch.object(VideoProcess, 'recognize_actions', recognize_actions):
+            with self.assertRaises(RuntimeError):
+                VideoProcess.analyze_video('video.mp4', folder, size=(4, 2))
+            self.assertEqual(os.listdir(folder), [])
+
+
+class DynamicBatcherTests(SimpleTestCase):
+    def batcher(self, handler, max_batch_size=3, max_latency=0.5):
+        from algorithm.InferenceServer import DynamicBatcher
+        return DynamicBatcher('stub', handler, max_batch_size, max_latency)
+
+    def test_requests_coalesce_up_to_max_batch_size(self):
+        batches = []
+
+        def handler(inputs):
+            batches.append(list(inputs))
+            return [item * 2 for item in inputs]
+
+        batcher = self.batcher(handler)
+        futures = [batcher.submit(item) for item in range(7)]
+        self.assertEqual([future.result(timeout=5) for future in futures], [item * 2 for item in range(7)])
+        self.assertEqual(batches, [[0, 1, 2], [3, 4, 5], [6]])
+        self.assertEqual(batcher.stats()['batches'], 3)
+
+    def test_exception_reaches_every_caller(self):
+        def handler(inputs):
+            raise RuntimeError('model failed')
+
+        batcher = self.batcher(handler)
+        futures = [batcher.submit(item) for item in range(3)]
+        for future in futures:
+            with self.assertRaisesMessage(RuntimeError, 'model failed'):
+                future.result(timeout=5)
+
+    def test_bad_item_only_fails_its_own_request(self):
+        batches = []
+
+        def handler(inputs):
+            batches.append(list(inputs))
+            if 'bad' in inputs:
+                raise ValueError('bad clip')
+            return [item.upper() for item in inputs]
+
+        batcher = self.batcher(handler)
+        futures = [batcher.submit(item) for item in ('a', 'bad', 'c')]
+        self.assertEqual(futures[0].result(timeout=5), 'A')
+        self.assertEqual(futures[2].result(timeout=5), 'C')
+        with self.assertRaisesMessage(ValueError, 'bad clip'):
+            futures[1].result(timeout=5)
+        # 整批失败后逐个重试
+        self.assertEqual(batches, [['a', 'bad', 'c'], ['a'], ['bad'], ['c']])
+
+    def test_short_result_fails_unanswered_requests(self):
+        from algorithm.InferenceServer import InferenceError
+        batcher = self.batcher(lambda inputs: inputs[:-1])
+        futures = [batcher.submit(item) for item in range(3)]
+        self.assertEqual([future.result(timeout=5) for future in futures[:2]], [0, 1])
+        with self.assertRaises(InferenceError):
+            futures[2].result(timeout=5)
+
+
+class InferenceServerTests(SimpleTestCase):
+    def setUp(self):
+        from algorithm import InferenceServer as server_module
+        self.server_module = server_module
+        self.release = threading.Event()
+        self.addCleanup(self.release.set)
+
+        def slow(inputs):
+            self.release.wait()
+            return inputs
+
+        tasks = {
+            'echo': (lambda inputs: [item + 1 for item in inputs], 4, ('Stub', ('echo',))),
+            'slow': (slow, 1, ('Stub', ('slow',))),
+        }
+        patcher = mock.patch.dict(server_module.TASKS, tasks, clear=True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_client_round_trip_and_timeout(self):
+        # 监听的 socket 文件由 multiprocessing 在进程退出时删除
+        address = os.path.join(tempfile.gettempdir(), f'inference-test-{os.getpid()}.sock')
+        server = self.server_module.InferenceServer(address, b'key', timeout=0.2)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        for _ in range(100):
+            if os.path.exists(address):
+                break
+            time.sleep(0.01)
+        client = self.server_module.InferenceClient(address, b'key')
+        self.addCleanup(client._reset)
+        self.assertEqual(client.call('echo', [1, 2, 3]), [2, 3, 4])
+        # 处理函数迟迟不返回时，客户端收到错误而不是一直等待
+        with self.assertRaisesMessage(self.server_module.InferenceError, '超过'):
+            client.call('slow', [1])
+        with self.assertRaises(self.server_module.InferenceError):
+            client.call('missing', [1])
+
+    def test_tasks_sharing_models_share_a_lock(self):
+        self.server_module.TASKS['echo_long'] = self.server_module.TASKS['echo']
+        server = self.server_module.InferenceServer('unused.sock', b'key')
+        self.assertIs(server.batchers['echo'].lock, server.batchers['echo_long'].lock)
+        self.assertIsNot(server.batchers['echo'].lock, server.batchers['slow'].lock)
+
+
+@skipUnless(importable('cv2'), '需要 OpenCV')
+class ImageFrameWriterTests(SimpleTestCase):
+    def test_pending_writes_are_bounded(self):
+        from algorithm.VideoProcess import ImageFrameWriter
+        with tempfile.TemporaryDirectory() as folder:
+            writer = ImageFrameWriter(folder, '.png', workers=2)
+            pending = []
+            for index in range(40):
+                writer.write(index, np.full((8, 8, 3), index, dtype=np.uint8))
+                pending.append(len(writer.futures))
+            writer.close()
+            self.assertLessEqual(max(pending), 4)
+            self.assertEqual(len(os.listdir(folder)), 40)
+
+
+class ParityTests(SimpleTestCase):
+    def test_compare_outputs(self):
+        expected = np.array([[0.1, 0.9], [0.8, 0.2]])
+        self.assertTrue(InferenceBackend.compare_outputs(expected, expected + 0.005)['passed'])
+        # 误差较大但 Top-1 一致时通过，Top-1 不一致时不通过
+        self.assertTrue(InferenceBackend.compare_outputs(expected, expected * 2)['passed'])
+        report = InferenceBackend.compare_outputs(expected, expected[:, ::-1])
+        self.assertFalse(report['passed'])
+        self.assertEqual(report['top1_agreement'], 0.0)
+        with self.assertRaises(InferenceBackend.ParityError):
+            InferenceBackend.report_parity(report)
+        with self.assertRaises(InferenceBackend.ParityError):
+            InferenceBackend.compare_outputs(expected, expected[:1])
+
+    def test_failed_check_removes_export(self):
+        path = os.path.join(tempfile.mkdtemp(), 'model.onnx')
+        self.addCleanup(shutil.rmtree, os.path.dirname(path))
+        open(path, 'wb').close()
+
+        def check(model):
+            raise InferenceBackend.ParityError('mismatch')
+
+        with self.assertRaises(InferenceBackend.ParityError):
+            InferenceBackend.verify_export(object(), path, check)
+        self.assertFalse(os.path.exists(path))
+        open(path, 'wb').close()
+        model = object()
+        self.assertIs(InferenceBackend.verify_export(model, path, lambda m: None), model)
+        self.assertTrue(os.path.exists(path))
+
+    def test_quantize_dir_ignores_stale_tmp(self):
+        cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, cache_dir)
+        source = os.path.join(cache_dir, 'whisper')
+        os.makedirs(source)
+        for filename in ('encoder.onnx', 'config.json'):
+            with open(os.path.join(source, filename), 'w') as f:
+                f.write(filename)
+        destination = os.path.join(cache_dir, 'whisper-int8')
+        # 之前的量化中途失败留下的临时目录
+        os.makedirs(destination + '.tmp')
+
+        def quantize(source_path, destination_path):
+            shutil.copyfile(source_path, destination_path)
+
+        with mock.patch.object(InferenceBackend, 'quantize_file', side_effect=quantize):
+            InferenceBackend.quantize_dir(source, destination)
+        self.assertEqual(sorted(os.listdir(destination)), ['config.json', 'encoder.onnx'])
+        self.assertEqual(sorted(os.listdir(cache_dir)), ['whisper', 'whisper-int8', 'whisper-int8.tmp'])
+
+    def test_cached_export_skips_torch_model(self):
+        cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, cache_dir)
+        open(os.path.join(cache_dir, 'resnet50.onnx'), 'wb').close()
+        load_model = mock.Mock()
+        with mock.patch.dict(InferenceBackend.config, backend='onnx', cache_dir=cache_dir), \
+                mock.patch.object(InferenceBackend, 'OnnxModule') as onnx_module:
+            module = InferenceBackend.onnx_module('resnet50', load_model, (4, 3, 224, 224))
+        # 已有导出结果时直接加载，不构建 PyTorch 模型
+        load_model.assert_not_called()
+        onnx_module.assert_called_once_with(os.path.join(cache_dir, 'resnet50.onnx'))
+        self.assertIs(module, onnx_module.return_value)
+
+
+@skipUnless(importable('fitz'), '需要 PyMuPDF')
+class ResultCacheKeyTests(TempStorageMixin, SimpleTestCase):
+    def test_pipeline_params_change_key(self):
+        key = cache_key('text', 'a.pdf', 'hash')
+        self.assertIsNotNone(key)
+        with override_settings(PDF_DPI=300):
+            self.assertNotEqual(cache_key('text', 'a.pdf', 'hash'), key)
+
+    def test_artifacts_are_cached_with_result(self):
+        calls = []
+
+        def pipeline(file_path, output_dir):
+            # 模拟 PDF 流水线：插图保存在结果目录，result.json 记录其绝对路径
+            calls.append(file_path)
+            figure_path = os.path.join(output_dir, 'page_1_figure.png')
+            with open(figure_path, 'wb') as f:
+                f.write(b'png')
+            return [{'figure_path': figure_path}]
+
+        output_dirs = [os.path.join(self.storage_root, 'results', 'docs', name) for name in ('a.pdf', 'b.pdf')]
+        with mock.patch.dict('app.worker.PIPELINES', {'text': pipeline}):
+            for output_dir in output_dirs:
+                run_pipeline('text', 'a.pdf', output_dir, 'hash')
+        self.assertEqual(calls, ['a.pdf'])
+        with open(os.path.join(output_dirs[1], 'result.json'), encoding='utf-8') as f:
+            figure_path = json.load(f)[0]['figure_path']
+        self.assertEqual(figure_path, os.path.join(output_dirs[1], 'page_1_figure.png'))
+        self.assertTrue(os.path.exists(figure_path))
+
+
+class SchedulerClaimTests(TestCase):
+    def setUp(self):
+        project = Project.objects.create(name='photos', type='image')
+        Project.objects.create(name='clips', type='video').files.create(file_name='v.mp4')
+        self.files = [project.files.create(file_name=f'{i}.jpg') for i in range(3)]
+
+    def test_claim_oldest_pending_of_type(self):
+        scheduler = Scheduler()
+        rows = scheduler.claim('image', 2)
+        self.assertEqual([row['id'] for row in rows], [f.id for f in self.files[:2]])
+        self.assertEqual(rows[0]['project__name'], 'photos')
+        claimed = ProjectFile.objects.get(id=self.files[0].id)
+        self.assertEqual((claimed.status, claimed.attempts), (ProjectFile.Status.CLAIMED, 1))
+        self.assertIsNotNone(claimed.claimed_at)
+        self.assertEqual([row['id'] for row in scheduler.claim('image', 5)], [self.files[2].id])
+        self.assertEqual(scheduler.claim('image', 5), [])
+
+    @override_settings(PROCESSING_MAX_ATTEMPTS=2, PROCESSING_LEASE_TIMEOUT=60)
+    def test_stale_claims_are_requeued_then_failed(self):
+        scheduler = Scheduler()
+        scheduler.claim('image', 1)
+        stale = timezone.now() - timedelta(minutes=5)
+        ProjectFile.objects.filter(id=self.files[0].id).update(heartbeat_at=stale)
+        # 心跳超时的认领重新排队后按 id 顺序再次被认领
+        self.assertEqual(scheduler.claim('image', 1)[0]['id'], self.files[0].id)
+        ProjectFile.objects.filter(id=self.files[0].id).update(status=ProjectFile.Status.RUNNING, heartbeat_at=stale)
+        self.assertEqual(scheduler.claim('image', 1)[0]['id'], self.files[1].id)
+        failed = ProjectFile.objects.get(id=self.files[0].id)
+        self.assertEqual((failed.status, failed.attempts), (ProjectFile.Status.FAILED, 2))
+        self.assertTrue(failed.error)
+
+    @override_settings(PROCESSING_LEASE_TIMEOUT=60)
+    def test_own_inflight_files_are_not_reclaimed(self):
+        scheduler = Scheduler()
+        scheduler.claim('image', 1)
+        scheduler.inflight['future'] = ([self.files[0].id], 'image')
+        ProjectFile.objects.filter(id=self.files[0].id).update(heartbeat_at=timezone.now() - timedelta(minutes=5))
+        self.assertEqual(scheduler.reclaim_stale('image'), 0)
+        self.assertEqual(ProjectFile.objects.get(id=self.files[0].id).status, ProjectFile.Status.CLAIMED)
+
+    @override_settings(PROCESSING_LEASE_TIMEOUT=60)
+    def test_heartbeat_keeps_long_running_files(self):
+        owner = Scheduler()
+        owner.claim('image', 1)
+        owner.inflight['future'] = ([self.files[0].id], 'image')
+        # 开始处理已超过一小时，但调度器仍在刷新心跳
+        long_ago = timezone.now() - timedelta(hours=2)
+        ProjectFile.objects.filter(id=self.files[0].id).update(
+            status=ProjectFile.Status.RUNNING, claimed_at=long_ago, started_at=long_ago, heartbeat_at=long_ago
+        )
+        owner.heartbeat()
+        self.assertEqual(Scheduler().reclaim_stale('image'), 0)
+        self.assertEqual(ProjectFile.objects.get(id=self.files[0].id).status, ProjectFile.Status.RUNNING)
+
+
+    def test_drain_records_finished_and_requeues_cancelled(self):
+        scheduler = Scheduler()
+        scheduler.claim('image', 3)
+        futures = [Future() for _ in range(3)]
+        futures[0].set_result('result.json')
+        futures[1].set_exception(ValueError('无法读取图像'))
+        futures[2].cancel()
+        for file, future in zip(self.files, futures):
+            scheduler.inflight[future] = ([file.id], 'image')
+        scheduler.drain()
+        statuses = [ProjectFile.objects.get(id=file.id) for file in self.files]
+        self.assertEqual(
+            [(file.status, file.attempts) for file in statuses],
+            [(ProjectFile.Status.DONE, 1), (ProjectFile.Status.FAILED, 1), (ProjectFile.Status.PENDING, 0)],
+        )
+        self.assertEqual(scheduler.inflight, {})
+
+
+class RunPipelineTests(TempStorageMixin, SimpleTestCase):
+    def test_result_written_without_changing_cwd(self):
+        cwd = os.getcwd()
+        output_dir = os.path.join(self.storage_root, 'results', 'docs', 'a.txt')
+        file_path = os.path.join(self.storage_root, 'a.txt')
+        open(file_path, 'wb').close()
+        result_path = run_pipeline('text', file_path, output_dir)
+        self.assertEqual(result_path, os.path.join(output_dir, 'result.json'))
+        with open(result_path, encoding='utf-8') as f:
+            self.assertEqual(f.read(), 'null')
+        self.assertEqual(os.getcwd(), cwd)
+
+
+@skipUnless(importable('PIL'), '需要 Pillow')
+class ImagePipelineTests(TempStorageMixin, SimpleTestCase):
+    def setUp(self):
+        super().setUp()
+        from PIL import Image
+        self.Image = Image
+        self.paths = []
+        for name, color in (('a.png', 'red'), ('b.png', 'blue')):
+            path = os.path.join(self.storage_root, name)
+            Image.new('RGB', (8, 8), color).save(path)
+            self.paths.append(path)
+        self.broken = os.path.join(self.storage_root, 'c.png')
+        with open(self.broken, 'wb') as f:
+            f.write(b'not an image')
+
+    def classify(self, images):
+        # 两个模型都应收到已解码的图像
+        self.assertTrue(all(isinstance(image, self.Image.Image) for image in images))
+        return [[{'label': str(image.getpixel((0, 0))), 'score': 1.0}] for image in images]
+
+    def detect(self, images):
+        self.assertTrue(all(isinstance(image, self.Image.Image) for image in images))
+        return [[{'class': 'box', 'confidence': 0.5}] for _ in images]
+
+    def test_single_and_batch_results_match(self):
+        jobs = [(index, path, os.path.join(self.storage_root, 'results', str(index)))
+                for index, path in enumerate(self.paths + [self.broken])]
+        with mock.patch('app.worker.classify', self.classify), mock.patch('app.worker.detect', self.detect), \
+                mock.patch.object(self.Image, 'open', wraps=self.Image.open) as image_open:
+            errors = process_image_batch(jobs)
+            # 每张图像只解码一次
+            self.assertEqual(image_open.call_count, len(jobs))
+            single = process_image(self.paths[0], jobs[0][2])
+            with self.assertRaises(ValueError):
+                process_image(self.broken, jobs[2][2])
+        self.assertEqual(errors, {2: '无法读取图像'})
+        with open(os.path.join(jobs[0][2], 'result.json'), encoding='utf-8') as f:
+            self.assertEqual(json.load(f), single)
+        self.assertEqual(single, {
+            'label': '(255, 0, 0)',
+            'top_k': [{'label': '(255, 0, 0)', 'score': 1.0}],
+            'detections': [{'class': 'box', 'confidence': 0.5}],
+        })
+
+
+@skipUnless(importable('PIL', 'supervision'), '需要 Pillow 和 supervision')
+class DetectObjectsCommandTests(TempStorageMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        from PIL import Image
+        project = Project.objects.create(name='photos', type='image')
+        for name, size in (('a.png', 8), ('b.png', 16)):
+            path = os.path.join(self.storage_root, name)
+            Image.new('RGB', (size, size)).save(path)
+            project.files.create(file_name=name, local_path=path)
+        broken = os.path.join(self.storage_root, 'c.png')
+        with open(broken, 'wb') as f:
+            f.write(b'not an image')
+        project.files.create(file_name='c.png', local_path=broken)
+        self.project_dir = os.path.join(self.storage_root, 'results', 'photos')
+
+    def detect(self, *args, **options):
+        import supervision as sv
+
+        def model(source, **kwargs):
+            # 每张图像返回一个覆盖整张图像的检测框
+            return [sv.Detections(
+                xyxy=np.array([[0, 0, image.width, image.height]], dtype=np.float32),
+                confidence=np.array([0.5], dtype=np.float32), class_id=np.array([0]),
+            ) for image in source]
+
+        model.names = {0: 'box'}
+        stderr = StringIO()
+        with mock.patch.object(sv.Detections, 'from_ultralytics', side_effect=lambda result: result), \
+                mock.patch('app.management.commands.detect_objects.registry.get', return_value=model):
+            call_command('detect_objects', 'photos', *args, stdout=StringIO(), stderr=stderr, **options)
+        return stderr.getvalue()
+
+    def listing(self):
+        return sorted(
+            os.path.relpath(os.path.join(root, name), self.project_dir)
+            for root, _, names in os.walk(self.project_dir) for name in names
+        )
+
+    def test_results_are_written_per_file(self):
+        self.assertIn('c.png 无法读取', self.detect(batch_size=2))
+        self.assertEqual(self.listing(), [os.path.join('a.png', 'detections.json'), os.path.join('b.png', 'detections.json')])
+        for name, size in (('a.png', 8), ('b.png', 16)):
+            with open(os.path.join(self.project_dir, name, 'detections.json'), encoding='utf-8') as f:
+                self.assertEqual(json.load(f), [{'label': 'box', 'confidence': 0.5, 'bbox': [0, 0, size, size]}])
+
+    def test_failed_write_leaves_no_partial_output(self):
+        from algorithm import ImageProcess
+        records = ImageProcess.detection_records
+        calls = []
+
+        def detection_records(detections, names):
+            # 第二个文件的临时文件已经打开后失败
+            calls.append(names)
+            if len(calls) == 2:
+                raise RuntimeError('disk full')
+            return records(detections, names)
+
+        with mock.patch.object(ImageProcess, 'detection_records', detection_records):
+            with self.assertRaises(RuntimeError):
+                self.detect()
+        self.assertEqual(self.listing(), [os.path.join('a.png', 'detections.json')])
+
+    def test_failed_columnar_write_leaves_no_partial_output(self):
+        with mock.patch.object(np, 'savez_compressed', side_effect=RuntimeError('disk full')):
+            with self.assertRaises(RuntimeError):
+                self.detect(format='columnar')
+        self.assertEqual(self.listing(), [])
@@ -1,13 +1,20 @@
 from django.urls import path
-from .views import upload_files, create_project, get_projects, get_project_files, get_project_list,delete_project,delete_file, get_file_content
+from .views import upload_files, create_project, get_projects, get_project_files, get_project_list,delete_project,delete_file, get_file_content, list_projects, link_files, init_upload, upload_chunk, finalize_upload, get_inference_status, ingest_archive
 
 urlpatterns = [
     path('api/upload_files/<str:project_name>/', upload_files, name='upload_files'),
+    path('api/link_files/<str:project_name>/', link_files, name='link_files'),
+    path('api/ingest_archive/<str:project_name>/', ingest_archive, name='ingest_archive'),
+    path('api/init_upload/<str:project_name>/', init_upload, name='init_upload'),
+    path('api/upload_chunk/<uuid:upload_id>/', upload_chunk, name='upload_chunk'),
+    path('api/finalize_upload/<uuid:upload_id>/', finalize_upload, name='finalize_upload'),
     path('api/create_project/', create_project, name='create_project'),
     path('api/get_projects/', get_projects, name='get_projects'),
     path('api/get_project_files/<str:project_name>/', get_project_files, name='get_project_files'),
+    path('api/list_projects/', list_projects, name='list_projects'),
     path('api/get_project_list/', get_project_list, name='get_project_list'),
     path('api/delete_project/<str:project_name>/', delete_project, name='delete_project'),
     path('api/delete_file/<int:file_id>/', delete_file, name='delete_file'),
     path('api/get_file_content/<str:project_name>/<str:filename>/', get_file_content, name='get_file_content'),
+    path('api/inference_status/', get_inference_status, name='inference_status'),
 ]
\ No newline at end of file
@@ -1,9 +1,28 @@
 # 6666/project/app/views.py
+from collections import Counter
+import json
+import mimetypes
 import os
-from django.http import JsonResponse, HttpResponse
+import shutil
+import tarfile
+import tempfile
+import zipfile
+from asgiref.sync import sync_to_async
+from django.core.handlers.asgi import ASGIRequest
+from django.http import JsonResponse, HttpResponse, StreamingHttpResponse, FileResponse
 from django.views.decorators.csrf import csrf_exempt
 from django.conf import settings
-from .models import Project, ProjectFile
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from django.utils.cache import get_conditional_response
+from django.utils.http import content_disposition_header, http_date
+from .models import Project, ProjectFile, UploadSession, upload_session_expiry
+from .ingest import existing_file_names, import_archive, save_files
+from .storage import (
+    acquire_blob, blob_transaction, clean_file_name, commit_blob, discard_tmp_files, file_sha256, in_thread, merge_range, read_chunk,
+    release_blob, spool_upload, upload_tmp_path, write_chunk
+)
+from .worker import inference_client
 
 ALLOWED_FILE_EXTENSIONS = {
     'text': ['.txt', '.pdf', '.doc', '.docx', '.csv'],
@@ -12,15 +31,32 @@ ALLOWED_FILE_EXTENSIONS = {
     'video': ['.aac', '.mp4']
 }
 
-@csrf_exempt
-def upload_files(request, project_name):
+def duplicate_file_names(project, names):
+    """
+    同一项目内文件名唯一
+    :return: names 中与项目已有文件重名或在本次请求中重复的文件名
+    """
+    # MySQL 默认排序规则比较时不区分大小写，统一按小写判断重名
+    existing = {name.lower() for name in existing_file_names(project, names)}
+    counts = Counter(name.lower() for name in names)
+    return [name for name in dict.fromkeys(names) if name.lower() in existing or counts[name.lower()] > 1]
+
+def async_csrf_exempt(view_func):
+    # Django 4.2 的 csrf_exempt 会把协程函数包装成同步函数，异步视图直接设置豁免标记
+    view_func.csrf_exempt = True
+    return view_func
+
+# 上传、列表和文件内容接口为异步视图，在 ASGI 下慢速上传和下载不占用线程
+@async_csrf_exempt
+async def upload_files(request, project_name):
     if request.method == 'POST':
         try:
-            project = Project.objects.get(name=project_name)
+            project = await Project.objects.aget(name=project_name)
             project_type = project.type
             print('当前项目类型为:',project_type)
             allowed_extensions = ALLOWED_FILE_EXTENSIONS.get(project_type, [])
-            files = request.FILES.getlist('files')
+            # 解析 multipart 请求体时会写临时文件，放到线程池中进行
+            files = await in_thread(lambda: request.FILES.getlist('files'))()
             valid_files = []
             invalid_files = []
 
@@ -33,21 +69,24 @@ def upload_files(request, project_name):
 
             if invalid_files:
                 return JsonResponse({'message': f'以下文件类型不允许上传: {", ".join(invalid_files)}'}, status=400)
+            duplicates = await sync_to_async(duplicate_file_names)(project, [file.name for file in valid_files])
+            if duplicates:
+                return JsonResponse({'message': f'以下文件已存在: {", ".join(duplicates)}'}, status=400)
 
-            project_folder = os.path.join(settings.MEDIA_ROOT, project_name)
-            os.makedirs(project_folder, exist_ok=True)
-
-            for file in valid_files:
-                file_path = os.path.join(project_folder, file.name)
-                with open(file_path, 'wb+') as destination:
-                    for chunk in file.chunks():
-                        destination.write(chunk)
-                ProjectFile.objects.create(
-                    project=project,
-                    file_name=file.name,
-                    status='待处理',
-                    local_path=file_path
-                )
+            # 边写边计算哈希，全部写完后在一个事务内批量登记，相同内容只保存一份
+            batch = []
+            try:
+                for file in valid_files:
+                    tmp_path, digest, size = await in_thread(spool_upload)(file)
+                    batch.append((file.name, tmp_path, digest, size, os.path.splitext(file.name)[1].lower()))
+            except BaseException:
+                discard_tmp_files([tmp_path for _, tmp_path, _, _, _ in batch])
+                raise
+            try:
+                await sync_to_async(save_files)(project, batch)
+            except IntegrityError:
+                # 检查之后被并发请求创建了同名文件
+                return JsonResponse({'message': '文件已存在'}, status=400)
 
             return JsonResponse({'message': '文件上传成功'})
         except Project.DoesNotExist:
@@ -55,6 +94,291 @@ def upload_files(request, project_name):
 
     return JsonResponse({'message': '无效的请求方法'}, status=400)
 
+@csrf_exempt
+# 按内容哈希关联已上传过的文件，客户端只需上传返回的 missing 列表
+def link_files(request, project_name):
+    """
+    请求体：{"files": [{"name": "a.wav", "sha256": "..."}]}
+    返回：{"linked": [...], "missing": [...]}
+    """
+    if request.method == 'POST':
+        try:
+            project = Project.objects.get(name=project_name)
+            files = json.loads(request.body).get('files', [])
+        except Project.DoesNotExist:
+            return JsonResponse({'message': '项目不存在'}, status=404)
+        except (ValueError, AttributeError):
+            return JsonResponse({'message': '请求格式无效'}, status=400)
+
+        if not isinstance(files, list) or not all(
+                isinstance(f, dict) and isinstance(f.get('name'), str) and isinstance(f.get('sha256'), str)
+                for f in files):
+            return JsonResponse({'message': '请求格式无效'}, status=400)
+
+        allowed_extensions = ALLOWED_FILE_EXTENSIONS.get(project.type, [])
+        invalid_files = [f['name'] for f in files
+                         if clean_file_name(f['name']) is None
+                         or os.path.splitext(f['name'])[1].lower() not in allowed_extensions]
+        if invalid_files:
+            return JsonResponse({'message': f'以下文件类型不允许上传: {", ".join(invalid_files)}'}, status=400)
+        duplicates = duplicate_file_names(project, [clean_file_name(f['name']) for f in files])
+        if duplicates:
+            return JsonResponse({'message': f'以下文件已存在: {", ".join(duplicates)}'}, status=400)
+
+        linked = []
+        missing = []
+        # 引用计数加一和创建 ProjectFile 在同一事务内，创建失败时引用计数一起回滚
+        try:
+            with transaction.atomic():
+                for file in files:
+                    blob = acquire_blob(file['sha256'])
+                    if blob is None:
+                        missing.append(file['name'])
+                        continue
+                    ProjectFile.objects.create(
+                        project=project,
+                        file_name=clean_file_name(file['name']),
+                        status=ProjectFile.Status.PENDING,
+                        local_path=blob.path,
+                        blob=blob
+                    )
+                    linked.append(file['name'])
+        except IntegrityError:
+            return JsonResponse({'message': '文件已存在'}, status=400)
+        return JsonResponse({'linked': linked, 'missing': missing})
+    return JsonResponse({'message': '无效的请求方法'}, status=400)
+
+# 批量导入时压缩包中被跳过的成员最多返回的数量
+INGEST_SKIPPED_LIMIT = 100
+
+@csrf_exempt
+# 批量导入：上传 zip / tar 压缩包，逐个成员流式写入存储并批量创建 ProjectFile
+def ingest_archive(request, project_name):
+    """
+    multipart 字段 archive 上传 zip 或 tar（可为 tar.gz / tar.bz2 / tar.xz）；
+    也可以直接以请求体发送：tar 边接收边导入，Content-Type 为 application/zip 时先写入临时文件
+    扩展名不允许或与已有文件重名的成员跳过，不影响其他成员
+    返回：{"imported": 导入的文件数, "skipped": [被跳过的成员，最多 100 个], "skipped_count": 被跳过的成员数}
+    """
+    if request.method != 'POST':
+        return JsonResponse({'message': '无效的请求方法'}, status=400)
+    try:
+        project = Project.objects.get(name=project_name)
+    except Project.DoesNotExist:
+        return JsonResponse({'message': '项目不存在'}, status=404)
+    allowed_extensions = ALLOWED_FILE_EXTENSIONS.get(project.type, [])
+
+    tmp_file = None
+    if request.content_type == 'multipart/form-data':
+        fileobj = request.FILES.get('archive')
+        if fileobj is None:
+            return JsonResponse({'message': '缺少压缩包'}, status=400)
+        seekable = True
+    elif request.content_type == 'application/zip':
+        # zip 的目录在文件末尾，需要随机读取
+        tmp_dir = os.path.join(settings.BLOB_ROOT, 'tmp')
+        os.makedirs(tmp_dir, exist_ok=True)
+        tmp_file = fileobj = tempfile.TemporaryFile(dir=tmp_dir)
+        shutil.copyfileobj(request, tmp_file, FILE_CHUNK_SIZE)
+        tmp_file.seek(0)
+        seekable = True
+    else:
+        fileobj = request
+        seekable = False
+
+    try:
+        imported, skipped = import_archive(project, fileobj, allowed_extensions, seekable=seekable)
+    except (zipfile.BadZipFile, tarfile.TarError):
+        return JsonResponse({'message': '无法识别的压缩包'}, status=400)
+    except IntegrityError:
+        # 导入期间被并发请求创建了同名文件，此前已提交的批次保留
+        return JsonResponse({'message': '导入过程中出现重名文件，请重新导入'}, status=400)
+    finally:
+        if tmp_file is not None:
+            tmp_file.close()
+    return JsonResponse({
+        'message': '文件导入成功',
+        'imported': imported,
+        'skipped': skipped[:INGEST_SKIPPED_LIMIT],
+        'skipped_count': len(skipped)
+    })
+
+# 断点续传：建议的分块大小和允许的最大分块
+UPLOAD_CHUNK_SIZE = 8 * 1024 * 1024
+UPLOAD_MAX_CHUNK_SIZE = 64 * 1024 * 1024
+
+def upload_session_data(session):
+    return {
+        'upload_id': str(session.id),
+        'file_name': session.file_name,
+        'size': session.size,
+        'received': session.received,
+        'chunk_size': UPLOAD_CHUNK_SIZE
+    }
+
+@csrf_exempt
+# 断点续传：创建上传会话
+def init_upload(request, project_name):
+    """
+    请求体：{"file_name": "a.mp4", "size": 123, "sha256": "..."}，sha256 可省略
+    """
+    if request.method == 'POST':
+        try:
+            project = Project.objects.get(name=project_name)
+            data = json.loads(request.body)
+            file_name = clean_file_name(data['file_name'])
+            size = int(data['size'])
+        except Project.DoesNotExist:
+            return JsonResponse({'message': '项目不存在'}, status=404)
+        except (ValueError, KeyError, TypeError):
+            return JsonResponse({'message': '请求格式无效'}, status=400)
+        if size < 0:
+            return JsonResponse({'message': '请求格式无效'}, status=400)
+        if file_name is None:
+            return JsonResponse({'message': '文件名无效'}, status=400)
+        file_extension = os.path.splitext(file_name)[1].lower()
+        if file_extension not in ALLOWED_FILE_EXTENSIONS.get(project.type, []):
+            return JsonResponse({'message': f'以下文件类型不允许上传: {file_name}'}, status=400)
+        if existing_file_names(project, [file_name]):
+            return JsonResponse({'message': f'以下文件已存在: {file_name}'}, status=400)
+
+        session = UploadSession.objects.create(
+            project=project,
+            file_name=file_name,
+            size=size,
+            sha256=str(data.get('sha256') or '').lower()
+        )
+        tmp_path = upload_tmp_path(session.id)
+        os.makedirs(os.path.dirname(tmp_path), exist_ok=True)
+        open(tmp_path, 'wb').close()
+        return JsonResponse(upload_session_data(session))
+    return JsonResponse({'message': '无效的请求方法'}, status=400)
+
+def save_chunk_range(upload_id, start, end):
+    # 在行锁内合并已接收区间，并发上传的分块不会互相覆盖
+    with transaction.atomic():
+        session = UploadSession.objects.select_for_update().get(id=upload_id)
+        session.received = merge_range(session.received, start, end)
+        session.expires_at = upload_session_expiry()
+        session.save(update_fields=['received', 'updated_at', 'expires_at'])
+    return session
+
+@async_csrf_exempt
+# 断点续传：GET 查询已接收区间，PUT 上传分块
+async def upload_chunk(request, upload_id):
+    """
+    PUT 参数：offset 为分块在文件中的起始位置，请求头 X-Chunk-SHA256 为分块的 sha256
+    分块先读入缓冲区，校验通过后才写入目标文件并记为已接收
+    """
+    try:
+        session = await UploadSession.objects.aget(id=upload_id)
+    except UploadSession.DoesNotExist:
+        return JsonResponse({'message': '上传会话不存在'}, status=404)
+    if session.expires_at <= timezone.now():
+        # 已过期但还没有被 expire_uploads 删除的会话不再接收分块
+        return JsonResponse({'message': '上传会话已过期'}, status=410)
+
+    if request.method == 'GET':
+        return JsonResponse(upload_session_data(session))
+    if request.method == 'PUT':
+        try:
+            offset = int(request.GET.get('offset', ''))
+            length = int(request.headers.get('Content-Length') or 0)
+        except ValueError:
+            return JsonResponse({'message': '分块参数无效'}, status=400)
+        checksum = request.headers.get('X-Chunk-SHA256', '').lower()
+        if not checksum or offset < 0 or not 0 < length <= UPLOAD_MAX_CHUNK_SIZE or offset + length > session.size:
+            return JsonResponse({'message': '分块参数无效'}, status=400)
+
+        buffer, digest, received = await in_thread(read_chunk)(request, length)
+        try:
+            if received != length:
+                return JsonResponse({'message': '分块数据不完整'}, status=400)
+            if digest != checksum:
+                return JsonResponse({'message': '分块校验失败'}, status=400)
+            await in_thread(write_chunk)(upload_tmp_path(session.id), offset, buffer)
+        finally:
+            buffer.close()
+
+        try:
+            session = await sync_to_async(save_chunk_range)(upload_id, offset, offset + length)
+        except UploadSession.DoesNotExist:
+            # 写入期间会话被完成或过期清理
+            return JsonResponse({'message': '上传会话不存在'}, status=404)
+        return JsonResponse(upload_session_data(session))
+    return JsonResponse({'message': '无效的请求方法'}, status=400)
+
+def upload_complete(session):
+    return session.received == ([[0, session.size]] if session.size else [])
+
+def commit_upload(upload_id, digest):
+    """
+    在行锁内核对整体哈希并创建 ProjectFile
+    :param digest: 已计算好的整个文件的 sha256
+    """
+    with blob_transaction():
+        try:
+            session = UploadSession.objects.select_for_update().get(id=upload_id)
+        except UploadSession.DoesNotExist:
+            return JsonResponse({'message': '上传会话不存在'}, status=404)
+        if not upload_complete(session):
+            return JsonResponse({'message': '文件尚未上传完整', 'received': session.received}, status=400)
+        if session.sha256 and digest != session.sha256:
+            # 整体校验失败说明已接收的数据不可信，需要重新上传
+            session.received = []
+            session.save(update_fields=['received', 'updated_at'])
+            return JsonResponse({'message': '文件校验失败，请重新上传'}, status=400)
+
+        if ProjectFile.objects.filter(project_id=session.project_id, file_name=session.file_name).exists():
+            return JsonResponse({'message': f'以下文件已存在: {session.file_name}'}, status=400)
+
+        file_extension = os.path.splitext(session.file_name)[1].lower()
+        blob = commit_blob(upload_tmp_path(session.id), digest, session.size, file_extension)
+        try:
+            with transaction.atomic():
+                project_file = ProjectFile.objects.create(
+                    project_id=session.project_id,
+                    file_name=session.file_name,
+                    status=ProjectFile.Status.PENDING,
+                    local_path=blob.path,
+                    blob=blob
+                )
+        except IntegrityError:
+            # 检查之后被并发请求创建了同名文件；临时文件已移入存储，会话无法继续使用
+            release_blob(blob.id)
+            session.delete()
+            return JsonResponse({'message': f'以下文件已存在: {session.file_name}'}, status=400)
+        session.delete()
+    return JsonResponse({
+        'message': '文件上传成功',
+        'file': {
+            'id': project_file.id,
+            'name': project_file.file_name,
+            'status': project_file.get_status_display(),
+            'processed_at': '',
+            'local_path': project_file.local_path
+        }
+    })
+
+@async_csrf_exempt
+# 断点续传：所有分块接收完成后校验整个文件并创建 ProjectFile
+async def finalize_upload(request, upload_id):
+    if request.method == 'POST':
+        try:
+            session = await UploadSession.objects.aget(id=upload_id)
+        except UploadSession.DoesNotExist:
+            return JsonResponse({'message': '上传会话不存在'}, status=404)
+        if not upload_complete(session):
+            return JsonResponse({'message': '文件尚未上传完整', 'received': session.received}, status=400)
+        # 整个文件的哈希在线程池中计算，不阻塞事件循环，计算期间也不持有行锁
+        try:
+            digest = await in_thread(file_sha256)(upload_tmp_path(session.id))
+        except FileNotFoundError:
+            # 同一会话已被并发请求完成
+            return JsonResponse({'message': '上传会话不存在'}, status=404)
+        return await sync_to_async(commit_upload)(upload_id, digest)
+    return JsonResponse({'message': '无效的请求方法'}, status=400)
+
 @csrf_exempt
 def create_project(request):
     if request.method == 'POST':
@@ -81,91 +405,221 @@ def create_project(request):
         if invalid_files:
             return JsonResponse({'message': f'以下文件类型不允许上传: {", ".join(invalid_files)}'}, status=400)
 
-        project, created = Project.objects.get_or_create(name=project_name, type=project_type)  # 记录项目类型
-        project_folder = os.path.join(settings.MEDIA_ROOT, project_name)
-        os.makedirs(project_folder, exist_ok=True)
-
-        file_list = []
-        for index, file in enumerate(valid_files, start=1):
-            file_path = os.path.join(project_folder, file.name)
-            with open(file_path, 'wb+') as destination:
-                for chunk in file.chunks():
-                    destination.write(chunk)
-            # 创建 ProjectFile 实例
-            project_file = ProjectFile.objects.create(
-                project=project,
-                file_name=file.name,
-                status='待处理',
-                local_path=file_path
-            )
-            file_list.append({
+        project, created = Project.objects.get_or_create(name=project_name, defaults={'type': project_type})  # 记录项目类型
+        if project.type != project_type:
+            return JsonResponse({'message': '已存在同名的其他类型项目'}, status=400)
+        duplicates = duplicate_file_names(project, [file.name for file in valid_files])
+        if duplicates:
+            return JsonResponse({'message': f'以下文件已存在: {", ".join(duplicates)}'}, status=400)
+        # 与 upload_files 相同：先写入临时文件，再通过 save_files 在一个事务内批量登记
+        batch = []
+        try:
+            for file in valid_files:
+                tmp_path, digest, size = spool_upload(file)
+                batch.append((file.name, tmp_path, digest, size, os.path.splitext(file.name)[1].lower()))
+        except BaseException:
+            discard_tmp_files([tmp_path for _, tmp_path, _, _, _ in batch])
+            raise
+        try:
+            save_files(project, batch)
+        except IntegrityError:
+            # 检查之后被并发请求创建了同名文件
+            return JsonResponse({'message': '文件已存在'}, status=400)
+
+        # MySQL 的 bulk_create 不回填主键，按文件名查询新建的记录
+        project_files = ProjectFile.objects.filter(project=project, file_name__in=[file.name for file in valid_files])
+        file_list = [
+            {
                 'id': project_file.id,
-                'name': file.name,
-                'status': '待处理',
+                'name': project_file.file_name,
+                'status': project_file.get_status_display(),
                 'processed_at': '',
                 'local_path': project_file.local_path
-            })
+            }
+            for project_file in project_files.order_by('id')
+        ]
 
         return JsonResponse({'message': '项目创建成功', 'files': file_list})
 
     return JsonResponse({'message': '无效的请求方法'}, status=400)
 
-@csrf_exempt
+def format_time(value):
+    return value.strftime('%Y-%m-%d %H:%M:%S') if value else ''
+
+@async_csrf_exempt
 # 传递 projects 信息
-def get_projects(request):
+async def get_projects(request):
     if request.method == 'GET':
-        projects = Project.objects.all()
+        # 一次性预取所有项目的文件，避免每个项目单独查询
+        projects = Project.objects.prefetch_related('files')
         project_list = []
-        for project in projects:
-            project_files = ProjectFile.objects.filter(project=project)
+        async for project in projects:
             file_list = []
-            for file in project_files:
+            for file in project.files.all():
                 file_list.append({
                     'id': file.id,
                     'name': file.file_name,
-                    'status': file.status,
-                    'processed_at': file.processed_at.strftime('%Y-%m-%d %H:%M:%S') if file.processed_at else '',
+                    'status': file.get_status_display(),
+                    'processed_at': format_time(file.processed_at),
                     'local_path': file.local_path
                 })
             project_data = {
                 'id': project.id,
                 'name': project.name,
                 'type': project.type,  # 返回项目类型
-                'created_at': project.created_at.strftime('%Y-%m-%d %H:%M:%S'),
+                'created_at': format_time(project.created_at),
                 'files': file_list
             }
             project_list.append(project_data)
         return JsonResponse({'projects': project_list})
     return JsonResponse({'message': '无效的请求方法'}, status=400)
 
-@csrf_exempt
+# 分页列表可选字段：接口字段名 -> 数据库字段名
+PROJECT_FIELDS = {'id': 'id', 'name': 'name', 'type': 'type', 'created_at': 'created_at'}
+FILE_FIELDS = {
+    'id': 'id',
+    'name': 'file_name',
+    'status': 'status',
+    'processed_at': 'processed_at',
+    'local_path': 'local_path',
+}
+LIST_PAGE_SIZE = 100
+LIST_MAX_PAGE_SIZE = 1000
+
+def parse_fields(value, allowed):
+    """
+    解析逗号分隔的字段列表，未指定时返回全部字段，为 none 时返回空列表
+    """
+    if not value:
+        return list(allowed)
+    if value == 'none':
+        return []
+    fields = [field.strip() for field in value.split(',') if field.strip()]
+    if any(field not in allowed for field in fields):
+        raise ValueError(value)
+    return fields
+
+def serialize_row(row, fields, columns):
+    data = {}
+    for field in fields:
+        value = row[columns[field]]
+        if field in ('created_at', 'processed_at'):
+            value = format_time(value)
+        elif field == 'status':
+            # 接口返回状态的中文名称
+            value = ProjectFile.Status(value).label
+        data[field] = value
+    return data
+
+async def iter_project_page(projects, project_fields, file_fields):
+    """
+    逐个生成项目数据；文件按 project_id 排序后异步流式读取，同一时刻只在内存中保留一个项目的文件
+    """
+    if not file_fields:
+        for project in projects:
+            yield serialize_row(project, project_fields, PROJECT_FIELDS)
+        return
+    files = (
+        ProjectFile.objects.filter(project_id__in=[p['id'] for p in projects])
+        .order_by('project_id', 'id')
+        .values('project_id', *[FILE_FIELDS[f] for f in file_fields])
+        .aiterator(chunk_size=2000)
+    )
+    try:
+        row = await anext(files, None)
+        for project in projects:
+            project_data = serialize_row(project, project_fields, PROJECT_FIELDS)
+            project_data['files'] = []
+            while row is not None and row['project_id'] == project['id']:
+                project_data['files'].append(serialize_row(row, file_fields, FILE_FIELDS))
+                row = await anext(files, None)
+            yield project_data
+    finally:
+        # 客户端中途断开时关闭数据库游标
+        await files.aclose()
+
+@async_csrf_exempt
+# 分页、流式返回项目及其文件
+async def list_projects(request):
+    """
+    GET 参数：
+    cursor: 上一页返回的 next_cursor，为空时从头开始
+    limit: 每页项目数，默认 100，最大 1000
+    fields: 项目字段，逗号分隔，如 id,name
+    file_fields: 文件字段，逗号分隔；为 none 时不返回文件
+    format: json（默认，分块输出）或 ndjson（每行一个项目，最后一行为 {"next_cursor": ...}）
+    """
+    if request.method != 'GET':
+        return JsonResponse({'message': '无效的请求方法'}, status=400)
+    try:
+        cursor = int(request.GET.get('cursor') or 0)
+        limit = min(int(request.GET.get('limit') or LIST_PAGE_SIZE), LIST_MAX_PAGE_SIZE)
+        project_fields = parse_fields(request.GET.get('fields'), PROJECT_FIELDS)
+        file_fields = parse_fields(request.GET.get('file_fields'), FILE_FIELDS)
+    except ValueError:
+        return JsonResponse({'message': '查询参数无效'}, status=400)
+    if limit <= 0 or not project_fields:
+        return JsonResponse({'message': '查询参数无效'}, status=400)
+    output_format = request.GET.get('format', 'json')
+    if output_format not in ('json', 'ndjson'):
+        return JsonResponse({'message': '输出格式无效'}, status=400)
+
+    # 按主键做游标分页，多取一条用于判断是否还有下一页
+    projects = [
+        project async for project in
+        Project.objects.filter(id__gt=cursor)
+        .order_by('id')
+        .values('id', *[PROJECT_FIELDS[f] for f in project_fields if f != 'id'])[:limit + 1]
+    ]
+    next_cursor = projects[limit - 1]['id'] if len(projects) > limit else None
+    projects = projects[:limit]
+    items = iter_project_page(projects, project_fields, file_fields)
+
+    # 异步生成器逐项输出，ASGI 服务器在客户端接收变慢时暂停生成
+    if output_format == 'ndjson':
+        async def stream():
+            async for item in items:
+                yield json.dumps(item, ensure_ascii=False) + '\n'
+            yield json.dumps({'next_cursor': next_cursor}) + '\n'
+        return StreamingHttpResponse(stream(), content_type='application/x-ndjson')
+
+    async def stream():
+        yield '{"projects": ['
+        index = 0
+        async for item in items:
+            yield (',' if index else '') + json.dumps(item, ensure_ascii=False)
+            index += 1
+        yield '], "next_cursor": ' + json.dumps(next_cursor) + '}'
+    return StreamingHttpResponse(stream(), content_type='application/json')
+
+@async_csrf_exempt
 # 显示项目列表具体信息
-def get_project_list(request):
+async def get_project_list(request):
     projects = Project.objects.all()
     project_list = []
-    for project in projects:
+    async for project in projects:
         project_data = {
             'id': project.id,
             'name': project.name,
             'type': project.type,  # 返回项目类型
-            'created_at': project.created_at.strftime('%Y-%m-%d %H:%M:%S')
+            'created_at': format_time(project.created_at)
         }
         project_list.append(project_data)
     return JsonResponse({'projects': project_list})
 
-@csrf_exempt
-def get_project_files(request, project_name):
+@async_csrf_exempt
+async def get_project_files(request, project_name):
     if request.method == 'GET':
         try:
-            project = Project.objects.get(name=project_name)
+            project = await Project.objects.aget(name=project_name)
             project_files = ProjectFile.objects.filter(project=project)
             file_list = []
-            for file in project_files:
+            async for file in project_files:
                 file_list.append({
                     'id': file.id,
                     'name': file.file_name,
-                    'status': file.status,
-                    'processed_at': file.processed_at.strftime('%Y-%m-%d %H:%M:%S') if file.processed_at else '',
+                    'status': file.get_status_display(),
+                    'processed_at': format_time(file.processed_at),
                     'local_path': file.local_path
                 })
             return JsonResponse({'files': file_list, 'project_type': project.type})  # 返回项目类型
@@ -181,13 +635,23 @@ def delete_project(request, project_name):
             project = Project.objects.get(name=project_name)
             # 删除项目下的所有文件
             project_files = ProjectFile.objects.filter(project=project)
+            blob_refs = Counter()
             for file in project_files:
-                file_path = file.local_path
-                if os.path.exists(file_path):
-                    os.remove(file_path)
-                file.delete()
+                if file.blob_id:
+                    blob_refs[file.blob_id] += 1
+                elif file.local_path and os.path.exists(file.local_path):
+                    # 内容寻址存储之前上传的文件直接删除
+                    os.remove(file.local_path)
+            # 清理未完成的断点续传临时文件
+            for upload_id in project.upload_sessions.values_list('id', flat=True):
+                tmp_path = upload_tmp_path(upload_id)
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
             # 删除项目
             project.delete()
+            # 文件记录删除后再释放内容引用
+            for blob_id, count in blob_refs.items():
+                release_blob(blob_id, count)
             return JsonResponse({'message': '项目删除成功'})
         except Project.DoesNotExist:
             return JsonResponse({'message': '项目不存在'}, status=404)
@@ -200,43 +664,151 @@ def delete_file(request, file_id):
         try:
             file = ProjectFile.objects.get(id=file_id)
             file.delete()
+            if file.blob_id:
+                release_blob(file.blob_id)
             return JsonResponse({'message': '文件删除成功'})
         except ProjectFile.DoesNotExist:
             return JsonResponse({'message': '文件不存在'}, status=404)
     return JsonResponse({'message': '无效的请求方法'}, status=400)
 
-@csrf_exempt
-def get_file_content(request, project_name, filename):
-    if request.method == 'GET':
+# 媒体文件按块流式读取的块大小
+FILE_CHUNK_SIZE = 64 * 1024
+
+def file_etag(stat):
+    # 以修改时间和文件大小生成校验值，无需读取文件内容
+    return f'"{stat.st_mtime_ns:x}-{stat.st_size:x}"'
+
+def parse_range(header, size):
+    """
+    解析单段 Range 请求头
+    :return: (start, end) 闭区间；无 Range 或格式不支持时返回 None；范围无法满足时抛出 ValueError
+    """
+    if not header or not header.startswith('bytes=') or ',' in header:
+        # 多段范围按规范可以直接返回完整内容
+        return None
+    first, _, last = header[len('bytes='):].strip().partition('-')
+    try:
+        if not first:
+            # bytes=-N 表示最后 N 个字节
+            length = int(last)
+        else:
+            start = int(first)
+            end = min(int(last), size - 1) if last else size - 1
+            if last and start > int(last):
+                # 终点小于起点的范围语法无效，按规范忽略 Range 返回完整内容
+                return None
+    except ValueError:
+        return None
+    if not first:
+        # 长度为 0 或文件为空时后缀范围无法满足
+        if length <= 0 or size == 0:
+            raise ValueError(header)
+        return max(size - length, 0), size - 1
+    if start >= size:
+        raise ValueError(header)
+    return start, end
+
+def iter_file_range(file_path, start, length):
+    with open(file_path, 'rb') as f:
+        f.seek(start)
+        while length > 0:
+            chunk = f.read(min(FILE_CHUNK_SIZE, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+
+async def aiter_file_range(file_path, start, length):
+    # 读文件在线程池中进行，不阻塞事件循环；上一块发送完才读下一块，客户端接收慢时数据不会在内存中堆积
+    f = await in_thread(open)(file_path, 'rb')
+    try:
+        await in_thread(f.seek)(start)
+        while length > 0:
+            chunk = await in_thread(f.read)(min(FILE_CHUNK_SIZE, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+    finally:
+        await in_thread(f.close)()
+
+def file_response(request, file_path, start, length, content_type, status=200):
+    """
+    返回文件内容 [start, start + length)：ASGI 下使用异步生成器，WSGI 下保持同步读取
+    """
+    if request.method == 'HEAD':
+        # HEAD 只需要响应头，不读取文件
+        response = HttpResponse(status=status, content_type=content_type)
+    elif isinstance(request, ASGIRequest):
+        response = StreamingHttpResponse(
+            aiter_file_range(file_path, start, length), status=status, content_type=content_type
+        )
+    elif status == 200:
+        # FileResponse 在服务器支持时使用 wsgi.file_wrapper（sendfile）发送，不经过 Python 内存
+        response = FileResponse(open(file_path, 'rb'), content_type=content_type)
+    else:
+        response = StreamingHttpResponse(
+            iter_file_range(file_path, start, length), status=status, content_type=content_type
+        )
+    response['Content-Length'] = str(length)
+    return response
+
+@async_csrf_exempt
+async def get_file_content(request, project_name, filename):
+    if request.method in ('GET', 'HEAD'):
         try:
-            project = Project.objects.get(name=project_name)
-            project_file = ProjectFile.objects.get(project=project, file_name=filename)
+            project = await Project.objects.aget(name=project_name)
+            project_file = await ProjectFile.objects.filter(project=project, file_name=filename).order_by('id').afirst()
+            if project_file is None:
+                return JsonResponse({'message': '文件不存在'}, status=404)
             file_path = project_file.local_path
-            if os.path.exists(file_path):
-                with open(file_path, 'rb') as file:
-                    content = file.read()
-                # 根据文件类型设置响应头
-                file_extension = os.path.splitext(filename)[1].lower()
-                if file_extension in ['.txt', '.csv']:
-                    content_type = 'text/plain'
-                elif file_extension in ['.pdf']:
-                    content_type = 'application/pdf'
-                elif file_extension in ['.jpg', '.jpeg', '.png']:
-                    content_type = f'image/{file_extension[1:]}'
-                elif file_extension in ['.wav', '.mp3']:
-                    content_type = f'audio/{file_extension[1:]}'
-                elif file_extension in ['.aac', '.mp4']:
-                    content_type = f'video/{file_extension[1:]}'
-                else:
-                    content_type = 'application/octet-stream'
+            try:
+                stat = await in_thread(os.stat)(file_path)
+            except FileNotFoundError:
+                return JsonResponse({'message': '文件不存在'}, status=404)
 
-                response = HttpResponse(content, content_type=content_type)
-                response['Content-Disposition'] = f'inline; filename={filename}'
+            etag = file_etag(stat)
+            # If-None-Match / If-Modified-Since 命中时直接返回 304
+            response = get_conditional_response(request, etag=etag, last_modified=int(stat.st_mtime))
+            if response is not None:
                 return response
+
+            content_type = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+            byte_range = None
+            if_range = request.headers.get('If-Range')
+            # If-Range 与当前版本不一致时忽略 Range，返回完整内容
+            if not if_range or if_range in (etag, http_date(stat.st_mtime)):
+                try:
+                    byte_range = parse_range(request.headers.get('Range'), stat.st_size)
+                except ValueError:
+                    response = HttpResponse(status=416)
+                    response['Content-Range'] = f'bytes */{stat.st_size}'
+                    return response
+
+            if byte_range is None:
+                response = file_response(request, file_path, 0, stat.st_size, content_type)
             else:
-                return JsonResponse({'message': '文件不存在'}, status=404)
+                start, end = byte_range
+                response = file_response(request, file_path, start, end - start + 1, content_type, status=206)
+                response['Content-Range'] = f'bytes {start}-{end}/{stat.st_size}'
+            response['Accept-Ranges'] = 'bytes'
+            response['ETag'] = etag
+            response['Last-Modified'] = http_date(stat.st_mtime)
+            response['Content-Disposition'] = content_disposition_header(False, filename)
+            return response
         except Project.DoesNotExist:
             return JsonResponse({'message': '项目不存在'}, status=404)
-        except ProjectFile.DoesNotExist:
-            return JsonResponse({'message': '文件不存在'}, status=404)
-    return JsonResponse({'message': '无效的请求方法'}, status=400)
\ No newline at end of file
+    return JsonResponse({'message': '无效的请求方法'}, status=400)
+
+@csrf_exempt
+def get_inference_status(request):
+    # 推理服务各任务的批处理统计，用于观察凑批效果
+    if request.method != 'GET':
+        return JsonResponse({'message': '无效的请求方法'}, status=400)
+    client = inference_client()
+    if client is None:
+        return JsonResponse({'message': '未配置推理服务'}, status=404)
+    try:
+        return JsonResponse({'tasks': client.stats()})
+    except (OSError, EOFError):
+        return JsonResponse({'message': '推理服务不可用'}, status=503)
\ No newline at end of file
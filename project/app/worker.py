@@ -0,0 +1,579 @@
+# 后台处理：认领待处理的 ProjectFile，按项目类型分发到对应的算法流水线
+import functools
+import json
+import os
+import textwrap
+import time
+import types
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from datetime import timedelta
+from importlib import import_module
+
+from django.conf import settings
+from django.db import connections, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from algorithm import InferenceBackend
+from algorithm.InferenceServer import InferenceClient
+from algorithm.ModelRegistry import registry
+from algorithm.ResultCache import ResultCache
+from .models import ProjectFile
+from .storage import file_sha256
+
+# 项目类型 -> 算法模块，模块导入时只注册模型，不会加载
+ALGORITHM_MODULES = {
+    'text': 'algorithm.PDFProcess',
+    'image': 'algorithm.ImageProcess',
+    'audio': 'algorithm.AudioProcess',
+    'video': 'algorithm.VideoProcess',
+}
+
+
+# 按文件整体处理、无法与其他请求合批的类型，配置了推理服务时也在本进程加载模型，保持多进程并行
+LOCAL_TYPES = ('text', 'video')
+
+
+@functools.lru_cache(maxsize=None)
+def inference_client():
+    """
+    配置了推理服务时返回客户端，模型由推理服务统一加载，本进程不再加载模型
+    :return: InferenceClient，未配置时返回 None
+    """
+    if not settings.INFERENCE_SERVER_ADDRESS:
+        return None
+    return InferenceClient(settings.INFERENCE_SERVER_ADDRESS, settings.INFERENCE_SERVER_AUTHKEY.encode())
+
+
+def _init_worker(project_type):
+    """
+    工作进程初始化：预加载对应类型的模型，之后该进程处理的所有文件共用；使用推理服务时不加载
+    :param project_type: 项目类型（text / image / audio / video）
+    """
+    if settings.MODEL_REGISTRY_MAX_MEMORY:
+        registry.max_memory = settings.MODEL_REGISTRY_MAX_MEMORY
+    InferenceBackend.config.update(
+        backend=settings.INFERENCE_BACKEND,
+        intra_op_threads=settings.INFERENCE_INTRA_OP_THREADS,
+        inter_op_threads=settings.INFERENCE_INTER_OP_THREADS,
+    )
+    module = import_module(ALGORITHM_MODULES[project_type])
+    if project_type == 'text' and settings.PDF_PAGE_WORKERS > 1:
+        # PDF 按页分片到常驻的 PDF 进程池处理，模型只在池中的进程加载
+        return
+    if project_type in LOCAL_TYPES or inference_client() is None:
+        registry.preload(*module.MODEL_NAMES)
+
+
+# 以下推理函数在配置了推理服务时调用服务，否则使用本进程加载的模型
+def classify(images):
+    client = inference_client()
+    if client:
+        return client.classify(images)
+    from algorithm import ImageProcess
+    return ImageProcess.classify_images(registry.get('resnet50'), images, batch_size=settings.IMAGE_BATCH_SIZE)
+
+
+def detect(images):
+    client = inference_client()
+    if client:
+        return client.detect(images)
+    from algorithm import ImageProcess
+    model = registry.get('yolov8m')
+    return [
+        None if detections is None else ImageProcess.detection_records(detections, model.names)
+        for detections in ImageProcess.detect_objects(model, images, batch_size=settings.IMAGE_BATCH_SIZE)
+    ]
+
+
+def image_result(top_k, detections):
+    # 单个文件和批量处理写入相同结构的 result.json
+    if top_k is None or detections is None:
+        return None
+    return {
+        'label': top_k[0]['label'],
+        'top_k': top_k,
+        'detections': detections,
+    }
+
+
+def recognize_images(file_paths):
+    """
+    对一组图像做分类和目标检测，按 IMAGE_BATCH_SIZE 分批：每张图像只解码一次，解码结果同时送入两个模型
+    使用推理服务时传递路径，由推理服务读取图像，避免通过 socket 传输解码后的像素
+    :return: 与 file_paths 等长的结果列表，无法读取的图像为 None
+    """
+    client = inference_client()
+    if client:
+        return [image_result(*pair) for pair in zip(client.classify(file_paths), client.detect(file_paths))]
+    from algorithm import ImageProcess
+    results = []
+    with ThreadPoolExecutor() as executor:
+        for start in range(0, len(file_paths), settings.IMAGE_BATCH_SIZE):
+            batch = file_paths[start:start + settings.IMAGE_BATCH_SIZE]
+            images = list(executor.map(ImageProcess.load_detect_image, batch))
+            valid = [image for image in images if image is not None]
+            pairs = zip(classify(valid), detect(valid)) if valid else iter(())
+            results.extend(None if image is None else image_result(*next(pairs)) for image in images)
+    return results
+
+
+def transcribe(audios):
+    client = inference_client()
+    if client:
+        return client.transcribe(audios)
+    from algorithm import AudioProcess
+    return AudioProcess.transcribe_batch(registry.get('whisper'), audios, batch_size=settings.WHISPER_BATCH_SIZE)
+
+
+def transcribe_long(file_path):
+    client = inference_client()
+    if client:
+        return client.call('transcribe_long', [(file_path, settings.WHISPER_BATCH_SIZE)])[0]
+    from algorithm import AudioProcess
+    return AudioProcess.transcribe_long(registry.get('whisper'), file_path, batch_size=settings.WHISPER_BATCH_SIZE)
+
+
+def process_text(file_path, output_dir):
+    # 目前只有 PDF 需要模型处理，其余文本文件直接视为处理完成
+    if os.path.splitext(file_path)[1].lower() != '.pdf':
+        return None
+    # 插图保存到该文件的结果目录，PDF 进程池中的进程也按该目录保存
+    options = {'dpi': settings.PDF_DPI, 'batch_size': settings.PDF_BATCH_SIZE, 'output_dir': output_dir}
+    from algorithm import PDFProcess
+    if settings.PDF_PAGE_WORKERS > 1:
+        # 长文档按页分片到多个进程并行处理
+        return PDFProcess.process_pdf_parallel(
+            file_path, workers=settings.PDF_PAGE_WORKERS, pages_per_task=settings.PDF_PAGES_PER_TASK, **options
+        )
+    # 逐页处理并逐页写出，内存占用与页数无关
+    return PDFProcess.process_pdf_stream(file_path, **options)
+
+
+def process_image(file_path, output_dir):
+    result = recognize_images([file_path])[0]
+    if result is None:
+        raise ValueError('无法读取图像')
+    return result
+
+
+def process_audio(file_path, output_dir):
+    import librosa
+    from algorithm import AudioProcess
+    # 超过 Whisper 单个窗口长度的音频走分段识别，否则会被截断
+    if librosa.get_duration(path=file_path) > AudioProcess.WHISPER_WINDOW_SECONDS:
+        return transcribe_long(file_path)
+    audio = AudioProcess.preprocess_audio(file_path)
+    return {'transcription': transcribe([audio])[0]}
+
+
+def process_video(file_path, output_dir):
+    from algorithm import VideoProcess
+    frames_folder = os.path.join(output_dir, 'frames')
+    options = {
+        'sample_fps': settings.VIDEO_SAMPLE_FPS,
+        'output_format': settings.VIDEO_FRAME_FORMAT,
+        'adaptive': settings.VIDEO_ADAPTIVE_SAMPLING,
+    }
+    # 抽取的帧一边保存一边送入动作识别，视频只解码一次
+    return {
+        'frames_folder': frames_folder,
+        'recognition': VideoProcess.analyze_video(file_path, frames_folder, **options),
+    }
+
+
+def process_audio_batch(jobs):
+    """
+    批量处理一组音频文件：短音频预处理后合批识别，长音频逐个分段识别，结果分别写入各自的结果目录
+    :param jobs: [(file_id, file_path, output_dir)]
+    :return: {file_id: 错误信息}，成功的文件不在其中
+    """
+    import librosa
+    from algorithm import AudioProcess
+    results = {}
+    errors = {}
+    short_clips = []
+    for file_id, file_path, _ in jobs:
+        try:
+            if librosa.get_duration(path=file_path) > AudioProcess.WHISPER_WINDOW_SECONDS:
+                results[file_id] = transcribe_long(file_path)
+            else:
+                short_clips.append((file_id, AudioProcess.preprocess_audio(file_path)))
+        except Exception as e:
+            errors[file_id] = str(e)
+
+    if short_clips:
+        transcriptions = transcribe([audio for _, audio in short_clips])
+        for (file_id, _), transcription in zip(short_clips, transcriptions):
+            results[file_id] = {'transcription': transcription}
+
+    for file_id, _, output_dir in jobs:
+        if file_id in results:
+            os.makedirs(output_dir, exist_ok=True)
+            write_json(results[file_id], os.path.join(output_dir, 'result.json'))
+    return errors
+
+
+def process_image_batch(jobs):
+    """
+    批量处理一组图像：分类和目标检测都按批推理，结果分别写入各自的结果目录
+    :param jobs: [(file_id, file_path, output_dir)]
+    :return: {file_id: 错误信息}
+    """
+    results = recognize_images([file_path for _, file_path, _ in jobs])
+    errors = {}
+    for (file_id, file_path, output_dir), result in zip(jobs, results):
+        if result is None:
+            errors[file_id] = '无法读取图像'
+            continue
+        os.makedirs(output_dir, exist_ok=True)
+        write_json(result, os.path.join(output_dir, 'result.json'))
+    return errors
+
+
+# 项目类型 -> 处理流水线
+PIPELINES = {
+    'text': process_text,
+    'image': process_image,
+    'audio': process_audio,
+    'video': process_video,
+}
+
+
+# 支持一次处理多个文件的类型 -> 批量流水线，批大小见 settings.PROCESSING_BATCH_SIZE
+BATCH_PIPELINES = {
+    'image': process_image_batch,
+    'audio': process_audio_batch,
+}
+
+
+def _to_builtin(value):
+    # json.dump 无法直接序列化 numpy 数组和标量
+    if hasattr(value, 'tolist'):
+        return value.tolist()
+    return str(value)
+
+
+def write_json(result, path):
+    """
+    写出 JSON 结果；流水线返回生成器时逐项写入，不在内存中汇总
+    """
+    with open(path, 'w', encoding='utf-8') as f:
+        if not isinstance(result, types.GeneratorType):
+            json.dump(result, f, ensure_ascii=False, indent=4, default=_to_builtin)
+            return
+        f.write('[')
+        count = 0
+        for item in result:
+            item_output = json.dumps(item, ensure_ascii=False, indent=4, default=_to_builtin)
+            f.write((',' if count else '') + '\n' + textwrap.indent(item_output, '    '))
+            count += 1
+        f.write('\n]' if count else ']')
+
+
+# 结果目录中还有中间产物的类型（PDF 的插图裁剪、视频抽帧）：整个结果目录作为一个缓存项，
+# result.json 中指向产物的绝对路径在命中时改写为新文件的结果目录；其他类型只缓存 result.json
+DIRECTORY_CACHE_TYPES = ('text', 'video')
+
+
+# 各类型影响处理结果的参数，参数变化后缓存的结果不再使用
+def pipeline_params(project_type):
+    params = {
+        'text': {'dpi': settings.PDF_DPI},
+        'video': {
+            'sample_fps': settings.VIDEO_SAMPLE_FPS,
+            'frame_format': settings.VIDEO_FRAME_FORMAT,
+            'adaptive': settings.VIDEO_ADAPTIVE_SAMPLING,
+        },
+    }
+    # 不同推理后端（尤其是 INT8 量化）的结果可能略有差异，分别缓存
+    return {'backend': settings.INFERENCE_BACKEND, **params.get(project_type, {})}
+
+
+@functools.lru_cache(maxsize=None)
+def get_result_cache():
+    if not settings.RESULT_CACHE_ENABLED:
+        return None
+    return ResultCache(settings.RESULT_CACHE_ROOT, settings.RESULT_CACHE_MAX_SIZE)
+
+
+def cache_key(project_type, file_path, content_hash=None):
+    """
+    结果缓存键：文件内容哈希 + 该类型用到的模型指纹 + 处理参数
+    :return: 缓存键，未启用缓存时返回 None
+    """
+    if get_result_cache() is None:
+        return None
+    module = import_module(ALGORITHM_MODULES[project_type])
+    models = {name: registry.fingerprint(name) for name in module.MODEL_NAMES}
+    return ResultCache.key(content_hash or file_sha256(file_path), models, pipeline_params(project_type))
+
+
+def load_cached_result(project_type, key, output_dir):
+    """
+    命中时把缓存的结果复制到 output_dir
+    :return: 是否命中
+    """
+    if project_type in DIRECTORY_CACHE_TYPES:
+        return get_result_cache().get_dir(project_type, key, output_dir)
+    return get_result_cache().get_file(project_type, key, os.path.join(output_dir, 'result.json'))
+
+
+def store_cached_result(project_type, key, output_dir):
+    if project_type in DIRECTORY_CACHE_TYPES:
+        get_result_cache().put_dir(project_type, key, output_dir)
+    else:
+        get_result_cache().put_file(project_type, key, os.path.join(output_dir, 'result.json'))
+
+
+def mark_running(file_ids):
+    # 工作进程真正开始处理时记录，与只是在进程池队列中等待的已认领文件区分开
+    now = timezone.now()
+    ProjectFile.objects.filter(id__in=file_ids).update(
+        status=ProjectFile.Status.RUNNING, started_at=now, heartbeat_at=now
+    )
+
+
+def run_pipeline(project_type, file_path, output_dir, content_hash=None, file_id=None):
+    """
+    在工作进程中处理单个文件，结果写入 output_dir/result.json；内容、模型和参数都没有变化时直接使用缓存的结果
+    :param project_type: 项目类型
+    :param file_path: 待处理文件路径
+    :param output_dir: 该文件的结果目录
+    :param content_hash: 文件内容的 sha256，为 None 时现场计算
+    :param file_id: 对应的 ProjectFile id，用于记录开始处理的时间
+    :return: 结果文件路径
+    """
+    if file_id is not None:
+        mark_running([file_id])
+    os.makedirs(output_dir, exist_ok=True)
+    result_path = os.path.join(output_dir, 'result.json')
+    key = cache_key(project_type, file_path, content_hash)
+    if key and load_cached_result(project_type, key, output_dir):
+        return result_path
+    result = PIPELINES[project_type](file_path, output_dir)
+    write_json(result, result_path)
+    if key:
+        store_cached_result(project_type, key, output_dir)
+    return result_path
+
+
+def run_batch_pipeline(project_type, jobs, content_hashes=None):
+    """
+    在工作进程中批量处理多个文件，命中缓存的文件不再送入流水线
+    :param jobs: [(file_id, file_path, output_dir)]
+    :param content_hashes: 与 jobs 对应的文件内容哈希
+    :return: {file_id: 错误信息}
+    """
+    mark_running([file_id for file_id, _, _ in jobs])
+    content_hashes = content_hashes or [None] * len(jobs)
+    pending = []
+    errors = {}
+    for job, content_hash in zip(jobs, content_hashes):
+        file_id, file_path, output_dir = job
+        try:
+            key = cache_key(project_type, file_path, content_hash)
+        except OSError as e:
+            # 文件无法读取时只记录该文件失败，不影响同批其他文件
+            errors[file_id] = str(e)
+            continue
+        os.makedirs(output_dir, exist_ok=True)
+        if key and load_cached_result(project_type, key, output_dir):
+            continue
+        pending.append((job, key))
+    if not pending:
+        return errors
+    errors.update(BATCH_PIPELINES[project_type]([job for job, _ in pending]))
+    for (file_id, _, output_dir), key in pending:
+        if key and file_id not in errors:
+            store_cached_result(project_type, key, output_dir)
+    return errors
+
+
+class Scheduler:
+    """
+    基于数据库的任务调度器：轮询待处理文件，原子地认领后提交到对应类型的进程池
+    """
+
+    def __init__(self, concurrency=None, poll_interval=None):
+        self.concurrency = dict(settings.PROCESSING_CONCURRENCY)
+        self.concurrency.update(concurrency or {})
+        self.poll_interval = poll_interval or settings.PROCESSING_POLL_INTERVAL
+        self.batch_sizes = dict(settings.PROCESSING_BATCH_SIZE)
+        self.max_attempts = settings.PROCESSING_MAX_ATTEMPTS
+        self.lease_timeout = settings.PROCESSING_LEASE_TIMEOUT
+        self.executors = {}
+        # future -> ([file_id, ...], project_type)
+        self.inflight = {}
+
+    def _executor(self, project_type):
+        if project_type not in self.executors:
+            self.executors[project_type] = ProcessPoolExecutor(
+                max_workers=self.concurrency[project_type],
+                initializer=_init_worker,
+                initargs=(project_type,),
+            )
+        return self.executors[project_type]
+
+    def inflight_ids(self):
+        return [file_id for file_ids, _ in self.inflight.values() for file_id in file_ids]
+
+    def heartbeat(self):
+        """
+        刷新本调度器已认领和处理中文件的心跳，处理时间再长也不会被其他调度器回收
+        """
+        own = self.inflight_ids()
+        if own:
+            ProjectFile.objects.filter(
+                id__in=own, status__in=[ProjectFile.Status.CLAIMED, ProjectFile.Status.RUNNING]
+            ).update(heartbeat_at=timezone.now())
+
+    def reclaim_stale(self, project_type):
+        """
+        回收超时的认领：调度器被强制结束时，已认领和处理中的文件不会再刷新心跳；
+        心跳超过 lease_timeout 未刷新的文件重新排队，认领次数达到 max_attempts 的标记为失败
+        本调度器仍在处理的文件不回收
+        :return: 回收的文件数
+        """
+        deadline = timezone.now() - timedelta(seconds=self.lease_timeout)
+        stale = (
+            ProjectFile.objects
+            .filter(project__type=project_type)
+            .filter(status__in=[ProjectFile.Status.CLAIMED, ProjectFile.Status.RUNNING], heartbeat_at__lt=deadline)
+            .exclude(id__in=self.inflight_ids())
+        )
+        error = '处理超时，调度器可能已退出'
+        requeued = stale.filter(attempts__lt=self.max_attempts).update(status=ProjectFile.Status.PENDING, error=error)
+        failed = stale.filter(attempts__gte=self.max_attempts).update(
+            status=ProjectFile.Status.FAILED, error=error, processed_at=timezone.now()
+        )
+        if requeued or failed:
+            print(f'回收超时的 {project_type} 文件: {requeued} 个重新排队, {failed} 个标记为失败')
+        return requeued + failed
+
+    def claim(self, project_type, limit):
+        """
+        认领最多 limit 个待处理文件并标记为已认领，多个调度器并行运行时不会重复认领
+        按 (status, id) 索引取最早的待处理文件，不需要扫描整张表；认领前先回收超时的认领
+        """
+        self.reclaim_stale(project_type)
+        with transaction.atomic():
+            ids = list(
+                ProjectFile.objects.select_for_update(skip_locked=True, of=('self',))
+                .filter(status=ProjectFile.Status.PENDING, project__type=project_type)
+                .order_by('id')
+                .values_list('id', flat=True)[:limit]
+            )
+            now = timezone.now()
+            ProjectFile.objects.filter(id__in=ids).update(
+                status=ProjectFile.Status.CLAIMED, claimed_at=now, heartbeat_at=now, attempts=F('attempts') + 1
+            )
+        return list(
+            ProjectFile.objects.filter(id__in=ids)
+            .values('id', 'file_name', 'local_path', 'project__name', 'blob__sha256')
+        )
+
+    def submit(self):
+        """
+        为每种类型补充任务，使进程池保持忙碌，返回本轮提交的文件数
+        """
+        submitted = 0
+        for project_type, workers in self.concurrency.items():
+            if workers <= 0:
+                continue
+            running = sum(1 for t in self.inflight.values() if t[1] == project_type)
+            # 每个进程预取一个任务，避免进程空等下一轮轮询
+            free = workers * 2 - running
+            if free <= 0:
+                continue
+            batch_size = self.batch_sizes.get(project_type, 1) if project_type in BATCH_PIPELINES else 1
+            rows = self.claim(project_type, free * batch_size)
+            if not rows:
+                continue
+            # 进程池以 fork 方式创建子进程，先关闭数据库连接，避免子进程继承连接
+            connections.close_all()
+            executor = self._executor(project_type)
+            for i in range(0, len(rows), batch_size):
+                batch = rows[i:i + batch_size]
+                jobs = [
+                    (row['id'], row['local_path'],
+                     os.path.join(settings.RESULT_ROOT, row['project__name'], row['file_name']))
+                    for row in batch
+                ]
+                content_hashes = [row['blob__sha256'] for row in batch]
+                if batch_size > 1:
+                    future = executor.submit(run_batch_pipeline, project_type, jobs, content_hashes)
+                else:
+                    future = executor.submit(
+                        run_pipeline, project_type, jobs[0][1], jobs[0][2], content_hashes[0], jobs[0][0]
+                    )
+                self.inflight[future] = ([row['id'] for row in batch], project_type)
+            submitted += len(rows)
+        return submitted
+
+    def finish(self, future):
+        """
+        根据任务结果更新文件状态，批量任务中各文件单独记录成功或失败；
+        失败次数未达到 max_attempts 的文件重新排队
+        :return: 失败的文件 id 列表
+        """
+        file_ids, project_type = self.inflight.pop(future)
+        try:
+            result = future.result()
+            # 批量任务返回 {file_id: 错误信息}，单个任务返回结果文件路径
+            errors = result if isinstance(result, dict) else {}
+        except BrokenProcessPool:
+            # 子进程异常退出（如内存不足），重建该类型的进程池
+            self.executors.pop(project_type, None)
+            errors = dict.fromkeys(file_ids, '工作进程异常退出')
+        except Exception as e:
+            errors = dict.fromkeys(file_ids, str(e))
+        for file_id, error in errors.items():
+            print(f'文件 {file_id} 处理失败: {error}')
+        failed = [file_id for file_id in file_ids if file_id in errors]
+        succeeded = [file_id for file_id in file_ids if file_id not in errors]
+        now = timezone.now()
+        for file_id in failed:
+            ProjectFile.objects.filter(id=file_id, attempts__lt=self.max_attempts).update(
+                status=ProjectFile.Status.PENDING, error=errors[file_id]
+            )
+            ProjectFile.objects.filter(id=file_id, attempts__gte=self.max_attempts).update(
+                status=ProjectFile.Status.FAILED, error=errors[file_id], processed_at=now
+            )
+        ProjectFile.objects.filter(id__in=succeeded).update(status=ProjectFile.Status.DONE, error='', processed_at=now)
+        return failed
+
+    def run(self, once=False):
+        """
+        调度主循环
+        :param once: 为 True 时处理完当前所有待处理文件后退出
+        """
+        try:
+            while True:
+                self.heartbeat()
+                self.submit()
+                if not self.inflight:
+                    if once:
+                        break
+                    time.sleep(self.poll_interval)
+                    continue
+                done, _ = wait(list(self.inflight), timeout=self.poll_interval, return_when=FIRST_COMPLETED)
+                for future in done:
+                    self.finish(future)
+        finally:
+            for executor in self.executors.values():
+                executor.shutdown(wait=True, cancel_futures=True)
+            self.drain()
+
+    def drain(self):
+        """
+        退出时处理剩余任务：已结束（成功或失败）的任务照常记录结果；
+        被取消或未开始的文件放回队列，下次启动重新处理，本次认领不计入失败次数
+        """
+        for future in [future for future in self.inflight if future.done() and not future.cancelled()]:
+            self.finish(future)
+        ProjectFile.objects.filter(id__in=self.inflight_ids()).update(
+            status=ProjectFile.Status.PENDING, attempts=F('attempts') - 1
+        )
+        self.inflight.clear()
@@ -13,4 +13,6 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "project.settings")
 
+# 上传、列表和文件内容接口为异步视图，部署时使用 ASGI 服务器，例如：
+# uvicorn project.asgi:application --workers 4
 application = get_asgi_application()
@@ -132,4 +132,80 @@ STATIC_URL = "static/"
 DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
 
 MEDIA_URL = '/media/'
-MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
\ No newline at end of file
+MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
+
+# 上传文件按内容哈希存储的目录
+BLOB_ROOT = os.path.join(MEDIA_ROOT, 'blobs')
+
+# 断点续传会话在最近一次上传分块后保留的时间（秒），过期的会话和临时文件由 expire_uploads 命令删除
+UPLOAD_SESSION_TTL = 24 * 60 * 60
+
+# 批量导入压缩包时每个事务登记的文件数
+INGEST_BATCH_SIZE = 1000
+
+# 处理结果输出目录
+RESULT_ROOT = os.path.join(BASE_DIR, 'results')
+
+# 声学特征存储目录，按文件哈希和特征参数保存 .npy 文件
+FEATURE_ROOT = os.path.join(BASE_DIR, 'features')
+
+# 处理结果缓存：按文件内容哈希、模型版本和处理参数复用已有结果；PDF 和视频连同插图、抽帧等中间产物一起缓存
+RESULT_CACHE_ENABLED = True
+RESULT_CACHE_ROOT = os.path.join(BASE_DIR, 'cache')
+# 缓存总大小上限（字节），超出时淘汰最久未使用的结果，None 表示不限制
+RESULT_CACHE_MAX_SIZE = 10 * 1024 ** 3
+
+# 后台处理：每种项目类型的并发进程数
+PROCESSING_CONCURRENCY = {
+    'text': 2,
+    'image': 2,
+    'audio': 1,
+    'video': 1,
+}
+# 后台处理：轮询待处理文件的间隔（秒）
+PROCESSING_POLL_INTERVAL = 2
+# 每个文件最多处理的次数，失败后未达到该次数时重新排队，1 表示不重试
+PROCESSING_MAX_ATTEMPTS = 1
+# 调度器每次轮询时刷新已认领和处理中文件的心跳；心跳超过该时间（秒）未刷新时视为调度器已退出，
+# 文件重新排队或达到最多次数后标记为失败。与单个文件的处理时长无关，应明显大于轮询间隔
+PROCESSING_LEASE_TIMEOUT = 5 * 60
+# 支持批量处理的类型每个任务包含的文件数
+PROCESSING_BATCH_SIZE = {'image': 64, 'audio': 16}
+# PDF 页面渲染分辨率（DPI）
+PDF_DPI = 144
+# PDF 布局检测每批页数
+PDF_BATCH_SIZE = 8
+# 单个 PDF 按页并行处理的进程数，1 表示在当前工作进程内顺序处理
+PDF_PAGE_WORKERS = 1
+# 并行处理时每个分片的页数
+PDF_PAGES_PER_TASK = 16
+# Whisper 每次 generate 的音频段数（长音频为 30 秒窗口数）
+WHISPER_BATCH_SIZE = 8
+# 图像分类每批图像数
+IMAGE_BATCH_SIZE = 32
+# 视频每秒抽取的帧数，None 表示每 4 帧取一帧
+VIDEO_SAMPLE_FPS = None
+# 抽取帧的保存格式：npy 为单个数组文件，jpg / png 为逐帧图片
+VIDEO_FRAME_FORMAT = 'npy'
+# 按画面变化自适应抽帧，None 表示按固定间隔抽帧；
+# 例如 {'threshold': 0.08, 'max_fps': 4, 'min_fps': 0.1}：差异阈值、每秒最多和最少保留的帧数
+VIDEO_ADAPTIVE_SAMPLING = None
+# 每个工作进程的模型内存预算（字节），超出时按最近最少使用卸载模型，None 表示不限制
+MODEL_REGISTRY_MAX_MEMORY = None
+# 推理后端：torch 为 PyTorch 原生推理，onnx 为 ONNX Runtime，onnx-int8 为 ONNX Runtime + 动态 INT8 量化
+INFERENCE_BACKEND = 'torch'
+# ONNX Runtime 算子内并行线程数，None 表示使用全部核心；多进程时建议设为 CPU 核数 / 进程数
+# 只作用于分类模型和 Whisper；YOLO 检测和布局模型由 ultralytics 创建会话，不读取这两项
+INFERENCE_INTRA_OP_THREADS = None
+# ONNX Runtime 算子间并行线程数
+INFERENCE_INTER_OP_THREADS = 1
+# 推理服务地址：Unix socket 路径（如 '/tmp/datagov-inference.sock'）或 ('127.0.0.1', 6100)，
+# 配置后后台工作进程和视图都通过推理服务调用模型，自身不再加载模型；None 表示各进程自行加载
+# PDF 和视频无法合批，始终在后台工作进程中处理
+INFERENCE_SERVER_ADDRESS = None
+# 推理服务连接认证密钥
+INFERENCE_SERVER_AUTHKEY = SECRET_KEY
+# 推理服务凑批的最长等待时间（秒）
+INFERENCE_SERVER_MAX_LATENCY = 0.01
+# 推理服务单个请求等待结果的最长时间（秒），超时后向客户端返回错误
+INFERENCE_SERVER_TIMEOUT = 600
\ No newline at end of file